@@ -1,10 +1,38 @@
 from fraudcrawler.scraping.serp import SerpApi
 from fraudcrawler.scraping.enrich import Enricher
 from fraudcrawler.scraping.zyte import ZyteApi
-from fraudcrawler.processing.processor import Processor
+from fraudcrawler.processing.processor import Cascade, Processor
+from fraudcrawler.processing.local import LocalClassifierTier
+from fraudcrawler.processing.batch import (
+    BatchClassifier,
+    LocalBatchBackend,
+    OpenAIBatchBackend,
+)
+from fraudcrawler.processing.snippet import (
+    KeywordSnippetFilter,
+    LLMSnippetFilter,
+    SnippetFilter,
+)
 from fraudcrawler.base.orchestrator import Orchestrator, ProductItem
 from fraudcrawler.base.client import FraudCrawlerClient
+from fraudcrawler.base.service import CrawlerService, JobRequest
+from fraudcrawler.base.cache import Cache, DiskCache, MemoryCache
+from fraudcrawler.base.autoscale import Autoscaling
+from fraudcrawler.base.backends import (
+    DedupIndex,
+    MemoryDedupIndex,
+    MemoryQueueBackend,
+    MemoryRateBudget,
+    QueueBackend,
+    RateBudget,
+    SQLiteDedupIndex,
+    SQLiteQueueBackend,
+    SQLiteRateBudget,
+)
+from fraudcrawler.base.domains import DomainPolicy, DomainStatsStore
+from fraudcrawler.base.keys import KeyPool
 from fraudcrawler.base.base import (
+    AdaptiveDepth,
     Deepness,
     Enrichment,
     Host,
@@ -18,9 +46,36 @@ __all__ = [
     "Enricher",
     "ZyteApi",
     "Processor",
+    "Cascade",
+    "LocalClassifierTier",
+    "BatchClassifier",
+    "OpenAIBatchBackend",
+    "LocalBatchBackend",
+    "SnippetFilter",
+    "KeywordSnippetFilter",
+    "LLMSnippetFilter",
     "Orchestrator",
     "ProductItem",
     "FraudCrawlerClient",
+    "CrawlerService",
+    "JobRequest",
+    "Cache",
+    "DiskCache",
+    "MemoryCache",
+    "Autoscaling",
+    "QueueBackend",
+    "MemoryQueueBackend",
+    "SQLiteQueueBackend",
+    "DedupIndex",
+    "MemoryDedupIndex",
+    "SQLiteDedupIndex",
+    "RateBudget",
+    "MemoryRateBudget",
+    "SQLiteRateBudget",
+    "DomainPolicy",
+    "DomainStatsStore",
+    "KeyPool",
+    "AdaptiveDepth",
     "Language",
     "Location",
     "Host",
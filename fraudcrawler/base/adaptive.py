@@ -0,0 +1,142 @@
+import asyncio
+import logging
+from pydantic import BaseModel
+from typing import Dict
+
+from fraudcrawler.base.base import AdaptiveDepth
+
+logger = logging.getLogger(__name__)
+
+
+class TermState(BaseModel):
+    """Model for the progress of a search_term in the adaptive depth mode."""
+
+    item: dict
+    start: int = 0
+    n_requested: int = 0
+    n_pending: int = 0
+    fetching: bool = True
+    n_classified: int = 0
+    n_relevant: int = 0
+    last_page_full: bool = False
+
+    @property
+    def relevance_yield(self) -> float:
+        """The share of relevant products among the classified ones."""
+        return self.n_relevant / self.n_classified if self.n_classified else 0.0
+
+
+class AdaptiveDepthTracker:
+    """Decides per search_term whether to fetch a further SERP page based on its running relevance yield.
+
+    A search_term is active from its first serp item until all products of its last SERP page are
+    finished. At that point the next page is requested if the page was full, the share of relevant
+    products (among the classified ones) is at least `min_yield` and `max_results` is not reached;
+    otherwise the search_term is stopped early. Once all search_terms are added (c.f. func:`close`)
+    and none is active anymore, the event `done` is set.
+    """
+
+    def __init__(self, config: AdaptiveDepth):
+        """Initializes the tracker.
+
+        Args:
+            config: The adaptive depth configuration.
+        """
+        self._config = config
+        self._terms: Dict[str, TermState] = {}
+        self._closed = False
+        self.done = asyncio.Event()
+        self.n_pages = 0
+        self.n_stopped_early = 0
+
+    @property
+    def n_active(self) -> int:
+        """The number of search_terms with pending serp items or products."""
+        return sum(st.fetching or st.n_pending > 0 for st in self._terms.values())
+
+    def add_term(self, item: dict) -> None:
+        """Registers the first serp item of a search_term.
+
+        Args:
+            item: The serp item (c.f. func:`Orchestrator._add_serp_items_for_search_term`).
+        """
+        self._terms[item["search_term"]] = TermState(
+            item=dict(item), n_requested=item["num_results"]
+        )
+
+    def close(self) -> None:
+        """Signals that all search_terms are added."""
+        self._closed = True
+        self._check_done()
+
+    def page_fetched(self, search_term: str, n_products: int) -> dict | None:
+        """Registers the number of products found on a SERP page of a search_term.
+
+        Must be called before the products are passed on (also with `n_products=0` if the search failed).
+        Returns the serp item of the next page if it is requested right away.
+
+        Args:
+            search_term: The search_term of the page.
+            n_products: The number of products found on the page.
+        """
+        state = self._terms.get(search_term)
+        if state is None:
+            return None
+        self.n_pages += 1
+        state.fetching = False
+        state.n_pending += n_products
+        state.last_page_full = n_products >= state.n_requested
+        return self._next(search_term=search_term, state=state)
+
+    def product_finished(
+        self, search_term: str, classified: bool, relevant: bool
+    ) -> dict | None:
+        """Registers a finished (processed or filtered) product of a search_term.
+
+        Returns the serp item of the next page if it is requested.
+
+        Args:
+            search_term: The search_term of the product.
+            classified: Whether the product was classified.
+            relevant: Whether the product was classified as relevant.
+        """
+        state = self._terms.get(search_term)
+        if state is None or state.n_pending == 0:
+            return None
+        state.n_pending -= 1
+        state.n_classified += int(classified)
+        state.n_relevant += int(classified and relevant)
+        return self._next(search_term=search_term, state=state)
+
+    def _next(self, search_term: str, state: TermState) -> dict | None:
+        """Returns the serp item of the next page once the current page is finished (if it is worth it)."""
+        if state.fetching or state.n_pending > 0:
+            return None
+
+        next_start = state.start + state.n_requested
+        num_results = min(self._config.page_size, self._config.max_results - next_start)
+        if (
+            state.last_page_full
+            and num_results > 0
+            and state.n_classified > 0
+            and state.relevance_yield >= self._config.min_yield
+        ):
+            state.start = next_start
+            state.n_requested = num_results
+            state.fetching = True
+            logger.debug(
+                f'Fetching next page for search_term="{search_term}" (start={next_start}, yield={state.relevance_yield:.2f})'
+            )
+            return {**state.item, "num_results": num_results, "start": next_start}
+
+        if state.last_page_full and num_results > 0:
+            self.n_stopped_early += 1
+            logger.debug(
+                f'Stopping search_term="{search_term}" early (yield={state.relevance_yield:.2f})'
+            )
+        self._check_done()
+        return None
+
+    def _check_done(self) -> None:
+        if self._closed and self.n_active == 0:
+            self.done.set()
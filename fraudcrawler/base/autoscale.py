@@ -0,0 +1,265 @@
+import asyncio
+import logging
+import math
+from pydantic import BaseModel
+import time
+from typing import Callable, Coroutine, Dict, List, Set
+
+from fraudcrawler.settings import (
+    AUTOSCALE_DEFAULT_INTERVAL,
+    AUTOSCALE_DEFAULT_DRAIN_TIME,
+    AUTOSCALE_DEFAULT_MAX_ERROR_RATE,
+    AUTOSCALE_EWMA_ALPHA,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class Autoscaling(BaseModel):
+    """Model for the autoscaling of the workers per stage.
+
+    The zyte and processor workers share the budget `max_total_wkrs` (if given), such that workers move
+    to whichever of the two stages is the current bottleneck.
+    """
+
+    min_wkrs: int = 1
+    max_serp_wkrs: int = 10
+    max_zyte_wkrs: int = 20
+    max_proc_wkrs: int = 20
+    max_total_wkrs: int | None = None
+    interval: float = AUTOSCALE_DEFAULT_INTERVAL
+    drain_time: float = AUTOSCALE_DEFAULT_DRAIN_TIME
+    max_error_rate: float = AUTOSCALE_DEFAULT_MAX_ERROR_RATE
+
+
+class StageStats:
+    """Running statistics of the calls of a pipeline stage (exponentially weighted moving averages)."""
+
+    def __init__(self, alpha: float = AUTOSCALE_EWMA_ALPHA):
+        """Initializes the statistics.
+
+        Args:
+            alpha: The weight of the latest call in the moving averages.
+        """
+        self._alpha = alpha
+        self.n_calls = 0
+        self.latency = 0.0
+        self.error_rate = 0.0
+
+    def record(self, start: float, error: bool = False) -> None:
+        """Records a call that started at `start` (c.f. func:`time.monotonic`).
+
+        Args:
+            start: The start time of the call.
+            error: Whether the call failed.
+        """
+        latency = time.monotonic() - start
+        alpha = self._alpha if self.n_calls else 1.0
+        self.latency = alpha * latency + (1 - alpha) * self.latency
+        self.error_rate = alpha * float(error) + (1 - alpha) * self.error_rate
+        self.n_calls += 1
+
+
+class WorkerPool:
+    """A pool of async workers consuming from the same queue; its size can change while it is running.
+
+    Every worker terminates once it consumes a `None` sentinel. A worker is retired by putting one
+    sentinel before all items of the queue (c.f. func:`PriorityQueue.put_first_nowait`), such that the
+    next worker done with its current item terminates; the pool is closed by putting one sentinel per
+    remaining worker after all items.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        queue: asyncio.Queue,
+        worker: Callable[[], Coroutine],
+        n_workers: int,
+        min_workers: int = 1,
+        max_workers: int | None = None,
+    ):
+        """Initializes the pool and starts `n_workers` workers.
+
+        Args:
+            name: The name of the pool (e.g. the stage).
+            queue: The queue the workers consume from.
+            worker: The function creating the coroutine of a worker.
+            n_workers: The initial number of workers.
+            min_workers: The minimal number of workers (optional).
+            max_workers: The maximal number of workers (optional).
+        """
+        self.name = name
+        self.queue = queue
+        self.min_workers = min_workers
+        self.max_workers = max_workers if max_workers is not None else n_workers
+        self._worker = worker
+        self._tasks: Set[asyncio.Task] = set()
+        self._n_retiring = 0
+        self._closing = False
+        # Set once a worker ended with an error
+        self.crashed = asyncio.Event()
+        for _ in range(n_workers):
+            self._start()
+
+    @property
+    def n_workers(self) -> int:
+        """The number of running workers (including the retired ones until they have finished)."""
+        return len(self._tasks)
+
+    @property
+    def n_retiring(self) -> int:
+        """The number of retired workers that have not finished yet."""
+        return self._n_retiring
+
+    def _start(self) -> None:
+        task = asyncio.create_task(self._worker())
+        self._tasks.add(task)
+        task.add_done_callback(self._on_done)
+
+    def _on_done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if task.cancelled():
+            return
+        if (exc := task.exception()) is not None:
+            # A pending retirement is left to the worker consuming its sentinel
+            logger.error(f"Error in {self.name} worker: {exc}")
+            self.crashed.set()
+        elif self._n_retiring > 0:
+            self._n_retiring -= 1
+
+    def add(self) -> bool:
+        """Starts an additional worker (if the maximum is not reached) and returns whether it did."""
+        if self._closing or self.n_workers >= self.max_workers:
+            return False
+        self._start()
+        logger.debug(f"Added {self.name} worker (#workers={self.n_workers})")
+        return True
+
+    def retire(self) -> bool:
+        """Retires a worker (if the minimum is not reached) and returns whether it did."""
+        if self._closing or self.n_workers - self._n_retiring <= self.min_workers:
+            return False
+        self._n_retiring += 1
+        # Queues without priorities only retire a worker once the items put before are consumed
+        put_first = getattr(self.queue, "put_first_nowait", self.queue.put_nowait)
+        put_first(None)
+        logger.debug(f"Retiring {self.name} worker (#workers={self.n_workers})")
+        return True
+
+    async def close(self) -> List[BaseException | None]:
+        """Sends the sentinels to all remaining workers and waits for them to conclude.
+
+        Returns the exceptions raised by the workers (`None` for workers concluding normally).
+        """
+        self._closing = True
+        for _ in range(self.n_workers - self._n_retiring):
+            await self.queue.put(None)
+        tasks = list(self._tasks)
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    def cancel(self) -> None:
+        """Cancels all workers (e.g. when the run is cancelled)."""
+        self._closing = True
+        for task in self._tasks:
+            task.cancel()
+
+
+class Autoscaler:
+    """Adds and retires workers of the worker pools based on their queue depth, call latency and error rate.
+
+    For every pool the number of workers needed to drain its queue within `drain_time` seconds is
+    estimated by `queue size * latency / drain_time`. Pools with a high error rate (e.g. rate limited
+    by the provider) are shrunk instead. The pools listed in `shared` compete for the budget
+    `max_total_wkrs`: a pool needing more workers takes them from the least loaded other pool.
+    """
+
+    def __init__(
+        self,
+        pools: Dict[str, WorkerPool],
+        stats: Dict[str, StageStats],
+        config: Autoscaling,
+        shared: List[str] | None = None,
+    ):
+        """Initializes the autoscaler.
+
+        Args:
+            pools: The worker pools by stage.
+            stats: The call statistics by stage.
+            config: The autoscaling configuration.
+            shared: The stages sharing the budget `config.max_total_wkrs` (optional).
+        """
+        self._pools = pools
+        self._stats = stats
+        self._config = config
+        self._shared = shared or []
+
+    def _target(self, name: str) -> int:
+        """Estimates the number of workers needed by a pool."""
+        pool = self._pools[name]
+        stats = self._stats.get(name)
+        backlog = pool.queue.qsize()
+        if stats is None or stats.n_calls == 0:
+            # Without measurements keep the workers busy with the backlog
+            return min(max(pool.n_workers, backlog), pool.max_workers)
+        needed = math.ceil(backlog * stats.latency / self._config.drain_time)
+        return min(max(needed, pool.min_workers), pool.max_workers)
+
+    def _load(self, name: str) -> float:
+        """The backlog per worker of a pool."""
+        pool = self._pools[name]
+        return pool.queue.qsize() / max(pool.n_workers, 1)
+
+    def _n_shared(self) -> int:
+        return sum(self._pools[n].n_workers for n in self._shared if n in self._pools)
+
+    def step(self) -> None:
+        """Adjusts the number of workers of every pool by at most one worker."""
+        budget = self._config.max_total_wkrs
+        for name, pool in self._pools.items():
+            if pool.n_retiring:
+                # Wait until the retired worker has finished its current item
+                continue
+            stats = self._stats.get(name)
+
+            # Back off when the provider returns errors (e.g. rate limits)
+            if stats is not None and stats.error_rate > self._config.max_error_rate:
+                if pool.retire():
+                    logger.info(
+                        f"Autoscaler retired a {name} worker due to error rate {stats.error_rate:.2f}"
+                    )
+                continue
+
+            target = self._target(name)
+            if target > pool.n_workers:
+                if name in self._shared and budget is not None:
+                    if self._n_shared() >= budget:
+                        if any(
+                            self._pools[n].n_retiring
+                            for n in self._shared
+                            if n in self._pools
+                        ):
+                            continue
+                        others = [
+                            n for n in self._shared if n != name and n in self._pools
+                        ]
+                        donor = min(others, key=self._load, default=None)
+                        if donor is None or self._load(donor) >= self._load(name):
+                            continue
+                        if not self._pools[donor].retire():
+                            continue
+                        # The worker is added once the retired one has finished (c.f. `n_workers`)
+                        logger.info(f"Autoscaler moves a worker from {donor} to {name}")
+                        continue
+                if pool.add():
+                    logger.debug(f"Autoscaler added a {name} worker (target={target})")
+            elif target < pool.n_workers and pool.queue.qsize() == 0:
+                if pool.retire():
+                    logger.debug(
+                        f"Autoscaler retired a {name} worker (target={target})"
+                    )
+
+    async def run(self) -> None:
+        """Runs the autoscaler until it is cancelled."""
+        while True:
+            await asyncio.sleep(self._config.interval)
+            self.step()
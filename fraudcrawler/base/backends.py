@@ -0,0 +1,555 @@
+from abc import ABC, abstractmethod
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import heapq
+import itertools
+import logging
+from pathlib import Path
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Set, Tuple, TypeVar
+import uuid
+
+from fraudcrawler.settings import QUEUE_DEFAULT_VISIBILITY_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+# A message reserved from a queue: (message id, payload)
+Message = Tuple[str, str]
+
+T = TypeVar("T")
+
+
+class _Backend:
+    """Base class of the backends, running their (blocking) calls without blocking the event loop."""
+
+    _executor: ThreadPoolExecutor | None = None
+
+    async def call(self, func: Callable[..., T], *args: Any) -> T:
+        """Calls a method of the backend from the event loop.
+
+        In-memory backends are called directly, the file based backends (possibly waiting for the locks
+        of the other processes) in a dedicated thread.
+        """
+        if self._executor is None:
+            return func(*args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(func, *args)
+        )
+
+
+class QueueBackend(_Backend, ABC):
+    """Abstract base class for the (shared) storage of the stage queues.
+
+    Abstract methods:
+        put: Adds a message to a queue.
+        get: Reserves the message with the highest priority of a queue.
+        ack: Removes a processed message.
+        nack: Releases a reserved message for redelivery.
+        extend: Extends the reservation of a message in process.
+        size: Returns the number of messages waiting in a queue.
+        pending: Returns the number of messages waiting in or reserved from a queue.
+        open: Registers a producer of a queue.
+        close: Unregisters a producer of a queue.
+        n_producers: Returns the number of registered producers of a queue.
+
+    A reserved message is invisible to the other consumers for `visibility_timeout` seconds; if it is
+    not acknowledged within this time (e.g. because its node crashed), it is delivered again. A queue
+    is exhausted once it has no pending messages and no registered producers.
+    """
+
+    def __init__(self, visibility_timeout: float = QUEUE_DEFAULT_VISIBILITY_TIMEOUT):
+        """Initializes the backend.
+
+        Args:
+            visibility_timeout: Seconds a reserved message is invisible to other consumers (optional).
+        """
+        self.visibility_timeout = visibility_timeout
+
+    @abstractmethod
+    def put(self, queue: str, payload: str, priority: float = 0.0) -> None:
+        """Adds a message to a queue.
+
+        Args:
+            queue: The name of the queue.
+            payload: The (serialized) message.
+            priority: The priority of the message (higher is delivered first) (optional).
+        """
+        pass
+
+    @abstractmethod
+    def get(self, queue: str) -> Message | None:
+        """Reserves the visible message with the highest priority (FIFO among equal priorities).
+
+        Returns None if the queue has no visible message.
+
+        Args:
+            queue: The name of the queue.
+        """
+        pass
+
+    @abstractmethod
+    def ack(self, queue: str, msg_id: str) -> None:
+        """Removes a processed message.
+
+        Args:
+            queue: The name of the queue.
+            msg_id: The ID of the message.
+        """
+        pass
+
+    @abstractmethod
+    def nack(self, queue: str, msg_id: str) -> None:
+        """Releases a reserved message, such that it is delivered again.
+
+        Args:
+            queue: The name of the queue.
+            msg_id: The ID of the message.
+        """
+        pass
+
+    @abstractmethod
+    def extend(self, queue: str, msg_id: str) -> None:
+        """Extends the reservation of a message by `visibility_timeout` seconds (e.g. while it is processed).
+
+        Args:
+            queue: The name of the queue.
+            msg_id: The ID of the message.
+        """
+        pass
+
+    @abstractmethod
+    def size(self, queue: str) -> int:
+        """Returns the number of messages waiting in a queue (reserved messages excluded).
+
+        Args:
+            queue: The name of the queue.
+        """
+        pass
+
+    @abstractmethod
+    def pending(self, queue: str) -> int:
+        """Returns the number of messages waiting in or reserved from a queue (i.e. not yet acknowledged).
+
+        Args:
+            queue: The name of the queue.
+        """
+        pass
+
+    @abstractmethod
+    def open(self, queue: str, producer: str) -> None:
+        """Registers a producer (e.g. a node) that may still add messages to a queue.
+
+        Args:
+            queue: The name of the queue.
+            producer: The ID of the producer.
+        """
+        pass
+
+    @abstractmethod
+    def close(self, queue: str, producer: str) -> None:
+        """Unregisters a producer that will not add further messages to a queue.
+
+        Args:
+            queue: The name of the queue.
+            producer: The ID of the producer.
+        """
+        pass
+
+    @abstractmethod
+    def n_producers(self, queue: str) -> int:
+        """Returns the number of registered producers of a queue.
+
+        Args:
+            queue: The name of the queue.
+        """
+        pass
+
+
+class MemoryQueueBackend(QueueBackend):
+    """Queue backend in memory (shared by the orchestrators of one process, e.g. for testing)."""
+
+    def __init__(self, visibility_timeout: float = QUEUE_DEFAULT_VISIBILITY_TIMEOUT):
+        super().__init__(visibility_timeout=visibility_timeout)
+        self._queues: Dict[str, List[Tuple[float, int, str]]] = {}
+        self._messages: Dict[str, Tuple[float, int, str]] = {}
+        self._reserved: Dict[str, Dict[str, float]] = {}
+        self._producers: Dict[str, Set[str]] = {}
+        self._counter = itertools.count()
+
+    def put(self, queue: str, payload: str, priority: float = 0.0) -> None:
+        msg_id = uuid.uuid4().hex
+        entry = (-priority, next(self._counter), msg_id)
+        self._messages[msg_id] = (priority, entry[1], payload)
+        heapq.heappush(self._queues.setdefault(queue, []), entry)
+
+    def _requeue_expired(self, queue: str) -> None:
+        now = time.monotonic()
+        reserved = self._reserved.setdefault(queue, {})
+        for msg_id in [m for m, until in reserved.items() if until <= now]:
+            self._release(queue=queue, msg_id=msg_id)
+
+    def _release(self, queue: str, msg_id: str) -> None:
+        self._reserved[queue].pop(msg_id)
+        priority, count, _ = self._messages[msg_id]
+        heapq.heappush(self._queues.setdefault(queue, []), (-priority, count, msg_id))
+
+    def get(self, queue: str) -> Message | None:
+        self._requeue_expired(queue)
+        heap = self._queues.get(queue)
+        if not heap:
+            return None
+        msg_id = heapq.heappop(heap)[-1]
+        self._reserved[queue][msg_id] = time.monotonic() + self.visibility_timeout
+        return msg_id, self._messages[msg_id][-1]
+
+    def ack(self, queue: str, msg_id: str) -> None:
+        self._reserved.setdefault(queue, {}).pop(msg_id, None)
+        self._messages.pop(msg_id, None)
+
+    def nack(self, queue: str, msg_id: str) -> None:
+        if msg_id in self._reserved.get(queue, {}):
+            self._release(queue=queue, msg_id=msg_id)
+
+    def extend(self, queue: str, msg_id: str) -> None:
+        reserved = self._reserved.get(queue, {})
+        if msg_id in reserved:
+            reserved[msg_id] = time.monotonic() + self.visibility_timeout
+
+    def size(self, queue: str) -> int:
+        self._requeue_expired(queue)
+        return len(self._queues.get(queue, []))
+
+    def pending(self, queue: str) -> int:
+        return len(self._queues.get(queue, [])) + len(self._reserved.get(queue, {}))
+
+    def open(self, queue: str, producer: str) -> None:
+        self._producers.setdefault(queue, set()).add(producer)
+
+    def close(self, queue: str, producer: str) -> None:
+        self._producers.get(queue, set()).discard(producer)
+
+    def n_producers(self, queue: str) -> int:
+        return len(self._producers.get(queue, set()))
+
+
+class SQLiteQueueBackend(QueueBackend):
+    """Durable queue backend in a SQLite file in WAL mode, shared by the crawler processes of a host.
+
+    Messages are reserved within an immediate transaction, such that every message is delivered to
+    exactly one consumer at a time. Use one file per shared crawl.
+    """
+
+    _table = "queue_messages"
+    _producers_table = "queue_producers"
+
+    def __init__(
+        self,
+        filename: Path | str,
+        visibility_timeout: float = QUEUE_DEFAULT_VISIBILITY_TIMEOUT,
+    ):
+        """Initializes the backend with the given filename.
+
+        Args:
+            filename: The SQLite file of the queues.
+            visibility_timeout: Seconds a reserved message is invisible to other consumers (optional).
+        """
+        super().__init__(visibility_timeout=visibility_timeout)
+        self._filename = Path(filename)
+        self._filename.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = _connect(self._filename)
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self._table} "
+            "(id INTEGER PRIMARY KEY AUTOINCREMENT, queue TEXT NOT NULL, payload TEXT NOT NULL, "
+            "priority REAL NOT NULL, visible_at REAL NOT NULL, n_deliveries INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute(
+            f"CREATE INDEX IF NOT EXISTS {self._table}_next "
+            f"ON {self._table} (queue, priority DESC, id)"
+        )
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self._producers_table} "
+            "(queue TEXT NOT NULL, producer TEXT NOT NULL, PRIMARY KEY (queue, producer))"
+        )
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix=type(self).__name__
+        )
+
+    def put(self, queue: str, payload: str, priority: float = 0.0) -> None:
+        with self._lock:
+            self._conn.execute(
+                f"INSERT INTO {self._table} (queue, payload, priority, visible_at) "  # nosec B608
+                "VALUES (?, ?, ?, 0)",
+                (queue, payload, priority),
+            )
+
+    def get(self, queue: str) -> Message | None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    f"SELECT id, payload FROM {self._table} "  # nosec B608
+                    "WHERE queue = ? AND visible_at <= ? ORDER BY priority DESC, id LIMIT 1",
+                    (queue, now),
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        f"UPDATE {self._table} SET visible_at = ?, "  # nosec B608
+                        "n_deliveries = n_deliveries + 1 WHERE id = ?",
+                        (now + self.visibility_timeout, row[0]),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return (str(row[0]), row[1]) if row is not None else None
+
+    def ack(self, queue: str, msg_id: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                f"DELETE FROM {self._table} WHERE id = ?",  # nosec B608
+                (int(msg_id),),
+            )
+
+    def nack(self, queue: str, msg_id: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE {self._table} SET visible_at = 0 WHERE id = ?",  # nosec B608
+                (int(msg_id),),
+            )
+
+    def extend(self, queue: str, msg_id: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE {self._table} SET visible_at = ? "  # nosec B608
+                "WHERE id = ? AND visible_at > 0",
+                (time.time() + self.visibility_timeout, int(msg_id)),
+            )
+
+    def size(self, queue: str) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT COUNT(*) FROM {self._table} "  # nosec B608
+                "WHERE queue = ? AND visible_at <= ?",
+                (queue, time.time()),
+            ).fetchone()
+        return row[0]
+
+    def pending(self, queue: str) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT COUNT(*) FROM {self._table} WHERE queue = ?",  # nosec B608
+                (queue,),
+            ).fetchone()
+        return row[0]
+
+    def open(self, queue: str, producer: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR IGNORE INTO {self._producers_table} (queue, producer) "  # nosec B608
+                "VALUES (?, ?)",
+                (queue, producer),
+            )
+
+    def close(self, queue: str, producer: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                f"DELETE FROM {self._producers_table} "  # nosec B608
+                "WHERE queue = ? AND producer = ?",
+                (queue, producer),
+            )
+
+    def n_producers(self, queue: str) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT COUNT(*) FROM {self._producers_table} WHERE queue = ?",  # nosec B608
+                (queue,),
+            ).fetchone()
+        return row[0]
+
+
+class DedupIndex(_Backend, ABC):
+    """Abstract base class for the (shared) index of the already collected keys (e.g. URLs).
+
+    Abstract methods:
+        add: Adds a key and returns whether it was new.
+    """
+
+    @abstractmethod
+    def add(self, key: str) -> bool:
+        """Adds a key and returns whether it was new (i.e. not added before by any node).
+
+        Args:
+            key: The key (e.g. a URL).
+        """
+        pass
+
+
+class MemoryDedupIndex(DedupIndex):
+    """Dedup index in memory (shared by the orchestrators of one process, e.g. for testing)."""
+
+    def __init__(self):
+        self._keys: Set[str] = set()
+
+    def add(self, key: str) -> bool:
+        if key in self._keys:
+            return False
+        self._keys.add(key)
+        return True
+
+
+class SQLiteDedupIndex(DedupIndex):
+    """Dedup index in a SQLite file in WAL mode, shared by the crawler processes of a host."""
+
+    _table = "dedup_keys"
+
+    def __init__(self, filename: Path | str):
+        """Initializes the index with the given filename.
+
+        Args:
+            filename: The SQLite file of the index (may be the file of the class:`SQLiteQueueBackend`).
+        """
+        self._filename = Path(filename)
+        self._filename.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = _connect(self._filename)
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self._table} (key TEXT PRIMARY KEY)"
+        )
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix=type(self).__name__
+        )
+
+    def add(self, key: str) -> bool:
+        with self._lock:
+            cursor = self._conn.execute(
+                f"INSERT OR IGNORE INTO {self._table} (key) VALUES (?)",  # nosec B608
+                (key,),
+            )
+        return cursor.rowcount == 1
+
+
+class RateBudget(_Backend, ABC):
+    """Abstract base class for the (shared) budgets of the API calls per second.
+
+    The calls of a budget (e.g. a pipeline stage) are spaced such that all nodes sharing the budget
+    together make at most `rates[name]` calls per second, with bursts of up to `burst` calls. Calls of
+    names without a rate are not limited.
+
+    Abstract methods:
+        reserve: Reserves a call and returns the seconds to wait before making it.
+    """
+
+    def __init__(self, rates: Dict[str, float], burst: int = 1):
+        """Initializes the budget.
+
+        Args:
+            rates: The max number of calls per second by name (e.g. {"zyte": 10}).
+            burst: The max number of calls made at once after an idle period (optional).
+        """
+        self.rates = rates
+        self.burst = burst
+
+    def _next(self, name: str, tat: float, now: float) -> Tuple[float, float]:
+        """Returns the waiting time of a call and the new theoretical arrival time (c.f. GCRA)."""
+        interval = 1.0 / self.rates[name]
+        tat = max(tat, now)
+        wait = max(0.0, tat - now - (self.burst - 1) * interval)
+        return wait, tat + interval
+
+    @abstractmethod
+    def reserve(self, name: str) -> float:
+        """Reserves a call and returns the seconds to wait before making it.
+
+        Args:
+            name: The name of the budget.
+        """
+        pass
+
+    async def acquire(self, name: str) -> None:
+        """Waits until a call fits into the budget.
+
+        Args:
+            name: The name of the budget.
+        """
+        if name not in self.rates:
+            return
+        wait = await self.call(self.reserve, name)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class MemoryRateBudget(RateBudget):
+    """Rate budget in memory (shared by the orchestrators of one process)."""
+
+    def __init__(self, rates: Dict[str, float], burst: int = 1):
+        super().__init__(rates=rates, burst=burst)
+        self._tat: Dict[str, float] = {}
+
+    def reserve(self, name: str) -> float:
+        wait, self._tat[name] = self._next(
+            name=name, tat=self._tat.get(name, 0.0), now=time.time()
+        )
+        return wait
+
+
+class SQLiteRateBudget(RateBudget):
+    """Rate budget in a SQLite file in WAL mode, shared by the crawler processes of a host."""
+
+    _table = "rate_budgets"
+
+    def __init__(self, filename: Path | str, rates: Dict[str, float], burst: int = 1):
+        """Initializes the budget with the given filename.
+
+        Args:
+            filename: The SQLite file of the budget (may be the file of the class:`SQLiteQueueBackend`).
+            rates: The max number of calls per second by name (e.g. {"zyte": 10}).
+            burst: The max number of calls made at once after an idle period (optional).
+        """
+        super().__init__(rates=rates, burst=burst)
+        self._filename = Path(filename)
+        self._filename.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = _connect(self._filename)
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self._table} (name TEXT PRIMARY KEY, tat REAL NOT NULL)"
+        )
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix=type(self).__name__
+        )
+
+    def reserve(self, name: str) -> float:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    f"SELECT tat FROM {self._table} WHERE name = ?",  # nosec B608
+                    (name,),
+                ).fetchone()
+                wait, tat = self._next(
+                    name=name, tat=row[0] if row else 0.0, now=time.time()
+                )
+                self._conn.execute(
+                    f"INSERT OR REPLACE INTO {self._table} (name, tat) VALUES (?, ?)",  # nosec B608
+                    (name, tat),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return wait
+
+
+def _connect(filename: Path) -> sqlite3.Connection:
+    """Connects to a SQLite file in WAL mode (autocommit, waiting for the locks of other processes)."""
+    conn = sqlite3.connect(
+        filename, timeout=30.0, isolation_level=None, check_same_thread=False
+    )
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
@@ -1,12 +1,17 @@
+import asyncio
+from contextlib import asynccontextmanager
 import json
 import logging
-from pydantic import BaseModel, field_validator, model_validator
+from pydantic import BaseModel, Field, field_validator, model_validator
 from pydantic_settings import BaseSettings
-from typing import List
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, TypeVar
 
 import aiohttp
 
 from fraudcrawler.settings import (
+    ADAPTIVE_DEFAULT_MAX_RESULTS,
+    ADAPTIVE_DEFAULT_MIN_YIELD,
+    ADAPTIVE_DEFAULT_PAGE_SIZE,
     GOOGLE_LANGUAGES_FILENAME,
     GOOGLE_LOCATIONS_FILENAME,
     PROCESSOR_DEFAULT_IF_MISSING,
@@ -14,6 +19,8 @@ from fraudcrawler.settings import (
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
 # Load google locations and languages
 with open(GOOGLE_LOCATIONS_FILENAME, "r") as gfile:
     _locs = json.load(gfile)
@@ -91,55 +98,160 @@ class Language(BaseModel):
 
 
 class Enrichment(BaseModel):
-    """Model for enriching initial search_term with alternative ones."""
+    """Model for enriching initial search_term with alternative ones.
+
+    With `max_depth > 1` the suggested and related terms are expanded themselves (c.f. func:`Enricher.expand`),
+    optionally bounded by `max_calls` DataForSEO requests.
+    """
 
     additional_terms: int
     additional_urls_per_term: int
+    max_depth: int = 1
+    max_calls: int | None = None
+
+
+class AdaptiveDepth(BaseModel):
+    """Model for adapting the search depth per search_term to its share of relevant products.
+
+    After the first SERP page of a search_term, further pages of `page_size` results are fetched only
+    while the share of relevant products among the classified ones stays at or above `min_yield`,
+    up to `max_results` results per search_term.
+    """
+
+    page_size: int = ADAPTIVE_DEFAULT_PAGE_SIZE
+    min_yield: float = ADAPTIVE_DEFAULT_MIN_YIELD
+    max_results: int = ADAPTIVE_DEFAULT_MAX_RESULTS
 
 
 class Deepness(BaseModel):
-    """Model for search depth."""
+    """Model for search depth.
+
+    With `adaptive` the `num_results` (and `additional_urls_per_term`) define the first SERP page of
+    every search_term, which is extended while the search_term keeps yielding relevant products.
+    """
 
     num_results: int
     enrichment: Enrichment | None = None
+    adaptive: AdaptiveDepth | None = None
 
 
 class Prompt(BaseModel):
-    """Model for prompts."""
+    """Model for prompts.
+
+    A prompt runs after the prompts listed in `depends_on` and the prompts of its gating condition
+    `run_if`; with e.g. `run_if={"relevance": [1]}` it only runs for products classified as relevant
+    and is recorded as skipped otherwise (c.f. func:`Processor.classify_all`).
+
+    `max_description_tokens` overrides the token budget of the product description of the Processor.
+    """
 
     name: str
     context: str
     system_prompt: str
     allowed_classes: List[int]
     default_if_missing: int = PROCESSOR_DEFAULT_IF_MISSING
+    depends_on: List[str] = Field(default_factory=list)
+    run_if: Dict[str, List[int]] = Field(default_factory=dict)
+    max_description_tokens: int | None = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into a single in-flight call.
+
+    The first caller for a given key starts the call; every caller arriving while it is in flight
+    awaits the same future and receives the same result (or exception). Once the call is done, the
+    key is released and the next caller starts a new call.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    async def do(self, key: str, func: Callable[[], Awaitable[T]]) -> T:
+        """Runs `func()` unless a call with the same key is already in flight, and returns its result.
+
+        Args:
+            key: The key identifying identical calls.
+            func: The function creating the awaitable for the call.
+        """
+        fut = self._inflight.get(key)
+        if fut is None:
+            fut = asyncio.ensure_future(func())
+            self._inflight[key] = fut
+            fut.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            logger.debug(f'Joining in-flight call for key="{key}".')
+        # Shield the shared call such that a cancelled waiter does not cancel it for the others
+        return await asyncio.shield(fut)
 
 
 class AsyncClient:
-    """Base class for sub-classes using async HTTP requests."""
+    """Base class for sub-classes using async HTTP requests.
+
+    By default every request opens its own HTTP session; long-running processes (c.f. class:`CrawlerService`)
+    call func:`open` to reuse one session (and its connections) for all requests until func:`close`.
+    """
+
+    def __init__(self):
+        self._single_flight = SingleFlight()
+        self._session: aiohttp.ClientSession | None = None
+
+    async def open(self) -> None:
+        """Opens the persistent HTTP session."""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+
+    async def close(self) -> None:
+        """Closes the persistent HTTP session."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @asynccontextmanager
+    async def _request_session(self) -> AsyncIterator[aiohttp.ClientSession]:
+        """Yields the persistent HTTP session (if open) or a new one for a single request."""
+        if self._session is not None and not self._session.closed:
+            yield self._session
+        else:
+            async with aiohttp.ClientSession() as session:
+                yield session
+
+    async def _coalesce(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        """Coalesces concurrent identical requests (c.f. class:`SingleFlight`).
+
+        Args:
+            key: The key identifying identical requests.
+            func: The function creating the awaitable for the request.
+        """
+        return await self._single_flight.do(key=key, func=func)
 
-    @staticmethod
     async def get(
+        self,
         url: str,
         headers: dict | None = None,
         params: dict | None = None,
     ) -> dict:
         """Async GET request of a given URL returning the data."""
-        async with aiohttp.ClientSession(headers=headers) as session:
-            async with session.get(url=url, params=params) as response:
+        async with self._request_session() as session:
+            async with session.get(url=url, params=params, headers=headers) as response:
                 response.raise_for_status()
                 json_ = await response.json()
         return json_
 
-    @staticmethod
     async def post(
+        self,
         url: str,
         headers: dict | None = None,
         data: List[dict] | dict | None = None,
         auth: aiohttp.BasicAuth | None = None,
     ) -> dict:
         """Async POST request of a given URL returning the data."""
-        async with aiohttp.ClientSession(headers=headers) as session:
-            async with session.post(url=url, json=data, auth=auth) as response:
+        async with self._request_session() as session:
+            async with session.post(
+                url=url, json=data, auth=auth, headers=headers
+            ) as response:
                 response.raise_for_status()
                 json_ = await response.json()
         return json_
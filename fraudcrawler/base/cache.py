@@ -0,0 +1,142 @@
+from abc import ABC, abstractmethod
+import hashlib
+import json
+import logging
+from pathlib import Path
+from pydantic import BaseModel
+import sqlite3
+import time
+from typing import Any, Dict
+
+from fraudcrawler.settings import CACHE_DEFAULT_FILENAME
+
+logger = logging.getLogger(__name__)
+
+
+class CacheEntry(BaseModel):
+    """Model for a cached value together with its creation time (seconds since the epoch)."""
+
+    value: Any
+    created_at: float
+
+    def age(self) -> float:
+        """Returns the age of the entry in seconds."""
+        return time.time() - self.created_at
+
+
+class Cache(ABC):
+    """Abstract base class for response caches.
+
+    Abstract methods:
+        get: Returns the entry for a given key (or None).
+        set: Stores a value for a given key.
+
+    A cache does not expire its entries by itself; the clients decide with their own TTLs whether an
+    entry (c.f. func:`CacheEntry.age`) is fresh, stale or expired.
+    """
+
+    @staticmethod
+    def make_key(namespace: str, **params: Any) -> str:
+        """Creates a key from a namespace and the normalized request parameters.
+
+        String parameters are lower-cased and their whitespaces are collapsed, such that e.g.
+        `"Kühlschrank "` and `"kühlschrank"` are mapped to the same key.
+
+        Args:
+            namespace: The namespace of the key (e.g. the endpoint).
+            params: The request parameters.
+        """
+        normalized = {
+            k: " ".join(v.split()).lower() if isinstance(v, str) else v
+            for k, v in params.items()
+        }
+        dump = json.dumps(normalized, sort_keys=True, default=str)
+        digest = hashlib.sha256(dump.encode("utf-8")).hexdigest()
+        return f"{namespace}:{digest}"
+
+    @abstractmethod
+    def get(self, key: str) -> CacheEntry | None:
+        """Returns the entry for a given key (or None if the key is unknown).
+
+        Args:
+            key: The key of the entry.
+        """
+        pass
+
+    @abstractmethod
+    def set(self, key: str, value: Any) -> None:
+        """Stores a (json serializable) value for a given key.
+
+        Args:
+            key: The key of the entry.
+            value: The value to store.
+        """
+        pass
+
+
+class MemoryCache(Cache):
+    """Cache keeping its entries in memory (lost after a restart)."""
+
+    def __init__(self):
+        self._entries: Dict[str, CacheEntry] = {}
+
+    def get(self, key: str) -> CacheEntry | None:
+        return self._entries.get(key)
+
+    def set(self, key: str, value: Any) -> None:
+        self._entries[key] = CacheEntry(value=value, created_at=time.time())
+
+
+class DiskCache(Cache):
+    """Cache keeping its entries in a SQLite file (survives restarts)."""
+
+    _table = "cache"
+
+    def __init__(self, filename: Path | str = CACHE_DEFAULT_FILENAME):
+        """Initializes the DiskCache with the given filename.
+
+        Args:
+            filename: The SQLite file to store the entries in.
+        """
+        self._filename = Path(filename)
+        self._filename.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self._filename)
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self._table} "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def __reduce__(self):
+        # Pickled for other processes by its filename (c.f. func:`FraudCrawlerClient.execute_sharded`)
+        return type(self), (self._filename,)
+
+    def get(self, key: str) -> CacheEntry | None:
+        row = self._conn.execute(
+            f"SELECT value, created_at FROM {self._table} WHERE key = ?",  # nosec B608
+            (key,),
+        ).fetchone()
+        if row is None:
+            return None
+        return CacheEntry(value=json.loads(row[0]), created_at=row[1])
+
+    def set(self, key: str, value: Any) -> None:
+        self._conn.execute(
+            f"INSERT OR REPLACE INTO {self._table} (key, value, created_at) VALUES (?, ?, ?)",  # nosec B608
+            (key, json.dumps(value), time.time()),
+        )
+        self._conn.commit()
+
+    def purge(self, max_age: float) -> int:
+        """Deletes all entries older than max_age seconds and returns their number.
+
+        Args:
+            max_age: The maximal age of the entries to keep.
+        """
+        cur = self._conn.execute(
+            f"DELETE FROM {self._table} WHERE created_at < ?",  # nosec B608
+            (time.time() - max_age,),
+        )
+        self._conn.commit()
+        logger.debug(f"Purged {cur.rowcount} entries from {self._filename}.")
+        return cur.rowcount
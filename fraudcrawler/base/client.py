@@ -1,16 +1,38 @@
+import ast
 import asyncio
+from concurrent.futures import ProcessPoolExecutor
 import csv
 from datetime import datetime
 import logging
+import multiprocessing
+import os
 from pathlib import Path
-from pydantic import BaseModel
-from typing import List
+from pydantic import BaseModel, Field
+from typing import AsyncIterator, Dict, List
 
 import pandas as pd
 
-from fraudcrawler.settings import ROOT_DIR
+from fraudcrawler.settings import JOURNAL_DEFAULT_DIR, ROOT_DIR, SHARD_DEFAULT_DIR
 from fraudcrawler.base.base import Setup, Language, Location, Deepness, Host, Prompt
+from fraudcrawler.base.autoscale import Autoscaling
+from fraudcrawler.base.backends import (
+    DedupIndex,
+    QueueBackend,
+    RateBudget,
+    SQLiteDedupIndex,
+    SQLiteQueueBackend,
+    SQLiteRateBudget,
+)
+from fraudcrawler.base.cache import Cache
+from fraudcrawler.base.domains import DomainPolicy, DomainStatsStore
+from fraudcrawler.base.journal import RunJournal
+from fraudcrawler.base.keys import KeyPool
 from fraudcrawler.base.orchestrator import Orchestrator, ProductItem
+from fraudcrawler.processing.batch import BatchClassifier
+from fraudcrawler.processing.local import LocalClassifierTier
+from fraudcrawler.processing.processor import Cascade
+from fraudcrawler.processing.snippet import SnippetFilter
+from fraudcrawler.processing.tokens import TokenUsage
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +44,10 @@ class Results(BaseModel):
 
     search_term: str
     filename: Path | None = None
+    run_id: str | None = None
+    term_mapping: Dict[str, str] = Field(default_factory=dict)
+    n_serp_calls_saved: int = 0
+    token_usage: TokenUsage | None = None
 
 
 class FraudCrawlerClient(Orchestrator):
@@ -29,16 +55,79 @@ class FraudCrawlerClient(Orchestrator):
 
     _filename_template = "{search_term}_{language}_{location}_{timestamp}.csv"
 
-    def __init__(self):
-        setup = Setup()
+    def __init__(
+        self,
+        cache: Cache | None = None,
+        autoscaling: Autoscaling | None = None,
+        max_queue_size: int | None = None,
+        domain_stats: DomainStatsStore | None = None,
+        domain_policy: DomainPolicy | None = None,
+        snippet_filter: SnippetFilter | None = None,
+        local_classifier: LocalClassifierTier | None = None,
+        cascade: Cascade | None = None,
+        batch: BatchClassifier | None = None,
+        queue_backend: QueueBackend | None = None,
+        dedup_index: DedupIndex | None = None,
+        rate_budget: RateBudget | None = None,
+        node_id: str | None = None,
+        journal_dir: Path | str | None = JOURNAL_DEFAULT_DIR,
+        key_pools: Dict[str, KeyPool[str]] | None = None,
+    ):
+        """Initializes the client with the credentials from the `.env` file.
+
+        Args:
+            cache: The cache for the SerpApi and DataForSEO responses and the classifications (optional).
+            autoscaling: Scale the number of workers per stage while running (optional).
+            max_queue_size: Max number of products waiting for zyte or processing before shedding the lowest priority ones (optional).
+            domain_stats: The persistent per-domain statistics, updated with the results of every run (optional).
+            domain_policy: The policy for domains with a proven zero yield in `domain_stats` (optional).
+            snippet_filter: Drops clearly irrelevant search results by their title and snippet before Zyte (optional).
+            local_classifier: Local classifiers answering the confident cases before OpenAI (optional).
+            cascade: Classify with a cheap model first and escalate only the uncertain answers (optional).
+            batch: Classify all products in batches after the crawling instead of calling OpenAI per product (optional).
+            queue_backend: The shared backend of the serp, zyte and proc queues, for sharing the work of a run between several nodes (optional).
+            dedup_index: The shared index of the collected URLs (and queued SERP items) of the nodes (optional).
+            rate_budget: The (shared) budget of the calls per second of the "serp", "zyte" and "proc" stages (optional).
+            node_id: The ID of this node among the nodes sharing the `queue_backend`; a restarted node must reuse the ID of the crashed one (optional).
+            journal_dir: The directory of the run journals for resuming interrupted runs (optional; None to disable).
+            key_pools: Pools of API keys (with quotas) replacing the keys of the `.env` file for the "serp", "zyte" and "proc" stages (optional).
+        """
+        setup = Setup()  # type: ignore[call-arg]
+        key_pools = key_pools or {}
         super().__init__(
-            serpapi_key=setup.serpapi_key,
+            serpapi_key=key_pools.get("serp", setup.serpapi_key),
             dataforseo_user=setup.dataforseo_user,
             dataforseo_pwd=setup.dataforseo_pwd,
-            zyteapi_key=setup.zyteapi_key,
-            openaiapi_key=setup.openaiapi_key,
+            zyteapi_key=key_pools.get("zyte", setup.zyteapi_key),
+            openaiapi_key=key_pools.get("proc", setup.openaiapi_key),
+            cache=cache,
+            autoscaling=autoscaling,
+            max_queue_size=max_queue_size,
+            domain_stats=domain_stats,
+            domain_policy=domain_policy,
+            snippet_filter=snippet_filter,
+            local_classifier=local_classifier,
+            cascade=cascade,
+            batch=batch,
+            queue_backend=queue_backend,
+            dedup_index=dedup_index,
+            rate_budget=rate_budget,
+            node_id=node_id,
         )
 
+        # The settings of the shard clients (c.f. func:`execute_sharded`)
+        self._shard_settings = {
+            "cache": cache,
+            "autoscaling": autoscaling,
+            "max_queue_size": max_queue_size,
+            "domain_stats": domain_stats,
+            "domain_policy": domain_policy,
+            "snippet_filter": snippet_filter,
+            "local_classifier": local_classifier,
+            "cascade": cascade,
+            "key_pools": key_pools,
+        }
+        self._journal_dir = journal_dir
         self._results_dir = _RESULTS_DIR
         if not self._results_dir.exists():
             self._results_dir.mkdir(parents=True)
@@ -96,6 +185,78 @@ class FraudCrawlerClient(Orchestrator):
             marketplaces: The marketplaces to include in the search.
             excluded_urls: The URLs to exclude from the search.
         """
+        asyncio.run(
+            self.aexecute(
+                search_term=search_term,
+                language=language,
+                location=location,
+                deepness=deepness,
+                prompts=prompts,
+                marketplaces=marketplaces,
+                excluded_urls=excluded_urls,
+            )
+        )
+
+    async def aexecute(
+        self,
+        search_term: str,
+        language: Language,
+        location: Location,
+        deepness: Deepness,
+        prompts: List[Prompt],
+        marketplaces: List[Host] | None = None,
+        excluded_urls: List[Host] | None = None,
+    ) -> None:
+        """Runs the pipeline like func:`execute` within an already running event loop.
+
+        Args:
+            search_term: The search term for the query.
+            language: The language to use for the query.
+            location: The location to use for the query.
+            deepness: The search depth and enrichment details.
+            prompts: The list of prompts to use for classification.
+            marketplaces: The marketplaces to include in the search.
+            excluded_urls: The URLs to exclude from the search.
+        """
+        async for _ in self.stream(
+            search_term=search_term,
+            language=language,
+            location=location,
+            deepness=deepness,
+            prompts=prompts,
+            marketplaces=marketplaces,
+            excluded_urls=excluded_urls,
+        ):
+            pass
+
+    async def stream(
+        self,
+        search_term: str,
+        language: Language,
+        location: Location,
+        deepness: Deepness,
+        prompts: List[Prompt],
+        marketplaces: List[Host] | None = None,
+        excluded_urls: List[Host] | None = None,
+        previously_collected_urls: List[str] | None = None,
+        journal: RunJournal | None = None,
+    ) -> AsyncIterator[ProductItem]:
+        """Runs the pipeline like func:`aexecute` and yields every finished product as soon as it is finished.
+
+        The results are saved as in func:`execute` once the run is concluded. Cancelling the iteration or
+        closing it early (e.g. `break` within `contextlib.aclosing`) cancels the run and all its workers.
+
+        Args:
+            search_term: The search term for the query.
+            language: The language to use for the query.
+            location: The location to use for the query.
+            deepness: The search depth and enrichment details.
+            prompts: The list of prompts to use for classification.
+            marketplaces: The marketplaces to include in the search.
+            excluded_urls: The URLs to exclude from the search.
+            previously_collected_urls: The urls that have been collected previously and are ignored.
+            journal: The journal of the run (optional; by default a new one in `journal_dir`).
+        """
         timestamp = datetime.today().strftime("%Y%m%d%H%M%S")
         filename = self._results_dir / self._filename_template.format(
             search_term=search_term,
@@ -103,10 +264,201 @@ class FraudCrawlerClient(Orchestrator):
             location=location.code,
             timestamp=timestamp,
         )
-        self._results.append(Results(search_term=search_term, filename=filename))
+        if journal is None and self._journal_dir is not None:
+            journal = RunJournal(run_id=filename.stem, directory=self._journal_dir)
+            journal.write_params(
+                {
+                    "filename": str(filename),
+                    "search_term": search_term,
+                    "language": language.model_dump(),
+                    "location": location.model_dump(),
+                    "deepness": deepness.model_dump(),
+                    "prompts": [p.model_dump() for p in prompts],
+                    "marketplaces": [h.model_dump() for h in marketplaces or []],
+                    "excluded_urls": [h.model_dump() for h in excluded_urls or []],
+                }
+            )
+            logger.info(f"Journaling run {journal.run_id} to {journal.filename}")
 
-        asyncio.run(
-            super().run(
+        async for product in self._stream(
+            filename=filename,
+            journal=journal,
+            search_term=search_term,
+            language=language,
+            location=location,
+            deepness=deepness,
+            prompts=prompts,
+            marketplaces=marketplaces,
+            excluded_urls=excluded_urls,
+            previously_collected_urls=previously_collected_urls,
+        ):
+            yield product
+
+    def execute_sharded(
+        self,
+        search_term: str,
+        language: Language,
+        location: Location,
+        deepness: Deepness,
+        prompts: List[Prompt],
+        marketplaces: List[Host] | None = None,
+        excluded_urls: List[Host] | None = None,
+        n_processes: int | None = None,
+        rates: Dict[str, float] | None = None,
+    ) -> None:
+        """Runs the pipeline (c.f. func:`execute`) in several processes and merges their results.
+
+        Every process runs its own orchestrator (with the settings of this client and its own event loop)
+        on queues shared in a SQLite file (c.f. class:`SQLiteQueueBackend`): the SERP calls, Zyte calls and
+        classifications are distributed among the processes as they become free, the collected URLs are
+        deduplicated across the processes and the API calls of all processes are limited by `rates`. The
+        processes write no run journals and batch classification is not supported.
+
+        Args:
+            search_term: The search term for the query.
+            language: The language to use for the query.
+            location: The location to use for the query.
+            deepness: The search depth and enrichment details.
+            prompts: The list of prompts to use for classification.
+            marketplaces: The marketplaces to include in the search.
+            excluded_urls: The URLs to exclude from the search.
+            n_processes: The number of processes (optional; defaults to the number of CPUs).
+            rates: The max number of calls per second of the "serp", "zyte" and "proc" stages of all processes together (optional).
+        """
+        if self._batch is not None:
+            raise ValueError(
+                "Batch classification cannot be combined with a sharded execution"
+            )
+        n_processes = n_processes or os.cpu_count() or 1
+        timestamp = datetime.today().strftime("%Y%m%d%H%M%S")
+        filename = self._results_dir / self._filename_template.format(
+            search_term=search_term,
+            language=language.code,
+            location=location.code,
+            timestamp=timestamp,
+        )
+        shards_dir = Path(SHARD_DEFAULT_DIR)
+        db = shards_dir / f"{filename.stem}.sqlite"
+        run = {
+            "search_term": search_term,
+            "language": language,
+            "location": location,
+            "deepness": deepness,
+            "prompts": prompts,
+            "marketplaces": marketplaces,
+            "excluded_urls": excluded_urls,
+        }
+
+        logger.info(f"Running {search_term} in {n_processes} processes (shared {db})")
+        context = multiprocessing.get_context("spawn")
+        try:
+            with ProcessPoolExecutor(
+                max_workers=n_processes, mp_context=context
+            ) as pool:
+                futures = [
+                    pool.submit(
+                        _execute_shard,
+                        shard=i,
+                        db=db,
+                        rates=rates,
+                        filename=shards_dir / f"{filename.stem}_shard{i}.csv",
+                        run=run,
+                        settings=self._shard_settings,
+                    )
+                    for i in range(n_processes)
+                ]
+                shards = [f.result() for f in futures]
+        finally:
+            for suffix in ["", "-wal", "-shm"]:
+                Path(f"{db}{suffix}").unlink(missing_ok=True)
+
+        self._results.append(
+            self._merge_shards(
+                search_term=search_term, filename=filename, shards=shards
+            )
+        )
+
+    @staticmethod
+    def _merge_shards(
+        search_term: str, filename: Path, shards: List[Results]
+    ) -> Results:
+        """Merges the results of the shards (c.f. func:`execute_sharded`) into one results file.
+
+        Args:
+            search_term: The search term of the run.
+            filename: The results file.
+            shards: The results of the shards.
+        """
+        dfs = []
+        for shard in shards:
+            if shard.filename is None or not shard.filename.exists():
+                continue
+            try:
+                dfs.append(pd.read_csv(shard.filename))
+            except pd.errors.EmptyDataError:
+                pass
+            shard.filename.unlink()
+        df = pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame()
+        df.to_csv(filename, index=False, quoting=csv.QUOTE_ALL)
+        logger.info(f"Results of {len(shards)} shards saved to {filename}")
+
+        results = Results(search_term=search_term, filename=filename)
+        results.token_usage = TokenUsage()
+        for shard in shards:
+            results.term_mapping.update(shard.term_mapping)
+            results.n_serp_calls_saved += shard.n_serp_calls_saved
+            if shard.token_usage is not None:
+                results.token_usage.merge(shard.token_usage)
+        return results
+
+    def resume(self, run_id: str) -> None:
+        """Resumes an interrupted run from its journal.
+
+        The journaled steps (enrichment, SERP calls, Zyte calls and classifications) are replayed
+        without calling the APIs again and the remaining work is done as in func:`execute`.
+
+        Args:
+            run_id: The ID of the run (c.f. attribute:`Results.run_id` or the journal files).
+        """
+        if self._journal_dir is None:
+            raise ValueError("Resuming requires the journals (journal_dir is None).")
+        journal = RunJournal(run_id=run_id, directory=self._journal_dir)
+        params = journal.params
+        if params is None:
+            journal.close(remove=True)
+            raise ValueError(f'No journal found for run_id="{run_id}"')
+
+        logger.info(f"Resuming run {run_id}")
+        self._execute(
+            filename=Path(params["filename"]),
+            journal=journal,
+            search_term=params["search_term"],
+            language=Language(**params["language"]),
+            location=Location(**params["location"]),
+            deepness=Deepness(**params["deepness"]),
+            prompts=[Prompt(**p) for p in params["prompts"]],
+            marketplaces=[Host(**h) for h in params["marketplaces"]] or None,
+            excluded_urls=[Host(**h) for h in params["excluded_urls"]] or None,
+        )
+
+    def _execute(
+        self,
+        filename: Path,
+        journal: RunJournal | None,
+        search_term: str,
+        language: Language,
+        location: Location,
+        deepness: Deepness,
+        prompts: List[Prompt],
+        marketplaces: List[Host] | None,
+        excluded_urls: List[Host] | None,
+    ) -> None:
+        """Runs the pipeline (c.f. func:`_stream`) to its end."""
+
+        async def consume() -> None:
+            async for _ in self._stream(
+                filename=filename,
+                journal=journal,
                 search_term=search_term,
                 language=language,
                 location=location,
@@ -114,8 +466,119 @@ class FraudCrawlerClient(Orchestrator):
                 prompts=prompts,
                 marketplaces=marketplaces,
                 excluded_urls=excluded_urls,
-            )
+            ):
+                pass
+
+        asyncio.run(consume())
+
+    async def _stream(
+        self,
+        filename: Path,
+        journal: RunJournal | None,
+        search_term: str,
+        language: Language,
+        location: Location,
+        deepness: Deepness,
+        prompts: List[Prompt],
+        marketplaces: List[Host] | None,
+        excluded_urls: List[Host] | None,
+        previously_collected_urls: List[str] | None = None,
+    ) -> AsyncIterator[ProductItem]:
+        """Runs the pipeline (c.f. func:`Orchestrator.stream`) and removes the journal once the results are saved."""
+        run_id = journal.run_id if journal is not None else None
+        self._results.append(
+            Results(search_term=search_term, filename=filename, run_id=run_id)
+        )
+
+        try:
+            async for product in super().stream(
+                search_term=search_term,
+                language=language,
+                location=location,
+                deepness=deepness,
+                prompts=prompts,
+                marketplaces=marketplaces,
+                excluded_urls=excluded_urls,
+                previously_collected_urls=previously_collected_urls,
+                journal=journal,
+            ):
+                yield product
+        finally:
+            if journal is not None:
+                journal.close(remove=filename.exists())
+
+        # Keep the mapping of the search_terms onto the searched ones
+        self._results[-1].term_mapping = dict(self._term_dedup.mapping)
+        self._results[-1].n_serp_calls_saved = self._term_dedup.n_duplicates
+        self._results[-1].token_usage = self._processor.usage.model_copy()
+
+    @staticmethod
+    def load_products(filename: Path | str) -> List[ProductItem]:
+        """Loads the products from a saved .csv file (without their classifications).
+
+        Args:
+            filename: The .csv file of a previous run.
+        """
+        df = pd.read_csv(filename)
+        df = df.astype(object).where(df.notna(), None)
+        fields = set(ProductItem.model_fields) - {
+            "classifications",
+            "serp_extensions",
+            "product_images",
+        }
+        products = []
+        for row in df.to_dict(orient="records"):
+            data = {k: v for k, v in row.items() if k in fields and v is not None}
+            images = row.get("product_images")
+            if isinstance(images, str):
+                data["product_images"] = ast.literal_eval(images)
+            products.append(ProductItem(**data))
+        return products
+
+    def reprocess_results(
+        self, prompts: List[Prompt], index: int = -1, filename: Path | str | None = None
+    ) -> None:
+        """Re-classifies the products of a previous run with the given prompts and saves them as a new result set.
+
+        Only the processing step is run (c.f. func:`Orchestrator.reprocess`), there are no SerpApi,
+        DataForSEO or Zyte calls.
+
+        Args:
+            prompts: The list of prompts to use for classification.
+            index: The index of the results to reprocess (optional).
+            filename: The .csv file of the results to reprocess (optional; overrides `index`).
+        """
+        if filename is None:
+            previous = self._results[index]
+            search_term, filename = previous.search_term, previous.filename
+        else:
+            search_term = Path(filename).stem.split("_")[0]
+        if filename is None:
+            raise ValueError("The results to reprocess have no file.")
+        products = self.load_products(filename)
+
+        timestamp = datetime.today().strftime("%Y%m%d%H%M%S")
+        new_filename = (
+            self._results_dir / f"{Path(filename).stem}_reprocessed_{timestamp}.csv"
         )
+        self._results.append(Results(search_term=search_term, filename=new_filename))
+
+        asyncio.run(super().reprocess(products=products, prompts=prompts))
+        self._results[-1].token_usage = self._processor.usage.model_copy()
+
+    def collect_manifest(self, filename: Path | str) -> None:
+        """Saves the products of a manifest (e.g. the output of func:`Orchestrator.proc_stage`) as results.
+
+        Args:
+            filename: The manifest file.
+        """
+        products = self.read_manifest(filename)
+        search_term = products[0].search_term if products else Path(filename).stem
+        results_filename = self._results_dir / f"{Path(filename).stem}.csv"
+        self._results.append(
+            Results(search_term=search_term, filename=results_filename)
+        )
+        asyncio.run(self.collect_stage(input=filename))
 
     def load_results(self, index: int = -1) -> pd.DataFrame:
         """Loads the results from the saved .csv files.
@@ -132,3 +595,24 @@ class FraudCrawlerClient(Orchestrator):
         n_res = len(self._results)
         for i, res in enumerate(self._results):
             print(f"index={-n_res + i}: {res.search_term} - {res.filename}")
+
+
+def _execute_shard(
+    shard: int,
+    db: Path,
+    rates: Dict[str, float] | None,
+    filename: Path,
+    run: dict,
+    settings: dict,
+) -> Results:
+    """Runs a shard of func:`FraudCrawlerClient.execute_sharded` (in its own process) and returns its results."""
+    client = FraudCrawlerClient(
+        **settings,
+        queue_backend=SQLiteQueueBackend(db),
+        dedup_index=SQLiteDedupIndex(db),
+        rate_budget=SQLiteRateBudget(db, rates=rates) if rates else None,
+        node_id=f"shard{shard}",
+        journal_dir=None,
+    )
+    client._execute(filename=filename, journal=None, **run)
+    return client._results[-1]
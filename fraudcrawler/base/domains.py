@@ -0,0 +1,204 @@
+import json
+import logging
+from pathlib import Path
+from pydantic import BaseModel, Field
+import random
+import sqlite3
+from typing import Dict, Literal
+
+from fraudcrawler.settings import (
+    DOMAIN_POLICY_DEFAULT_MIN_SEEN,
+    DOMAIN_POLICY_DEFAULT_RESAMPLE_RATE,
+    DOMAIN_STATS_DEFAULT_FILENAME,
+    PROCESSOR_SKIPPED,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class DomainStats(BaseModel):
+    """Model for the accumulated statistics of the products of a domain.
+
+    Only products with product details from Zyte are counted as seen.
+    """
+
+    n_seen: int = 0
+    n_kept: int = 0
+    n_relevant: int = 0
+    n_classified: Dict[str, int] = Field(default_factory=dict)
+    n_positive: Dict[str, int] = Field(default_factory=dict)
+
+    def relevance_rate(self, prompt: str) -> float | None:
+        """Returns the share of positive classifications of a prompt (None if never classified)."""
+        n_classified = self.n_classified.get(prompt, 0)
+        if n_classified == 0:
+            return None
+        return self.n_positive.get(prompt, 0) / n_classified
+
+    def add(
+        self, kept: bool, classifications: Dict[str, int], is_relevant: bool
+    ) -> None:
+        """Counts a seen product (c.f. func:`DomainStatsStore.update`)."""
+        self.n_seen += 1
+        self.n_kept += int(kept)
+        self.n_relevant += int(is_relevant)
+        for prompt, cls in classifications.items():
+            if cls == PROCESSOR_SKIPPED:
+                continue
+            self.n_classified[prompt] = self.n_classified.get(prompt, 0) + 1
+            self.n_positive[prompt] = self.n_positive.get(prompt, 0) + int(cls > 0)
+
+    def merge(self, other: "DomainStats") -> None:
+        """Adds the counts of other statistics of the same domain."""
+        self.n_seen += other.n_seen
+        self.n_kept += other.n_kept
+        self.n_relevant += other.n_relevant
+        for prompt, n in other.n_classified.items():
+            self.n_classified[prompt] = self.n_classified.get(prompt, 0) + n
+        for prompt, n in other.n_positive.items():
+            self.n_positive[prompt] = self.n_positive.get(prompt, 0) + n
+
+
+class DomainPolicy(BaseModel):
+    """Model for the policy applied to domains with a proven zero yield.
+
+    A domain has a proven zero yield once `min_seen` of its products were seen without a single
+    relevant one. Its products are either processed last (`action="deprioritize"`) or skipped in the
+    URL collection (`action="skip"`); in the latter case a share `resample_rate` of them is processed
+    anyway, such that the statistics of the domain do not go stale.
+    """
+
+    action: Literal["skip", "deprioritize"] = "skip"
+    min_seen: int = DOMAIN_POLICY_DEFAULT_MIN_SEEN
+    resample_rate: float = DOMAIN_POLICY_DEFAULT_RESAMPLE_RATE
+
+
+class DomainStatsStore:
+    """Persistent per-domain statistics in a SQLite file (in memory if no filename is given).
+
+    The statistics are updated in memory while running and written to the file with func:`flush`. The
+    flush adds the updates since the previous flush to the stored statistics, such that several processes
+    (e.g. the shards of func:`FraudCrawlerClient.execute_sharded`) can share the file.
+    """
+
+    _table = "domain_stats"
+
+    def __init__(
+        self,
+        filename: Path | str | None = DOMAIN_STATS_DEFAULT_FILENAME,
+        seed: int | None = None,
+    ):
+        """Initializes the store with the given filename.
+
+        Args:
+            filename: The SQLite file to store the statistics in (optional).
+            seed: The seed for resampling the zero yield domains (optional).
+        """
+        self._filename = Path(filename) if filename is not None else None
+        self._conn = self._connect()
+        self._stats: Dict[str, DomainStats] = {}
+        self._updates: Dict[str, DomainStats] = {}
+        self._rng = random.Random(seed)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._filename is None:
+            conn = sqlite3.connect(":memory:")
+        else:
+            self._filename.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self._filename)
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self._table} "
+            "(domain TEXT PRIMARY KEY, stats TEXT NOT NULL)"
+        )
+        conn.commit()
+        return conn
+
+    def __getstate__(self) -> dict:
+        # Pickled for other processes: without the connection and the pending updates (flushed by this process)
+        state = self.__dict__.copy()
+        del state["_conn"]
+        state["_updates"] = {}
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._conn = self._connect()
+
+    def get(self, domain: str) -> DomainStats:
+        """Returns the statistics of a domain (empty statistics for unknown domains).
+
+        Args:
+            domain: The domain.
+        """
+        if domain not in self._stats:
+            row = self._conn.execute(
+                f"SELECT stats FROM {self._table} WHERE domain = ?",  # nosec B608
+                (domain,),
+            ).fetchone()
+            self._stats[domain] = (
+                DomainStats(**json.loads(row[0])) if row else DomainStats()
+            )
+        return self._stats[domain]
+
+    def update(
+        self,
+        domain: str,
+        kept: bool,
+        classifications: Dict[str, int],
+        is_relevant: bool,
+    ) -> None:
+        """Adds a seen product to the statistics of its domain.
+
+        Args:
+            domain: The domain of the product.
+            kept: Whether the product was kept after the Zyte probability threshold.
+            classifications: The classifications of the product by prompt name (skipped prompts are ignored).
+            is_relevant: Whether the product is relevant.
+        """
+        for stats in [
+            self.get(domain),
+            self._updates.setdefault(domain, DomainStats()),
+        ]:
+            stats.add(
+                kept=kept, classifications=classifications, is_relevant=is_relevant
+            )
+
+    def is_zero_yield(self, domain: str, policy: DomainPolicy) -> bool:
+        """Returns whether a domain has a proven zero yield (c.f. class:`DomainPolicy`).
+
+        Args:
+            domain: The domain.
+            policy: The domain policy.
+        """
+        stats = self.get(domain)
+        return stats.n_seen >= policy.min_seen and stats.n_relevant == 0
+
+    def resample(self, policy: DomainPolicy) -> bool:
+        """Draws whether a product of a zero yield domain is processed anyway.
+
+        Args:
+            policy: The domain policy.
+        """
+        return self._rng.random() < policy.resample_rate
+
+    def flush(self) -> None:
+        """Adds the updates since the previous flush to the statistics in the file."""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            for domain, updates in self._updates.items():
+                row = self._conn.execute(
+                    f"SELECT stats FROM {self._table} WHERE domain = ?",  # nosec B608
+                    (domain,),
+                ).fetchone()
+                stats = DomainStats(**json.loads(row[0])) if row else DomainStats()
+                stats.merge(updates)
+                self._conn.execute(
+                    f"INSERT OR REPLACE INTO {self._table} (domain, stats) VALUES (?, ?)",  # nosec B608
+                    (domain, stats.model_dump_json()),
+                )
+            self._conn.commit()
+        except Exception:
+            self._conn.rollback()
+            raise
+        logger.debug(f"Stored the statistics of {len(self._updates)} domains.")
+        self._updates.clear()
@@ -0,0 +1,130 @@
+import json
+import logging
+from pathlib import Path
+from typing import Any, Dict, List
+
+from fraudcrawler.settings import JOURNAL_DEFAULT_DIR
+from fraudcrawler.base.manifest import open_jsonl_for_append
+
+logger = logging.getLogger(__name__)
+
+
+class RunJournal:
+    """Append-only JSONL journal of the completed work of a pipeline run.
+
+    Every completed step (the run parameters, the enriched search_terms, the products of every SERP
+    call, the products with their Zyte details and the classifications) is appended as one line and
+    flushed immediately, such that an interrupted run can be resumed from its journal: the orchestrator
+    replays the journaled steps instead of calling the APIs again (c.f. func:`FraudCrawlerClient.resume`).
+    """
+
+    def __init__(self, run_id: str, directory: Path | str = JOURNAL_DEFAULT_DIR):
+        """Initializes the journal of a run and loads its existing entries.
+
+        Args:
+            run_id: The ID of the run.
+            directory: The directory of the journal files (optional).
+        """
+        self.run_id = run_id
+        self.filename = Path(directory) / f"{run_id}.jsonl"
+        self.params: Dict[str, Any] | None = None
+        self._terms: List[str] | None = None
+        self._serp: Dict[str, List[dict]] = {}
+        self._zyte: Dict[str, dict] = {}
+        self._classified: Dict[str, Dict[str, int]] = {}
+        self.n_replayed = 0
+        self._load()
+        self._file = open_jsonl_for_append(self.filename)
+
+    def _load(self) -> None:
+        """Loads the entries of an existing journal (a truncated last line of a killed run is ignored)."""
+        if not self.filename.exists():
+            return
+        with open(self.filename, "r", encoding="utf-8") as file:
+            for i, line in enumerate(file):
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(
+                        f"Skipping corrupt line {i} of journal {self.filename}"
+                    )
+                    continue
+                event = entry["event"]
+                if event == "run":
+                    self.params = entry["params"]
+                elif event == "enrichment":
+                    self._terms = entry["terms"]
+                elif event == "serp":
+                    self._serp[entry["key"]] = entry["products"]
+                elif event == "zyte":
+                    self._zyte[entry["product"]["url"]] = entry["product"]
+                elif event == "proc":
+                    self._classified[entry["url"]] = entry["classifications"]
+        logger.info(
+            f"Loaded journal of run {self.run_id} ({len(self._serp)} SERP calls, "
+            f"{len(self._zyte)} Zyte calls, {len(self._classified)} classified products)"
+        )
+
+    def _write(self, entry: dict) -> None:
+        self._file.write(json.dumps(entry, default=str) + "\n")
+        self._file.flush()
+
+    @staticmethod
+    def serp_key(item: dict) -> str:
+        """Returns the key of a SERP item (c.f. func:`Orchestrator._add_serp_items_for_search_term`)."""
+        return json.dumps(
+            [item["search_term"], item["num_results"], item.get("start", 0)]
+        )
+
+    def write_params(self, params: Dict[str, Any]) -> None:
+        """Writes the parameters of the run."""
+        self.params = params
+        self._write({"event": "run", "params": params})
+
+    def write_terms(self, terms: List[str]) -> None:
+        """Writes the enriched search_terms."""
+        self._terms = terms
+        self._write({"event": "enrichment", "terms": terms})
+
+    def write_serp(self, key: str, products: List[dict]) -> None:
+        """Writes the products of a SERP call."""
+        self._write({"event": "serp", "key": key, "products": products})
+
+    def write_zyte(self, product: dict) -> None:
+        """Writes a product with its Zyte details (and filtering)."""
+        self._write({"event": "zyte", "product": product})
+
+    def write_classifications(self, url: str, classifications: Dict[str, int]) -> None:
+        """Writes the classifications of a product."""
+        self._write({"event": "proc", "url": url, "classifications": classifications})
+
+    def _replay(self, value: Any) -> Any:
+        if value is not None:
+            self.n_replayed += 1
+        return value
+
+    def terms(self) -> List[str] | None:
+        """Returns the journaled enriched search_terms (None if not journaled)."""
+        return self._replay(self._terms)
+
+    def serp(self, key: str) -> List[dict] | None:
+        """Returns the journaled products of a SERP call (None if not journaled)."""
+        return self._replay(self._serp.get(key))
+
+    def zyte(self, url: str) -> dict | None:
+        """Returns the journaled product with Zyte details of a URL (None if not journaled)."""
+        return self._replay(self._zyte.get(url))
+
+    def classifications(self, url: str) -> Dict[str, int] | None:
+        """Returns the journaled classifications of a product (None if not journaled)."""
+        return self._replay(self._classified.get(url))
+
+    def close(self, remove: bool = False) -> None:
+        """Closes the journal.
+
+        Args:
+            remove: Whether to remove the journal file (e.g. after the run completed) (optional).
+        """
+        self._file.close()
+        if remove:
+            self.filename.unlink(missing_ok=True)
@@ -0,0 +1,195 @@
+import asyncio
+from contextlib import asynccontextmanager
+import logging
+import time
+from typing import (
+    AsyncIterator,
+    Callable,
+    Generic,
+    List,
+    Literal,
+    Sequence,
+    TypeVar,
+)
+
+from fraudcrawler.settings import (
+    KEY_POOL_DEFAULT_COOLDOWN,
+    KEY_POOL_MAX_COOLDOWN,
+    KEY_POOL_POLL_INTERVAL,
+    KEY_POOL_QUARANTINE_STATUS,
+)
+
+logger = logging.getLogger(__name__)
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+
+def split_keys(keys: str | Sequence[str]) -> List[str]:
+    """Splits a comma separated string of keys (e.g. from an `.env` file) into a list of keys."""
+    if isinstance(keys, str):
+        keys = keys.split(",")
+    return [key.strip() for key in keys if key.strip()]
+
+
+def api_key_pool(keys: "str | Sequence[str] | KeyPool[str]") -> "KeyPool[str]":
+    """Returns the given pool or a new default pool of the given (comma separated) API keys."""
+    if isinstance(keys, KeyPool):
+        return keys
+    return KeyPool(split_keys(keys))
+
+
+class CredentialError(Exception):
+    """Auth or quota error of a credential reported within the response body instead of the HTTP status."""
+
+    def __init__(self, message: str, status: int):
+        super().__init__(message)
+        self.status = status
+
+
+class KeyPoolExhausted(RuntimeError):
+    """All keys of a pool have used up their call quota."""
+
+
+class KeyPool(Generic[K]):
+    """Pool of the credentials (API keys, accounts or pre-built clients) of one provider.
+
+    Every call acquires a key (c.f. func:`acquire`): either the least loaded key (fewest calls in flight,
+    then fewest calls) or the next key in round-robin order. Keys with `max_in_flight` calls in flight or
+    `max_calls` calls done are skipped. A key whose call fails with an auth or quota error (HTTP status
+    401, 402, 403 or 429) is quarantined for `cooldown` seconds, doubling with every further error, and
+    is used again afterwards. A pool of a single key behaves like the key itself.
+    """
+
+    def __init__(
+        self,
+        keys: Sequence[K],
+        max_in_flight: int | None = None,
+        max_calls: int | None = None,
+        strategy: Literal["least_loaded", "round_robin"] = "least_loaded",
+        cooldown: float = KEY_POOL_DEFAULT_COOLDOWN,
+    ):
+        """Initializes the pool.
+
+        Args:
+            keys: The credentials of the pool.
+            max_in_flight: The maximal number of concurrent calls per key (optional).
+            max_calls: The maximal number of calls per key, e.g. its monthly quota (optional).
+            strategy: Select the least loaded key or the keys in round-robin order.
+            cooldown: Time (in seconds) a key is quarantined after its first auth or quota error.
+        """
+        if not keys:
+            raise ValueError("A key pool needs at least one key")
+        self._keys = list(keys)
+        self._max_in_flight = max_in_flight
+        self._max_calls = max_calls
+        self._strategy = strategy
+        self._cooldown = cooldown
+        self._rotation = 0
+        self.in_flight = [0] * len(self._keys)
+        self.n_calls = [0] * len(self._keys)
+        self.n_quarantined = [0] * len(self._keys)
+        self._strikes = [0] * len(self._keys)
+        self._until = [0.0] * len(self._keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def map(self, func: Callable[[K], V]) -> "KeyPool[V]":
+        """Returns a new pool (with the same settings) of the transformed keys, e.g. one client per API key."""
+        return KeyPool(
+            [func(key) for key in self._keys],
+            max_in_flight=self._max_in_flight,
+            max_calls=self._max_calls,
+            strategy=self._strategy,
+            cooldown=self._cooldown,
+        )
+
+    def _available(self, idx: int, now: float) -> bool:
+        """Whether the key at `idx` is neither quarantined nor at its quota."""
+        if self._until[idx] > now:
+            return False
+        if self._max_calls is not None and self.n_calls[idx] >= self._max_calls:
+            return False
+        return self._max_in_flight is None or self.in_flight[idx] < self._max_in_flight
+
+    def _exhausted(self) -> bool:
+        return self._max_calls is not None and min(self.n_calls) >= self._max_calls
+
+    def select(self) -> K | None:
+        """Returns the next available key (c.f. `strategy`) or None if all keys are busy or quarantined."""
+        idx = self._select()
+        return None if idx is None else self._keys[idx]
+
+    def _select(self) -> int | None:
+        now = time.monotonic()
+        if self._strategy == "round_robin":
+            for _ in range(len(self._keys)):
+                idx = self._rotation
+                self._rotation = (idx + 1) % len(self._keys)
+                if self._available(idx, now):
+                    return idx
+            return None
+        available = [i for i in range(len(self._keys)) if self._available(i, now)]
+        if not available:
+            return None
+        return min(available, key=lambda i: (self.in_flight[i], self.n_calls[i]))
+
+    def quarantined(self) -> List[K]:
+        """Returns the keys which are currently quarantined."""
+        now = time.monotonic()
+        return [key for key, until in zip(self._keys, self._until) if until > now]
+
+    def quarantine(self, key: K) -> None:
+        """Quarantines a key after an auth or quota error (c.f. class docstring)."""
+        self._quarantine(self._index(key))
+
+    def _quarantine(self, idx: int) -> None:
+        self._strikes[idx] += 1
+        self.n_quarantined[idx] += 1
+        cooldown = min(
+            self._cooldown * 2 ** (self._strikes[idx] - 1), KEY_POOL_MAX_COOLDOWN
+        )
+        self._until[idx] = time.monotonic() + cooldown
+        logger.warning(
+            f"Quarantined key #{idx} of {len(self._keys)} for {cooldown:.0f}s after an auth or quota error"
+        )
+
+    def _index(self, key: K) -> int:
+        for idx, k in enumerate(self._keys):
+            if k is key or k == key:
+                return idx
+        raise ValueError("Unknown key")
+
+    @staticmethod
+    def is_credential_error(err: BaseException) -> bool:
+        """Whether an exception is an auth or quota error of the used key (aiohttp, OpenAI or class:`CredentialError`)."""
+        status = getattr(err, "status", None) or getattr(err, "status_code", None)
+        return status in KEY_POOL_QUARANTINE_STATUS
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[K]:
+        """Yields a key for one call, waiting while all keys are busy or quarantined.
+
+        The key is quarantined if the call raises an auth or quota error (c.f. func:`is_credential_error`)
+        and the pool has other keys to use meanwhile; a single key is left to the retries of the client.
+        """
+        while (idx := self._select()) is None:
+            if self._exhausted():
+                raise KeyPoolExhausted(
+                    f"All {len(self._keys)} keys used up their quota of {self._max_calls} calls"
+                )
+            await asyncio.sleep(KEY_POOL_POLL_INTERVAL)
+        key = self._keys[idx]
+        self.in_flight[idx] += 1
+        self.n_calls[idx] += 1
+        try:
+            yield key
+        except BaseException as err:
+            if len(self._keys) > 1 and self.is_credential_error(err):
+                self._quarantine(idx)
+            raise
+        else:
+            self._strikes[idx] = 0
+        finally:
+            self.in_flight[idx] -= 1
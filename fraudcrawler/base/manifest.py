@@ -0,0 +1,125 @@
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Dict, List, Sequence, Set, TextIO
+
+import pandas as pd
+
+try:
+    import pyarrow
+except ImportError:  # pragma: no cover - pyarrow is optional
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+
+def _is_parquet(filename: Path) -> bool:
+    """Whether a manifest is a Parquet file (which requires the optional dependency `pyarrow`)."""
+    if filename.suffix != ".parquet":
+        return False
+    if pyarrow is None:
+        raise ImportError(
+            f"Parquet manifest {filename} requires pyarrow; install it with "
+            "`pip install vianu-fraudcrawler[parquet]` or use a JSONL manifest"
+        )
+    return True
+
+
+def open_jsonl_for_append(filename: Path) -> TextIO:
+    """Opens a JSONL file for appending, terminating a truncated last line (e.g. of a killed process) first."""
+    filename.parent.mkdir(parents=True, exist_ok=True)
+    if filename.exists() and filename.stat().st_size > 0:
+        with open(filename, "rb+") as file:
+            file.seek(-1, os.SEEK_END)
+            if file.read(1) != b"\n":
+                file.write(b"\n")
+    return open(filename, "a", encoding="utf-8")
+
+
+def read_records(filename: Path | str, json_columns: Sequence[str] = ()) -> List[dict]:
+    """Reads the records of a manifest (JSONL, or Parquet if the file ends with `.parquet`).
+
+    A truncated last line of a JSONL manifest (e.g. of a killed stage) is ignored.
+
+    Args:
+        filename: The manifest file.
+        json_columns: The (nested) columns stored as JSON strings in Parquet manifests (optional).
+    """
+    filename = Path(filename)
+    if not filename.exists():
+        return []
+    if _is_parquet(filename):
+        df = pd.read_parquet(filename)
+        df = df.astype(object).where(df.notna(), None)
+        records = df.to_dict(orient="records")
+        for rec in records:
+            for col in json_columns:
+                if isinstance(rec.get(col), str):
+                    rec[col] = json.loads(rec[col])
+        return records
+
+    records = []
+    with open(filename, "r", encoding="utf-8") as file:
+        for i, line in enumerate(file):
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping corrupt line {i} of manifest {filename}")
+    return records
+
+
+class ManifestWriter:
+    """Writes records with unique `record_id`s to a manifest (JSONL, or Parquet if the file ends with `.parquet`).
+
+    Records whose ID is already in the manifest are skipped, such that re-running a stage is
+    idempotent. JSONL records are appended (and flushed) one by one, such that a retried stage
+    continues where it stopped; Parquet manifests are (re-)written on func:`close`.
+    """
+
+    def __init__(self, filename: Path | str, json_columns: Sequence[str] = ()):
+        """Initializes the writer and loads the IDs of the existing records.
+
+        Args:
+            filename: The manifest file.
+            json_columns: The (nested) columns stored as JSON strings in Parquet manifests (optional).
+        """
+        self.filename = Path(filename)
+        self._json_columns = json_columns
+        self._parquet = _is_parquet(self.filename)
+        existing = read_records(self.filename, json_columns=json_columns)
+        self._records: List[dict] = existing if self._parquet else []
+        self.record_ids: Set[str] = {rec["record_id"] for rec in existing}
+        self.n_written = 0
+        self._file = None if self._parquet else open_jsonl_for_append(self.filename)
+
+    def __contains__(self, record_id: str) -> bool:
+        return record_id in self.record_ids
+
+    def write(self, record: Dict) -> bool:
+        """Writes a record (if its ID is not yet in the manifest) and returns whether it was written.
+
+        Args:
+            record: The record (with a `record_id`).
+        """
+        if record["record_id"] in self.record_ids:
+            return False
+        self.record_ids.add(record["record_id"])
+        self.n_written += 1
+        if self._file is None:
+            self._records.append(record)
+        else:
+            self._file.write(json.dumps(record, default=str) + "\n")
+            self._file.flush()
+        return True
+
+    def close(self) -> None:
+        """Closes the manifest (and writes the Parquet file)."""
+        if self._file is not None:
+            self._file.close()
+            return
+        records = [
+            {k: json.dumps(v) if k in self._json_columns else v for k, v in rec.items()}
+            for rec in self._records
+        ]
+        pd.DataFrame(records).to_parquet(self.filename, index=False)
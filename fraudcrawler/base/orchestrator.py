@@ -1,8 +1,15 @@
 from abc import ABC, abstractmethod
 import asyncio
+from contextlib import asynccontextmanager
+import hashlib
+import json
 import logging
+from pathlib import Path
+import time
+import uuid
+from openai import AsyncOpenAI
 from pydantic import BaseModel, Field
-from typing import Dict, List, Set, cast
+from typing import Any, AsyncIterator, Callable, Coroutine, Dict, List, Set, cast
 
 from fraudcrawler.settings import PROCESSOR_DEFAULT_MODEL, MAX_RETRIES, RETRY_DELAY
 from fraudcrawler.settings import (
@@ -10,12 +17,37 @@ from fraudcrawler.settings import (
     DEFAULT_N_ZYTE_WKRS,
     DEFAULT_N_PROC_WKRS,
 )
-from fraudcrawler.settings import PRODUCT_ITEM_DEFAULT_IS_RELEVANT
+from fraudcrawler.settings import PROCESSOR_SKIPPED, PRODUCT_ITEM_DEFAULT_IS_RELEVANT
+from fraudcrawler.settings import (
+    PRIORITY_DOMAIN_YIELD_WEIGHT,
+    PRIORITY_MARKETPLACE_WEIGHT,
+    PRIORITY_RANK_WEIGHT,
+    PRIORITY_SEARCH_TERM_TYPE,
+    PRIORITY_ZERO_YIELD_PENALTY,
+)
 from fraudcrawler.base.base import Deepness, Host, Language, Location, Prompt
+from fraudcrawler.base.adaptive import AdaptiveDepthTracker
+from fraudcrawler.base.autoscale import Autoscaler, Autoscaling, StageStats, WorkerPool
+from fraudcrawler.base.backends import DedupIndex, QueueBackend, RateBudget
+from fraudcrawler.base.cache import Cache
+from fraudcrawler.base.domains import DomainPolicy, DomainStatsStore
+from fraudcrawler.base.journal import RunJournal
+from fraudcrawler.base.keys import KeyPool
+from fraudcrawler.base.manifest import ManifestWriter, read_records
+from fraudcrawler.base.queues import PriorityQueue, SharedQueue
+from fraudcrawler.processing.batch import BatchClassifier
+from fraudcrawler.processing.local import LocalClassifierTier
+from fraudcrawler.processing.snippet import SnippetFilter
+from fraudcrawler.processing.tokens import TokenUsage
+from fraudcrawler.scraping.terms import TermDeduplicator
 from fraudcrawler import SerpApi, Enricher, ZyteApi, Processor
+from fraudcrawler.processing.processor import Cascade, CascadeStats
 
 logger = logging.getLogger(__name__)
 
+# The nested fields of the products, stored as JSON strings in Parquet manifests
+_MANIFEST_JSON_FIELDS = ("serp_extensions", "product_images", "classifications")
+
 
 class ProductItem(BaseModel):
     """Model representing a product item."""
@@ -26,6 +58,11 @@ class ProductItem(BaseModel):
     url: str
     marketplace_name: str
     domain: str
+    serp_rank: int | None = None
+    serp_position: int | None = None
+    serp_title: str | None = None
+    serp_snippet: str | None = None
+    serp_extensions: Dict[str, Any] = Field(default_factory=dict)
 
     # Zyte parameters
     product_name: str | None = None
@@ -42,6 +79,11 @@ class ProductItem(BaseModel):
     filtered_at_stage: str | None = None
     is_relevant: int = PRODUCT_ITEM_DEFAULT_IS_RELEVANT
 
+    @property
+    def record_id(self) -> str:
+        """The ID of the product item (derived from its URL, which is unique within a run)."""
+        return hashlib.sha256(self.url.encode("utf-8")).hexdigest()[:16]
+
 
 class Orchestrator(ABC):
     """Abstract base class for orchestrating the different actors (crawling, processing).
@@ -55,70 +97,241 @@ class Orchestrator(ABC):
 
     For each pipeline step class:`Orchestrator` will deploy a number of async workers to handle the tasks.
     In addition it makes sure to orchestrate the canceling of the workers only after the relevant workload is done.
+    The queues of the pipeline are priority queues: search terms and products of higher value (c.f. func:`_priority`)
+    are processed first and, if `max_queue_size` is set, the lowest priority products are shed under overload.
 
     For more information on the orchestrating pattern see README.md.
     """
 
     def __init__(
         self,
-        serpapi_key: str,
-        dataforseo_user: str,
-        dataforseo_pwd: str,
-        zyteapi_key: str,
-        openaiapi_key: str,
+        serpapi_key: str | List[str] | KeyPool[str],
+        dataforseo_user: str | List[str],
+        dataforseo_pwd: str | List[str],
+        zyteapi_key: str | List[str] | KeyPool[str],
+        openaiapi_key: str | List[str] | KeyPool[str],
         openai_model: str = PROCESSOR_DEFAULT_MODEL,
         max_retries: int = MAX_RETRIES,
         retry_delay: int = RETRY_DELAY,
         n_serp_wkrs: int = DEFAULT_N_SERP_WKRS,
         n_zyte_wkrs: int = DEFAULT_N_ZYTE_WKRS,
         n_proc_wkrs: int = DEFAULT_N_PROC_WKRS,
+        cache: Cache | None = None,
+        autoscaling: Autoscaling | None = None,
+        max_queue_size: int | None = None,
+        domain_stats: DomainStatsStore | None = None,
+        domain_policy: DomainPolicy | None = None,
+        snippet_filter: SnippetFilter | None = None,
+        local_classifier: LocalClassifierTier | None = None,
+        cascade: Cascade | None = None,
+        batch: BatchClassifier | None = None,
+        queue_backend: QueueBackend | None = None,
+        dedup_index: DedupIndex | None = None,
+        rate_budget: RateBudget | None = None,
+        node_id: str | None = None,
+        serpapi: SerpApi | None = None,
+        enricher: Enricher | None = None,
+        zyteapi: ZyteApi | None = None,
+        openai_client: AsyncOpenAI | KeyPool[AsyncOpenAI] | None = None,
     ):
         """Initializes the orchestrator with the given settings.
 
         Args:
-            serpapi_key: The API key for SERP API.
-            dataforseo_user: The user for DataForSEO.
-            dataforseo_pwd: The password for DataForSEO.
-            zyteapi_key: The API key for Zyte API.
-            openaiapi_key: The API key for OpenAI.
+            serpapi_key: The API key for SERP API (or several keys, c.f. class:`KeyPool`).
+            dataforseo_user: The user for DataForSEO (or the users of several accounts).
+            dataforseo_pwd: The password for DataForSEO (or the passwords of the accounts).
+            zyteapi_key: The API key for Zyte API (or several keys).
+            openaiapi_key: The API key for OpenAI (or several keys).
             openai_model: The model to use for the processing (optional).
             max_retries: Maximum number of retries for API calls (optional).
             retry_delay: Delay between retries in seconds (optional).
             n_serp_wkrs: Number of async workers for serp (optional).
             n_zyte_wkrs: Number of async workers for zyte (optional).
             n_proc_wkrs: Number of async workers for the processor (optional).
+            cache: The cache for the SerpApi and DataForSEO responses and the classifications (optional).
+            autoscaling: Scale the number of workers per stage while running (optional).
+            max_queue_size: Max number of products waiting for zyte or processing before shedding the lowest priority ones (optional).
+            domain_stats: The persistent per-domain statistics, updated with the results of every run (optional).
+            domain_policy: The policy for domains with a proven zero yield in `domain_stats` (optional).
+            snippet_filter: Drops clearly irrelevant search results by their title and snippet before Zyte (optional).
+            local_classifier: Local classifiers answering the confident cases before OpenAI (optional).
+            cascade: Classify with a cheap model first and escalate only the uncertain answers to `openai_model` (optional).
+            batch: Classify all products in batches after the crawling instead of calling OpenAI per product (optional).
+            queue_backend: The shared backend of the serp, zyte and proc queues, for sharing the work of a run between several nodes (optional).
+            dedup_index: The shared index of the collected URLs (and queued SERP items) of the nodes (optional).
+            rate_budget: The (shared) budget of the calls per second of the "serp", "zyte" and "proc" stages (optional).
+            node_id: The ID of this node among the nodes sharing the `queue_backend`; a restarted node must reuse the ID of the crashed one (optional).
+            serpapi: A pre-built (e.g. warm) SerpApi client replacing the one of `serpapi_key` (optional).
+            enricher: A pre-built Enricher replacing the one of the DataForSEO credentials (optional).
+            zyteapi: A pre-built ZyteApi client replacing the one of `zyteapi_key` (optional).
+            openai_client: A pre-built OpenAI client (or a pool of them) used by the processor instead of the ones of `openaiapi_key` (optional).
         """
         # Setup the variables
         self._collected_urls_current_run: Set[str] = set()
         self._collected_urls_previous_runs: Set[str] = set()
+        self._term_dedup = TermDeduplicator()
+        self._domain_yield: Dict[str, List[int]] = {}
+        self._depth_tracker: AdaptiveDepthTracker | None = None
+        self._journal: RunJournal | None = None
+        self._domain_stats = domain_stats
+        self._domain_policy = domain_policy
+        self._snippet_filter = snippet_filter
+        self._batch = batch
+        self._batch_products: List[ProductItem] = []
+        self._queue_backend = queue_backend
+        self._dedup_index = dedup_index
+        self._rate_budget = rate_budget
+        self._node_id = node_id or uuid.uuid4().hex
+        self._stream_queue: asyncio.Queue[ProductItem | None] | None = None
 
         # Setup the clients
-        self._serpapi = SerpApi(
-            api_key=serpapi_key, max_retries=max_retries, retry_delay=retry_delay
+        self._serpapi = serpapi or SerpApi(
+            api_key=serpapi_key,
+            max_retries=max_retries,
+            retry_delay=retry_delay,
+            cache=cache,
+        )
+        self._enricher = enricher or Enricher(
+            user=dataforseo_user, pwd=dataforseo_pwd, cache=cache
         )
-        self._enricher = Enricher(user=dataforseo_user, pwd=dataforseo_pwd)
-        self._zyteapi = ZyteApi(
+        self._zyteapi = zyteapi or ZyteApi(
             api_key=zyteapi_key, max_retries=max_retries, retry_delay=retry_delay
         )
-        self._processor = Processor(api_key=openaiapi_key, model=openai_model)
+        self._processor = Processor(
+            api_key=openaiapi_key,
+            client=openai_client,
+            model=openai_model,
+            local_tier=local_classifier,
+            cascade=cascade,
+            cache=cache,
+        )
 
         # Setup the async framework
         self._n_serp_wkrs = n_serp_wkrs
         self._n_zyte_wkrs = n_zyte_wkrs
         self._n_proc_wkrs = n_proc_wkrs
+        self._autoscaling = autoscaling
+        self._max_queue_size = max_queue_size
         self._queues: Dict[str, asyncio.Queue] | None = None
-        self._workers: Dict[str, List[asyncio.Task] | asyncio.Task] | None = None
+        self._workers: Dict[str, WorkerPool | asyncio.Task] | None = None
+        self._stats: Dict[str, StageStats] = {}
+
+    @staticmethod
+    def _serp_priority(item: dict) -> float:
+        """Computes the priority of a serp item (initial search_terms before enriched ones)."""
+        return PRIORITY_SEARCH_TERM_TYPE.get(item["search_term_type"], 0.0)
+
+    def _priority(self, product: ProductItem) -> float:
+        """Computes the priority of a product.
+
+        The priority is the weighted sum of the search_term_type, the inverse SERP rank, the membership in
+        the given marketplaces and the (smoothed) share of relevant products of its domain in the current run.
+        """
+        priority = PRIORITY_SEARCH_TERM_TYPE.get(product.search_term_type, 0.0)
+        if product.serp_rank:
+            priority += PRIORITY_RANK_WEIGHT / product.serp_rank
+        if product.marketplace_name != self._serpapi._default_marketplace_name:
+            priority += PRIORITY_MARKETPLACE_WEIGHT
+        n_relevant, n_total = self._domain_yield.get(product.domain, [0, 0])
+        priority += PRIORITY_DOMAIN_YIELD_WEIGHT * (n_relevant + 1) / (n_total + 2)
+        if (
+            self._domain_policy is not None
+            and self._domain_policy.action == "deprioritize"
+        ):
+            if self._is_zero_yield(product.domain):
+                priority -= PRIORITY_ZERO_YIELD_PENALTY
+        return priority
+
+    def _update_domain_yield(self, product: ProductItem) -> None:
+        """Updates the share of relevant products of the product's domain."""
+        counts = self._domain_yield.setdefault(product.domain, [0, 0])
+        counts[0] += int(product.is_relevant == 1)
+        counts[1] += 1
+
+    def _is_zero_yield(self, domain: str) -> bool:
+        """Checks whether a domain has a proven zero yield in the domain statistics (c.f. class:`DomainPolicy`)."""
+        if self._domain_stats is None or self._domain_policy is None:
+            return False
+        return self._domain_stats.is_zero_yield(
+            domain=domain, policy=self._domain_policy
+        )
+
+    def _skip_domain(self, domain: str) -> bool:
+        """Checks whether the products of a domain are skipped (zero yield domains, except for the resampled ones)."""
+        if self._domain_policy is None or self._domain_policy.action != "skip":
+            return False
+        if not self._is_zero_yield(domain):
+            return False
+        if self._domain_stats is not None and self._domain_stats.resample(
+            policy=self._domain_policy
+        ):
+            logger.debug(f"Resampling zero yield domain {domain}")
+            return False
+        return True
+
+    def _update_domain_stats(self, product: ProductItem) -> None:
+        """Adds a product seen by Zyte (and classified or filtered by the probability threshold) to the domain statistics."""
+        if self._domain_stats is None or product.probability is None:
+            return
+        kept = product.filtered_at_stage != "Zyte probability threshold"
+        if kept and not product.classifications:
+            # Products shed or failed before the classification carry no information on the yield
+            return
+        self._domain_stats.update(
+            domain=product.domain,
+            kept=kept,
+            classifications=product.classifications,
+            is_relevant=product.is_relevant == 1,
+        )
+
+    @staticmethod
+    def _is_relevant(product: ProductItem) -> int:
+        """A product is relevant (1) if all its (not skipped) classifications are positive, not relevant (0) otherwise."""
+        classes = [
+            cls for cls in product.classifications.values() if cls != PROCESSOR_SKIPPED
+        ]
+        if not classes:
+            return PRODUCT_ITEM_DEFAULT_IS_RELEVANT
+        return int(all(cls > 0 for cls in classes))
+
+    @staticmethod
+    def _shed(product: ProductItem, queue: asyncio.Queue[ProductItem | None]) -> None:
+        """Marks a product shed from an overloaded queue as filtered and puts it into the given queue."""
+        logger.debug(f"Shedding product with url={product.url} due to overload")
+        product.filtered = True
+        product.filtered_at_stage = "Priority shedding (overload)"
+        queue.put_nowait(product)
+
+    @asynccontextmanager
+    async def _slot(self, stage: str) -> AsyncIterator[None]:
+        """Wraps an API call of a stage (waiting for the rate budget, if any)."""
+        if self._rate_budget is not None:
+            await self._rate_budget.acquire(stage)
+        yield
+
+    async def _claim(self, key: str) -> bool:
+        """Claims a unit of work shared with the other nodes (e.g. a SERP item) and returns whether this node does it."""
+        if self._queue_backend is None or self._dedup_index is None:
+            return True
+        return await self._dedup_index.call(self._dedup_index.add, key)
+
+    def _record_call(self, stage: str, start: float, error: bool = False) -> None:
+        """Records the latency and outcome of a call of a stage (c.f. class:`StageStats`)."""
+        if stats := self._stats.get(stage):
+            stats.record(start=start, error=error)
 
     async def _serp_execute(
         self,
         queue_in: asyncio.Queue[dict | None],
         queue_out: asyncio.Queue[ProductItem | None],
+        queue_bypass: asyncio.Queue[ProductItem | None],
     ) -> None:
         """Collects the SerpApi search setups from the queue_in, executes the search, filters the results (country_code) and puts them into queue_out.
 
         Args:
             queue_in: The input queue containing the search parameters.
             queue_out: The output queue to put the found urls.
+            queue_bypass: The output queue to put the filtered products (bypassing all later stages).
         """
         while True:
             item = await queue_in.get()
@@ -126,37 +339,76 @@ class Orchestrator(ABC):
                 queue_in.task_done()
                 break
 
-            try:
-                search_term_type = item.pop("search_term_type")
-                results = await self._serpapi.apply(**item)
-                logger.debug(
-                    f"SERP API search for {item['search_term']} returned {len(results)} results"
-                )
-                for res in results:
-                    product = ProductItem(
-                        search_term=item["search_term"],
-                        search_term_type=search_term_type,
-                        url=res.url,
-                        marketplace_name=res.marketplace_name,
-                        domain=res.domain,
-                        filtered=res.filtered,
-                        filtered_at_stage=res.filtered_at_stage,
+            start = time.monotonic()
+            products: List[ProductItem] | None = None
+            key = RunJournal.serp_key(item)
+            journaled = self._journal.serp(key) if self._journal else None
+            search_term_type = item.pop("search_term_type")
+            if journaled is not None:
+                products = [ProductItem(**p) for p in journaled]
+            else:
+                try:
+                    async with self._slot(stage="serp"):
+                        start = time.monotonic()
+                        results = await self._serpapi.apply(**item)
+                    self._record_call(stage="serp", start=start)
+                    logger.debug(
+                        f"SERP API search for {item['search_term']} returned {len(results)} results"
                     )
+                    products = [
+                        ProductItem(
+                            search_term=item["search_term"],
+                            search_term_type=search_term_type,
+                            url=res.url,
+                            marketplace_name=res.marketplace_name,
+                            domain=res.domain,
+                            serp_rank=res.rank,
+                            serp_position=res.position,
+                            serp_title=res.title,
+                            serp_snippet=res.snippet,
+                            serp_extensions=res.extensions,
+                            filtered=res.filtered,
+                            filtered_at_stage=res.filtered_at_stage,
+                        )
+                        for res in results
+                    ]
+                    if self._journal is not None:
+                        self._journal.write_serp(
+                            key=key, products=[p.model_dump() for p in products]
+                        )
+                except Exception as e:
+                    self._record_call(stage="serp", start=start, error=True)
+                    logger.error(f"Error executing SERP API search: {e}")
+
+            # The page is registered before its products are passed on (c.f. class:`AdaptiveDepthTracker`)
+            products = products or []
+            self._page_fetched(
+                search_term=item["search_term"],
+                n_results=len(products),
+                queue=queue_in,
+            )
+            for product in products:
+                if product.filtered:
+                    await queue_bypass.put(product)
+                else:
                     await queue_out.put(product)
-            except Exception as e:
-                logger.error(f"Error executing SERP API search: {e}")
             queue_in.task_done()
 
     async def _collect_url(
         self,
         queue_in: asyncio.Queue[ProductItem | None],
         queue_out: asyncio.Queue[ProductItem | None],
+        queue_bypass: asyncio.Queue[ProductItem | None],
     ) -> None:
         """Collects the URLs from the given queue_in, checks for duplicates, and puts them into the queue_out.
 
+        The URLs are collected by a single worker in the order they arrive, such that the first occurrence
+        of a URL is kept and all later ones are filtered.
+
         Args:
             queue_in: The input queue containing the URLs.
             queue_out: The output queue to put the URLs.
+            queue_bypass: The output queue to put the filtered products (bypassing all later stages).
         """
         while True:
             product = await queue_in.get()
@@ -181,22 +433,41 @@ class Orchestrator(ABC):
                         "URL collection (previous run deduplication)"
                     )
                     logger.debug(f"URL {url} as already collected in previous run")
+                elif self._skip_domain(product.domain):
+                    # skip domains that never yielded a relevant product
+                    product.filtered = True
+                    product.filtered_at_stage = "URL collection (zero yield domain)"
+                    logger.debug(f"URL {url} skipped as zero yield domain")
+                elif self._dedup_index is not None and not await self._dedup_index.call(
+                    self._dedup_index.add, url
+                ):
+                    # deduplicate on the other nodes sharing the run
+                    product.filtered = True
+                    product.filtered_at_stage = "URL collection (shared deduplication)"
+                    logger.debug(f"URL {url} already collected by another node")
                 else:
                     self._collected_urls_current_run.add(url)
 
-            await queue_out.put(product)
+            if product.filtered:
+                await queue_bypass.put(product)
+            else:
+                await queue_out.put(product)
             queue_in.task_done()
 
     async def _zyte_execute(
         self,
         queue_in: asyncio.Queue[ProductItem | None],
         queue_out: asyncio.Queue[ProductItem | None],
+        queue_bypass: asyncio.Queue[ProductItem | None],
     ) -> None:
         """Collects the URLs from the queue_in, enriches it with product details metadata, filters them (probability), and puts them into queue_out.
 
+        If a snippet filter is configured, the search results it drops are filtered before the Zyte request.
+
         Args:
             queue_in: The input queue containing URLs to fetch product details from.
             queue_out: The output queue to put the product details as dictionaries.
+            queue_bypass: The output queue to put the filtered products (bypassing all later stages).
         """
         while True:
             product = await queue_in.get()
@@ -204,36 +475,74 @@ class Orchestrator(ABC):
                 queue_in.task_done()
                 break
 
-            if not product.filtered:
-                try:
-                    # Fetch the product details from Zyte API
-                    details = await self._zyteapi.get_details(url=product.url)
-                    product.product_name = self._zyteapi.extract_product_name(
-                        details=details
-                    )
-                    product.product_price = self._zyteapi.extract_product_price(
-                        details=details
-                    )
-                    product.product_description = (
-                        self._zyteapi.extract_product_description(details=details)
-                    )
-                    product.product_images = self._zyteapi.extract_image_urls(
-                        details=details
-                    )
-                    product.probability = self._zyteapi.extract_probability(
-                        details=details
-                    )
+            journaled = self._journal.zyte(product.url) if self._journal else None
+            if journaled is not None:
+                product = ProductItem(**journaled)
+            elif await self._fetch_details(product) and self._journal is not None:
+                self._journal.write_zyte(product=product.model_dump())
 
-                    # Filter the product based on the probability threshold
-                    if not self._zyteapi.keep_product(details=details):
-                        product.filtered = True
-                        product.filtered_at_stage = "Zyte probability threshold"
+            if product.filtered:
+                await queue_bypass.put(product)
+            else:
+                await queue_out.put(product)
+            queue_in.task_done()
 
-                except Exception as e:
-                    logger.warning(f"Error executing Zyte API search: {e}.")
+    async def _fetch_details(self, product: ProductItem) -> bool:
+        """Fetches the product details from Zyte API and filters the product (snippet, probability).
 
-            await queue_out.put(product)
-            queue_in.task_done()
+        Returns False if the Zyte API call failed.
+
+        Args:
+            product: The product to enrich with its details.
+        """
+        if not product.filtered and not await self._keep_snippet(product):
+            product.filtered = True
+            product.filtered_at_stage = "SERP snippet pre-classification"
+
+        if not product.filtered:
+            start = time.monotonic()
+            try:
+                # Fetch the product details from Zyte API
+                async with self._slot(stage="zyte"):
+                    start = time.monotonic()
+                    details = await self._zyteapi.get_details(url=product.url)
+                self._record_call(stage="zyte", start=start)
+                product.product_name = self._zyteapi.extract_product_name(
+                    details=details
+                )
+                product.product_price = self._zyteapi.extract_product_price(
+                    details=details
+                )
+                product.product_description = self._zyteapi.extract_product_description(
+                    details=details
+                )
+                product.product_images = self._zyteapi.extract_image_urls(
+                    details=details
+                )
+                product.probability = self._zyteapi.extract_probability(details=details)
+
+                # Filter the product based on the probability threshold
+                if not self._zyteapi.keep_product(details=details):
+                    product.filtered = True
+                    product.filtered_at_stage = "Zyte probability threshold"
+
+            except Exception as e:
+                self._record_call(stage="zyte", start=start, error=True)
+                logger.warning(f"Error executing Zyte API search: {e}.")
+                return False
+        return True
+
+    async def _keep_snippet(self, product: ProductItem) -> bool:
+        """Checks with the snippet filter (if any) whether a product is worth its Zyte request."""
+        if self._snippet_filter is None:
+            return True
+        try:
+            return await self._snippet_filter.keep(
+                url=product.url, title=product.serp_title, snippet=product.serp_snippet
+            )
+        except Exception as e:
+            logger.warning(f"Error pre-classifying snippet of {product.url}: {e}.")
+            return True
 
     async def _proc_execute(
         self,
@@ -250,7 +559,7 @@ class Orchestrator(ABC):
         """
 
         # Process the products
-
+        levels = self._processor.order_prompts(prompts)
         while True:
             product = await queue_in.get()
             if product is None:
@@ -258,28 +567,180 @@ class Orchestrator(ABC):
                 queue_in.task_done()
                 break
 
+            if not product.filtered and self._journal is not None:
+                journaled = self._journal.classifications(product.url)
+                if journaled is not None:
+                    product.classifications.update(journaled)
+                    product.is_relevant = self._is_relevant(product)
+                    await queue_out.put(product)
+                    queue_in.task_done()
+                    continue
+
+            if not product.filtered and self._batch is not None:
+                # The product is classified in the batch after the crawling
+                self._batch_products.append(product)
+                queue_in.task_done()
+                continue
+
             if not product.filtered:
-                try:
-                    url = product.url
-                    name = product.product_name
-                    description = product.product_description
-
-                    # Run all the configured prompts
-                    for prompt in prompts:
-                        logger.debug(
-                            f"Classify product {name} with prompt {prompt.name}"
-                        )
-                        classification = await self._processor.classify(
-                            prompt=prompt,
-                            url=url,
-                            name=name,
-                            description=description,
-                        )
-                        product.classifications[prompt.name] = classification
-                except Exception as e:
-                    logger.warning(f"Error processing product: {e}.")
+                classified = await self._classify_product(
+                    product=product, levels=levels
+                )
+                # Products without details or with failed classifications are not journaled
+                # (their Zyte call or classification is repeated on resume)
+                if (
+                    classified
+                    and self._journal is not None
+                    and product.product_name
+                    and product.product_description
+                ):
+                    self._journal.write_classifications(
+                        url=product.url, classifications=product.classifications
+                    )
+
+            await queue_out.put(product)
+            queue_in.task_done()
+
+    async def _classify_product(
+        self, product: ProductItem, levels: List[List[Prompt]]
+    ) -> bool:
+        """Classifies a product with all prompts (c.f. func:`Processor.classify_all`).
+
+        Returns False if a classification failed (the product keeps the fallbacks of the failed prompts).
+
+        Args:
+            product: The product to classify.
+            levels: The levels of prompts (c.f. func:`Processor.order_prompts`).
+        """
+        start = time.monotonic()
+        failed: Set[str] = set()
+        try:
+            name = product.product_name
+            logger.debug(
+                f"Classify product {name} with {sum(map(len, levels))} prompts"
+            )
+            async with self._slot(stage="proc"):
+                start = time.monotonic()
+                classifications = await self._processor.classify_all(
+                    prompts=levels,
+                    url=product.url,
+                    name=name,
+                    description=product.product_description,
+                    failed=failed,
+                )
+            product.classifications.update(classifications)
+            product.is_relevant = self._is_relevant(product)
+            self._record_call(stage="proc", start=start)
+        except Exception as e:
+            self._record_call(stage="proc", start=start, error=True)
+            logger.warning(f"Error processing product: {e}.")
+            return False
+        return not failed
 
+    async def _classify_batch(
+        self, prompts: List[Prompt], queue_out: asyncio.Queue[ProductItem | None]
+    ) -> Set[str]:
+        """Classifies the products collected by the proc workers in batches and puts them into queue_out.
+
+        Returns the record IDs of the products whose classification failed.
+
+        Args:
+            prompts: The list of prompts to use for classification.
+            queue_out: The output queue to put the classified products.
+        """
+        if self._batch is None:
+            return set()
+        failed_records: Set[str] = set()
+        products = {p.record_id: p for p in self._batch_products}
+        self._batch_products = []
+        if products:
+            logger.info(f"Classifying {len(products)} products in batches...")
+            records = {
+                rid: (p.url, p.product_name, p.product_description)
+                for rid, p in products.items()
+            }
+            failed: Dict[str, Set[str]] = {}
+            try:
+                classifications = await self._batch.classify_all(
+                    processor=self._processor,
+                    prompts=prompts,
+                    records=records,
+                    failed=failed,
+                )
+            except Exception as e:
+                logger.error(f"Error classifying products in batches: {e}")
+                classifications = {}
+            for rid, product in products.items():
+                product.classifications.update(classifications.get(rid, {}))
+                product.is_relevant = self._is_relevant(product)
+                if rid not in classifications or failed.get(rid):
+                    failed_records.add(rid)
+                elif (
+                    self._journal is not None
+                    and product.product_name
+                    and product.product_description
+                ):
+                    self._journal.write_classifications(
+                        url=product.url, classifications=classifications[rid]
+                    )
+        for product in products.values():
+            await queue_out.put(product)
+        return failed_records
+
+    def _page_fetched(
+        self, search_term: str, n_results: int, queue: asyncio.Queue[dict | None]
+    ) -> None:
+        """Registers a fetched SERP page with the adaptive depth tracker (if any) and queues its next page."""
+        if self._depth_tracker is None:
+            return
+        item = self._depth_tracker.page_fetched(
+            search_term=search_term, n_products=n_results
+        )
+        if item is not None:
+            queue.put_nowait(item)
+
+    def _on_product_finished(self, product: ProductItem) -> None:
+        """Updates the running statistics with a finished (processed or filtered) product."""
+        classified = bool(product.classifications)
+        if classified:
+            self._update_domain_yield(product)
+        self._update_domain_stats(product)
+        if self._depth_tracker is not None and self._queues is not None:
+            item = self._depth_tracker.product_finished(
+                search_term=product.search_term,
+                classified=classified,
+                relevant=product.is_relevant == 1,
+            )
+            if item is not None:
+                self._queues["serp"].put_nowait(item)
+
+    async def _finish_products(
+        self,
+        queue_in: asyncio.Queue[ProductItem | None],
+        queue_out: asyncio.Queue[ProductItem | None],
+        update_stats: bool = True,
+    ) -> None:
+        """Collects the finished products (processed or filtered) from the queue_in, updates the running statistics and puts them into the queue_out.
+
+        Args:
+            queue_in: The input queue containing the finished products.
+            queue_out: The output queue to put the products (i.e. the result queue).
+            update_stats: Whether to update the running statistics (optional).
+        """
+        while True:
+            product = await queue_in.get()
+            if product is None:
+                queue_in.task_done()
+                break
+
+            try:
+                if update_stats:
+                    self._on_product_finished(product)
+            except Exception as e:
+                logger.error(f"Error finishing product: {e}")
             await queue_out.put(product)
+            if self._stream_queue is not None:
+                self._stream_queue.put_nowait(product)
             queue_in.task_done()
 
     @abstractmethod
@@ -309,51 +770,97 @@ class Orchestrator(ABC):
             prompts: The list of prompts used for the classification by func:`Processor.classify`.
         """
 
-        # Setup the input/output queues for the workers
-        serp_queue: asyncio.Queue[dict | None] = asyncio.Queue()
-        url_queue: asyncio.Queue[ProductItem | None] = asyncio.Queue()
-        zyte_queue: asyncio.Queue[ProductItem | None] = asyncio.Queue()
-        proc_queue: asyncio.Queue[ProductItem | None] = asyncio.Queue()
+        # Setup the input/output queues for the workers (filtered products bypass the later stages
+        # by being put directly into the done_queue, which passes all finished products to the res_queue)
         res_queue: asyncio.Queue[ProductItem | None] = asyncio.Queue()
-
-        # Setup the Serp workers
-        serp_wkrs = [
-            asyncio.create_task(
-                self._serp_execute(
-                    queue_in=serp_queue,
-                    queue_out=url_queue,
+        done_queue: asyncio.Queue[ProductItem | None] = asyncio.Queue()
+        serp_queue: asyncio.Queue[dict | None]
+        zyte_queue: asyncio.Queue[ProductItem | None]
+        proc_queue: asyncio.Queue[ProductItem | None]
+        url_queue: asyncio.Queue[ProductItem | None] = PriorityQueue(
+            priority=self._priority
+        )
+        if self._queue_backend is not None:
+            # The work of the serp, zyte and proc stages is shared with the other nodes
+            serp_queue = SharedQueue(
+                backend=self._queue_backend,
+                name="serp",
+                producer=self._node_id,
+                encode=self._encode_serp_item,
+                decode=self._decode_serp_item,
+                priority=self._serp_priority,
+            )
+            zyte_queue, proc_queue = [
+                SharedQueue(
+                    backend=self._queue_backend,
+                    name=name,
+                    producer=self._node_id,
+                    encode=lambda p: p.model_dump_json(),
+                    decode=ProductItem.model_validate_json,
+                    priority=self._priority,
                 )
+                for name in ["zyte", "proc"]
+            ]
+        else:
+            serp_queue = PriorityQueue(priority=self._serp_priority)
+            zyte_queue = PriorityQueue(
+                priority=self._priority,
+                max_items=self._max_queue_size,
+                on_shed=lambda p: self._shed(product=p, queue=done_queue),
             )
-            for _ in range(n_serp_wkrs)
-        ]
+            proc_queue = PriorityQueue(
+                priority=self._priority,
+                max_items=self._max_queue_size,
+                on_shed=lambda p: self._shed(product=p, queue=done_queue),
+            )
+
+        # Setup the Serp workers
+        serp_wkrs = self._create_pool(
+            name="serp",
+            queue=serp_queue,
+            worker=lambda: self._serp_execute(
+                queue_in=serp_queue,
+                queue_out=url_queue,
+                queue_bypass=done_queue,
+            ),
+            n_workers=n_serp_wkrs,
+        )
 
         # Setup the URL collector
         url_col = asyncio.create_task(
-            self._collect_url(queue_in=url_queue, queue_out=zyte_queue)
+            self._collect_url(
+                queue_in=url_queue, queue_out=zyte_queue, queue_bypass=done_queue
+            )
         )
 
         # Setup the Zyte workers
-        zyte_wkrs = [
-            asyncio.create_task(
-                self._zyte_execute(
-                    queue_in=zyte_queue,
-                    queue_out=proc_queue,
-                )
-            )
-            for _ in range(n_zyte_wkrs)
-        ]
+        zyte_wkrs = self._create_pool(
+            name="zyte",
+            queue=zyte_queue,
+            worker=lambda: self._zyte_execute(
+                queue_in=zyte_queue,
+                queue_out=proc_queue,
+                queue_bypass=done_queue,
+            ),
+            n_workers=n_zyte_wkrs,
+        )
 
         # Setup the processing workers
-        proc_wkrs = [
-            asyncio.create_task(
-                self._proc_execute(
-                    queue_in=proc_queue,
-                    queue_out=res_queue,
-                    prompts=prompts,
-                )
-            )
-            for _ in range(n_proc_wkrs)
-        ]
+        proc_wkrs = self._create_pool(
+            name="proc",
+            queue=proc_queue,
+            worker=lambda: self._proc_execute(
+                queue_in=proc_queue,
+                queue_out=done_queue,
+                prompts=prompts,
+            ),
+            n_workers=n_proc_wkrs,
+        )
+
+        # Setup the finisher of the products
+        done_col = asyncio.create_task(
+            self._finish_products(queue_in=done_queue, queue_out=res_queue)
+        )
 
         # Setup the result collector
         res_col = asyncio.create_task(self._collect_results(queue_in=res_queue))
@@ -364,6 +871,7 @@ class Orchestrator(ABC):
             "url": url_queue,
             "zyte": zyte_queue,
             "proc": proc_queue,
+            "done": done_queue,
             "res": res_queue,
         }
         self._workers = {
@@ -371,11 +879,148 @@ class Orchestrator(ABC):
             "url": url_col,
             "zyte": zyte_wkrs,
             "proc": proc_wkrs,
+            "done": done_col,
             "res": res_col,
         }
+        self._stats = {stage: StageStats() for stage in ["serp", "zyte", "proc"]}
+
+    @staticmethod
+    def _encode_serp_item(item: dict) -> str:
+        """Serializes a serp item (c.f. func:`_add_serp_items_for_search_term`) for a shared queue."""
+        return json.dumps(
+            {
+                k: (
+                    v.model_dump()
+                    if isinstance(v, BaseModel)
+                    else [h.model_dump() for h in v]
+                    if isinstance(v, list)
+                    else v
+                )
+                for k, v in item.items()
+            }
+        )
 
     @staticmethod
+    def _decode_serp_item(payload: str) -> dict:
+        """Deserializes a serp item (c.f. func:`_encode_serp_item`)."""
+        item = json.loads(payload)
+        item["language"] = Language(**item["language"])
+        item["location"] = Location(**item["location"])
+        for key in ["marketplaces", "excluded_urls"]:
+            if item.get(key) is not None:
+                item[key] = [Host(**h) for h in item[key]]
+        return item
+
+    def _create_pool(
+        self,
+        name: str,
+        queue: asyncio.Queue,
+        worker: Callable[[], Coroutine],
+        n_workers: int,
+    ) -> WorkerPool:
+        """Creates the worker pool of a stage; with autoscaling its size is bounded by the configured limits.
+
+        Args:
+            name: The name of the stage.
+            queue: The input queue of the stage.
+            worker: The function creating the coroutine of a worker.
+            n_workers: The initial number of workers.
+        """
+        if self._autoscaling is None:
+            min_wkrs, max_wkrs = n_workers, n_workers
+        else:
+            max_wkrs = getattr(self._autoscaling, f"max_{name}_wkrs")
+            min_wkrs = min(self._autoscaling.min_wkrs, max_wkrs)
+            n_workers = min(max(n_workers, min_wkrs), max_wkrs)
+        return WorkerPool(
+            name=name,
+            queue=queue,
+            worker=worker,
+            n_workers=n_workers,
+            min_workers=min_wkrs,
+            max_workers=max_wkrs,
+        )
+
+    async def _close_pool(self, name: str) -> None:
+        """Closes the worker pool of a stage and waits for its queue to be processed.
+
+        Args:
+            name: The name of the stage.
+        """
+        if self._workers is None or self._queues is None:
+            raise ValueError("Async framework is not setup.")
+        pool = cast(WorkerPool, self._workers[name])
+        try:
+            logger.debug(f"Waiting for {name}_workers to conclude their tasks...")
+            results = await pool.close()
+            for i, res in enumerate(results):
+                if isinstance(res, Exception):
+                    logger.error(f"Error in {name}_worker {i}: {res}")
+            logger.debug(f"...{name}_workers concluded their tasks")
+        except Exception as e:
+            logger.error(f"Gathering {name}_workers failed: {e}")
+        # Not joined when cancelled (c.f. func:`_cancel_workers`), as no worker acknowledges the queued items anymore
+        await self._queues[name].join()
+
+    async def _wait_depth_tracker(self, tracker: AdaptiveDepthTracker) -> None:
+        """Waits until the adaptive depth search_terms are finished (c.f. attribute:`AdaptiveDepthTracker.done`).
+
+        Raises a RuntimeError if a worker crashes meanwhile, as the products it was processing (and hence
+        their search_terms) would never be finished.
+        """
+        workers = self._workers or {}
+        crashes = {
+            name: (
+                asyncio.ensure_future(worker.crashed.wait())
+                if isinstance(worker, WorkerPool)
+                else worker
+            )
+            for name, worker in workers.items()
+        }
+        done = asyncio.ensure_future(tracker.done.wait())
+        try:
+            await asyncio.wait(
+                [done, *crashes.values()], return_when=asyncio.FIRST_COMPLETED
+            )
+            crashed = [name for name, crash in crashes.items() if crash.done()]
+        finally:
+            done.cancel()
+            for name, crash in crashes.items():
+                if isinstance(workers[name], WorkerPool):
+                    crash.cancel()
+        if not tracker.done.is_set():
+            raise RuntimeError(
+                f"The {', '.join(crashed)} workers ended while waiting for the adaptive depth search_terms"
+            )
+
+    def _cancel_workers(self) -> None:
+        """Cancels all workers of the async framework (e.g. when the run is cancelled)."""
+        for worker in (self._workers or {}).values():
+            worker.cancel()
+        logger.info("Pipeline cancelled; async framework is closed")
+
+    async def _close_task(self, name: str, label: str) -> None:
+        """Adds the sentinel to the queue of a single worker stage and waits for the worker to conclude.
+
+        Args:
+            name: The name of the stage.
+            label: The name of the worker (for logging).
+        """
+        if self._workers is None or self._queues is None:
+            raise ValueError("Async framework is not setup.")
+        queue = self._queues[name]
+        await queue.put(None)
+        task = cast(asyncio.Task, self._workers[name])
+        try:
+            logger.debug(f"Waiting for {label} to conclude its tasks...")
+            await task
+            logger.debug(f"...{label} concluded its tasks")
+        except Exception as e:
+            logger.error(f"Gathering {label} failed: {e}")
+        await queue.join()
+
     async def _add_serp_items_for_search_term(
+        self,
         queue: asyncio.Queue[dict | None],
         search_term: str,
         search_term_type: str,
@@ -395,6 +1040,11 @@ class Orchestrator(ABC):
             "marketplaces": marketplaces,
             "excluded_urls": excluded_urls,
         }
+        if not await self._claim(f"serp:{RunJournal.serp_key(item)}"):
+            logger.debug(f'Skipping item="{item}" already queued by another node')
+            return
+        if self._depth_tracker is not None:
+            self._depth_tracker.add_term(item)
         logger.debug(f'Adding item="{item}" to serp_queue')
         await queue.put(item)
 
@@ -408,7 +1058,11 @@ class Orchestrator(ABC):
         marketplaces: List[Host] | None,
         excluded_urls: List[Host] | None,
     ) -> None:
-        """Adds all the (enriched) search_term (as serp items) to the queue."""
+        """Adds all the (enriched) search_term (as serp items) to the queue.
+
+        Near-identical variants of already queued search_terms (c.f. class:`TermDeduplicator`) are skipped;
+        the mapping onto the queued search_terms is kept in `self._term_dedup`.
+        """
         common_kwargs = {
             "queue": queue,
             "language": language,
@@ -418,6 +1072,7 @@ class Orchestrator(ABC):
         }
 
         # Add initial items to the serp_queue
+        self._term_dedup.add(search_term)
         await self._add_serp_items_for_search_term(
             search_term=search_term,
             search_term_type="initial",
@@ -425,26 +1080,51 @@ class Orchestrator(ABC):
             **common_kwargs,  # type: ignore[arg-type]
         )
 
-        # Enrich the search_terms
+        # Enrich the search_terms (with shared queues, only one node enriches)
         enrichment = deepness.enrichment
-        if enrichment:
+        if enrichment and await self._claim(f"enrichment:{search_term}"):
             # Call DataForSEO to get additional terms
             n_terms = enrichment.additional_terms
-            terms = await self._enricher.apply(
-                search_term=search_term,
-                language=language,
-                location=location,
-                n_terms=n_terms,
-            )
+            journaled = self._journal.terms() if self._journal else None
+            if journaled is not None:
+                terms = journaled
+            elif enrichment.max_depth > 1:
+                terms = await self._enricher.expand(
+                    search_term=search_term,
+                    language=language,
+                    location=location,
+                    n_terms=n_terms,
+                    max_depth=enrichment.max_depth,
+                    max_calls=enrichment.max_calls,
+                )
+            else:
+                terms = await self._enricher.apply(
+                    search_term=search_term,
+                    language=language,
+                    location=location,
+                    n_terms=n_terms,
+                )
+            if self._journal is not None and journaled is None:
+                self._journal.write_terms(terms=terms)
 
-            # Add the enriched search terms to the serp_queue
+            # Add the enriched search terms to the serp_queue (skipping near-identical variants)
             for trm in terms:
+                if not self._term_dedup.add(trm):
+                    logger.debug(
+                        f'Skipping search_term="{trm}" as variant of "{self._term_dedup.mapping[trm]}"'
+                    )
+                    continue
                 await self._add_serp_items_for_search_term(
                     search_term=trm,
                     search_term_type="enriched",
                     num_results=enrichment.additional_urls_per_term,
                     **common_kwargs,  # type: ignore[arg-type]
                 )
+            n_saved = self._term_dedup.n_duplicates
+            if n_saved:
+                logger.info(
+                    f"Skipped {n_saved} near-identical search_terms (saved {n_saved} SerpAPI searches)"
+                )
 
     async def run(
         self,
@@ -456,6 +1136,7 @@ class Orchestrator(ABC):
         marketplaces: List[Host] | None = None,
         excluded_urls: List[Host] | None = None,
         previously_collected_urls: List[str] | None = None,
+        journal: RunJournal | None = None,
     ) -> None:
         """Runs the pipeline steps: serp, enrich, zyte, process, and collect the results.
 
@@ -468,13 +1149,36 @@ class Orchestrator(ABC):
             marketplaces: The marketplaces to include in the search.
             excluded_urls: The URLs to exclude from the search.
             previously_collected_urls: The urls that have been collected previously and are ignored.
+            journal: The journal of the completed steps, which are replayed instead of calling the APIs again (optional).
         """
 
         # ---------------------------
         #        INITIAL SETUP
         # ---------------------------
+        # Check the dependencies of the prompts
+        self._processor.order_prompts(prompts)
+        if self._batch is not None and deepness.adaptive:
+            raise ValueError(
+                "Adaptive depth needs the classifications while crawling and cannot be combined with batch classification"
+            )
+        if self._queue_backend is not None and deepness.adaptive:
+            raise ValueError(
+                "Adaptive depth tracks the SERP pages locally and cannot be combined with shared queues"
+            )
+
         if previously_collected_urls:
             self._collected_urls_previous_runs = set(self._collected_urls_current_run)
+        self._term_dedup = TermDeduplicator()
+        self._domain_yield = {}
+        self._processor.usage = TokenUsage()
+        self._processor.cascade_stats = CascadeStats()
+        self._batch_products = []
+        self._journal = journal
+        self._depth_tracker = (
+            AdaptiveDepthTracker(config=deepness.adaptive)
+            if deepness.adaptive
+            else None
+        )
 
         # Setup the async framework
         n_terms_max = 1 + (
@@ -499,19 +1203,343 @@ class Orchestrator(ABC):
             raise ValueError(
                 "Async framework is not setup. Please call _setup_async_framework() first."
             )
-        if not all([k in self._queues for k in ["serp", "url", "zyte", "proc", "res"]]):
+        if not all(
+            [k in self._queues for k in ["serp", "url", "zyte", "proc", "done", "res"]]
+        ):
             raise ValueError(
                 "The queues of the async framework are not setup correctly."
             )
         if not all(
-            [k in self._workers for k in ["serp", "url", "zyte", "proc", "res"]]
+            [k in self._workers for k in ["serp", "url", "zyte", "proc", "done", "res"]]
         ):
             raise ValueError(
                 "The workers of the async framework are not setup correctly."
             )
 
-        # Add the search items to the serp_queue
-        serp_queue = self._queues["serp"]
+        # Orchestrate the workers (cancelling the run cancels all workers)
+        autoscaler = None
+        try:
+            # Add the search items to the serp_queue
+            serp_queue = self._queues["serp"]
+            await self._add_serp_items(
+                queue=serp_queue,
+                search_term=search_term,
+                language=language,
+                location=location,
+                deepness=deepness,
+                marketplaces=marketplaces,
+                excluded_urls=excluded_urls,
+            )
+            if self._depth_tracker is not None:
+                self._depth_tracker.close()
+
+            # Start the autoscaler (if configured)
+            if self._autoscaling is not None:
+                pools = {
+                    stage: cast(WorkerPool, self._workers[stage])
+                    for stage in ["serp", "zyte", "proc"]
+                }
+                autoscaler = asyncio.create_task(
+                    Autoscaler(
+                        pools=pools,
+                        stats=self._stats,
+                        config=self._autoscaling,
+                        shared=["zyte", "proc"],
+                    ).run()
+                )
+
+            # ---------------------------
+            #   ORCHESTRATE SERP WORKERS
+            # ---------------------------
+            # With adaptive depth, further SERP pages are queued until all search_terms are finished
+            if self._depth_tracker is not None:
+                logger.debug(
+                    "Waiting for the adaptive depth search_terms to conclude..."
+                )
+                await self._wait_depth_tracker(self._depth_tracker)
+                logger.info(
+                    f"Adaptive depth fetched {self._depth_tracker.n_pages} SERP pages "
+                    f"(stopped {self._depth_tracker.n_stopped_early} search_terms early)"
+                )
+
+            # Wait for the serp workers to be concluded before adding the sentinels to the url_queue
+            await self._close_pool(name="serp")
+
+            # ---------------------------
+            #  ORCHESTRATE URL COLLECTOR
+            # ---------------------------
+            # Wait for the url_collector to be concluded before adding the sentinels to the zyte_queue
+            await self._close_task(name="url", label="url_collector")
+
+            # ---------------------------
+            #  ORCHESTRATE ZYTE WORKERS
+            # ---------------------------
+            # Wait for the zyte_workers to be concluded before adding the sentinels to the proc_queue
+            await self._close_pool(name="zyte")
+
+            # ---------------------------
+            #  ORCHESTRATE PROC WORKERS
+            # ---------------------------
+            # Wait for the proc_workers to be concluded before adding the sentinels to the res_queue
+            await self._close_pool(name="proc")
+            if autoscaler is not None:
+                autoscaler.cancel()
+
+            # With batch classification, the products collected by the proc workers are classified now
+            await self._classify_batch(prompts=prompts, queue_out=self._queues["done"])
+
+            # ---------------------------
+            #  ORCHESTRATE PRODUCT FINISHER
+            # ---------------------------
+            # Wait for the finisher to be concluded before adding the sentinels to the res_queue
+            await self._close_task(name="done", label="product finisher")
+            if self._domain_stats is not None:
+                self._domain_stats.flush()
+
+            # ---------------------------
+            #  ORCHESTRATE RES COLLECTOR
+            # ---------------------------
+            # Wait for the res_collector to be concluded
+            await self._close_task(name="res", label="res_collector")
+        except BaseException:
+            if autoscaler is not None:
+                autoscaler.cancel()
+            self._cancel_workers()
+            raise
+
+        self._log_usage()
+        if journal is not None and journal.n_replayed:
+            logger.info(
+                f"Resumed run {journal.run_id}: replayed {journal.n_replayed} journaled steps"
+            )
+        logger.info("Pipeline concluded; async framework is closed")
+
+    async def stream(
+        self,
+        search_term: str,
+        language: Language,
+        location: Location,
+        deepness: Deepness,
+        prompts: List[Prompt],
+        marketplaces: List[Host] | None = None,
+        excluded_urls: List[Host] | None = None,
+        previously_collected_urls: List[str] | None = None,
+        journal: RunJournal | None = None,
+    ) -> AsyncIterator[ProductItem]:
+        """Runs the pipeline (c.f. func:`run`) and yields every finished (processed or filtered) product as soon as it is finished.
+
+        The products are collected by func:`_collect_results` as well. Cancelling the iteration or closing
+        it early (e.g. `break` within `contextlib.aclosing`) cancels the run and all its workers.
+
+        Args:
+            search_term: The search term for the query.
+            language: The language to use for the query.
+            location: The location to use for the query.
+            deepness: The search depth and enrichment details.
+            prompts: The list of prompt to use for classification.
+            marketplaces: The marketplaces to include in the search.
+            excluded_urls: The URLs to exclude from the search.
+            previously_collected_urls: The urls that have been collected previously and are ignored.
+            journal: The journal of the completed steps, which are replayed instead of calling the APIs again (optional).
+        """
+        queue: asyncio.Queue[ProductItem | None] = asyncio.Queue()
+        self._stream_queue = queue
+        task = asyncio.create_task(
+            self.run(
+                search_term=search_term,
+                language=language,
+                location=location,
+                deepness=deepness,
+                prompts=prompts,
+                marketplaces=marketplaces,
+                excluded_urls=excluded_urls,
+                previously_collected_urls=previously_collected_urls,
+                journal=journal,
+            )
+        )
+        task.add_done_callback(lambda _: queue.put_nowait(None))
+        try:
+            while (product := await queue.get()) is not None:
+                yield product
+            # Raise the errors of the run
+            await task
+        finally:
+            self._stream_queue = None
+            if not task.done():
+                task.cancel()
+                await asyncio.wait([task])
+
+    async def reprocess(
+        self, products: List[ProductItem], prompts: List[Prompt]
+    ) -> None:
+        """Re-classifies the products of a previous run with the given prompts, without crawling them again.
+
+        The products are only passed through the proc workers (at full concurrency, reusing cached
+        classifications) and collected as a new result set; the previous classifications are replaced
+        and the filtered products are collected unchanged. The per-domain statistics are not updated.
+
+        Args:
+            products: The products of a previous run.
+            prompts: The list of prompts to use for classification.
+        """
+        self._processor.order_prompts(prompts)
+        self._processor.usage = TokenUsage()
+        self._processor.cascade_stats = CascadeStats()
+        self._depth_tracker = None
+        self._journal = None
+        self._batch_products = []
+
+        # Setup the processing stage only (without the shedding of the crawling runs)
+        proc_queue: asyncio.Queue[ProductItem | None] = PriorityQueue(
+            priority=self._priority
+        )
+        done_queue: asyncio.Queue[ProductItem | None] = asyncio.Queue()
+        res_queue: asyncio.Queue[ProductItem | None] = asyncio.Queue()
+        proc_wkrs = self._create_pool(
+            name="proc",
+            queue=proc_queue,
+            worker=lambda: self._proc_execute(
+                queue_in=proc_queue, queue_out=done_queue, prompts=prompts
+            ),
+            n_workers=self._n_proc_wkrs,
+        )
+        done_col = asyncio.create_task(
+            self._finish_products(
+                queue_in=done_queue, queue_out=res_queue, update_stats=False
+            )
+        )
+        res_col = asyncio.create_task(self._collect_results(queue_in=res_queue))
+        self._queues = {"proc": proc_queue, "done": done_queue, "res": res_queue}
+        self._workers = {"proc": proc_wkrs, "done": done_col, "res": res_col}
+        self._stats = {"proc": StageStats()}
+
+        logger.info(
+            f"Reprocessing {len(products)} products with {len(prompts)} prompts"
+        )
+        for product in products:
+            product = product.model_copy(
+                update={
+                    "classifications": {},
+                    "is_relevant": PRODUCT_ITEM_DEFAULT_IS_RELEVANT,
+                }
+            )
+            if product.filtered:
+                await done_queue.put(product)
+            else:
+                await proc_queue.put(product)
+
+        await self._close_pool(name="proc")
+        await self._classify_batch(prompts=prompts, queue_out=done_queue)
+        await self._close_task(name="done", label="product finisher")
+        await self._close_task(name="res", label="res_collector")
+        self._log_usage()
+        logger.info("Reprocessing concluded; async framework is closed")
+
+    @staticmethod
+    def read_manifest(filename: Path | str) -> List[ProductItem]:
+        """Reads the products of a manifest (JSONL, or Parquet if the file ends with `.parquet`).
+
+        Args:
+            filename: The manifest file.
+        """
+        records = read_records(filename, json_columns=_MANIFEST_JSON_FIELDS)
+        return [ProductItem(**rec) for rec in records]
+
+    @staticmethod
+    def _open_manifest(filename: Path | str) -> ManifestWriter:
+        return ManifestWriter(filename, json_columns=_MANIFEST_JSON_FIELDS)
+
+    @staticmethod
+    def _write_manifest(manifest: ManifestWriter, product: ProductItem) -> None:
+        manifest.write({"record_id": product.record_id, **product.model_dump()})
+
+    async def _run_stage(
+        self,
+        name: str,
+        input: Path | str,
+        output: Path | str,
+        n_workers: int,
+        process: Callable[[ProductItem], Coroutine[Any, Any, bool]],
+    ) -> None:
+        """Runs a stage from an input to an output manifest (c.f. func:`zyte_stage`, func:`proc_stage`).
+
+        Filtered products are passed on unchanged, products already in the output manifest are skipped
+        and products whose processing failed are not written (such that a retried stage repeats them).
+
+        Args:
+            name: The name of the stage.
+            input: The input manifest.
+            output: The output manifest.
+            n_workers: Number of async workers.
+            process: The function processing a product (returns False if it failed).
+        """
+        manifest = self._open_manifest(output)
+        products = [p for p in self.read_manifest(input) if p.record_id not in manifest]
+        queue: asyncio.Queue[ProductItem] = asyncio.Queue()
+        for product in products:
+            queue.put_nowait(product)
+        n_failed = 0
+
+        async def worker() -> None:
+            nonlocal n_failed
+            while not queue.empty():
+                product = queue.get_nowait()
+                try:
+                    processed = product.filtered or await process(product)
+                except Exception as e:
+                    logger.error(f"Error in stage {name} for url={product.url}: {e}")
+                    processed = False
+                if processed:
+                    self._write_manifest(manifest=manifest, product=product)
+                else:
+                    n_failed += 1
+
+        try:
+            await asyncio.gather(
+                *[worker() for _ in range(max(1, min(n_workers, len(products))))]
+            )
+        finally:
+            manifest.close()
+        logger.info(
+            f"Stage {name} wrote {manifest.n_written} products to {output} "
+            f"({n_failed} failed, {len(manifest.record_ids)} in total)"
+        )
+
+    async def search_stage(
+        self,
+        output: Path | str,
+        search_term: str,
+        language: Language,
+        location: Location,
+        deepness: Deepness,
+        marketplaces: List[Host] | None = None,
+        excluded_urls: List[Host] | None = None,
+    ) -> None:
+        """Runs the serp (incl. enrichment) and URL collection steps and writes the products to a manifest.
+
+        Each product has the record ID of its URL (c.f. attribute:`ProductItem.record_id`); products
+        already in the output manifest are skipped, such that the stage can be retried.
+
+        Args:
+            output: The output manifest (JSONL, or Parquet if the file ends with `.parquet`).
+            search_term: The search term for the query.
+            language: The language to use for the query.
+            location: The location to use for the query.
+            deepness: The search depth and enrichment details.
+            marketplaces: The marketplaces to include in the search.
+            excluded_urls: The URLs to exclude from the search.
+        """
+        if deepness.adaptive:
+            raise ValueError(
+                "Adaptive depth needs the classifications while crawling and cannot be run as separate stages"
+            )
+        self._term_dedup = TermDeduplicator()
+        self._depth_tracker = None
+        self._journal = None
+
+        serp_queue: asyncio.Queue[dict | None] = asyncio.Queue()
+        url_queue: asyncio.Queue[ProductItem | None] = asyncio.Queue()
+        out_queue: asyncio.Queue[ProductItem | None] = asyncio.Queue()
         await self._add_serp_items(
             queue=serp_queue,
             search_term=search_term,
@@ -521,106 +1549,129 @@ class Orchestrator(ABC):
             marketplaces=marketplaces,
             excluded_urls=excluded_urls,
         )
-
-        # ---------------------------
-        #   ORCHESTRATE SERP WORKERS
-        # ---------------------------
-        # Add the sentinels to the serp_queue
+        n_serp_wkrs = max(1, min(self._n_serp_wkrs, serp_queue.qsize()))
         for _ in range(n_serp_wkrs):
-            await serp_queue.put(None)
-
-        # Wait for the serp workers to be concluded before adding the sentinels to the url_queue
-        serp_workers = self._workers["serp"]
-        try:
-            logger.debug("Waiting for serp_workers to conclude their tasks...")
-            serp_res = await asyncio.gather(*serp_workers, return_exceptions=True)
-            for i, res in enumerate(serp_res):
-                if isinstance(res, Exception):
-                    logger.error(f"Error in serp_worker {i}: {res}")
-            logger.debug("...serp_workers concluded their tasks")
-        except Exception as e:
-            logger.error(f"Gathering serp_workers failed: {e}")
-        finally:
-            await serp_queue.join()
-
-        # ---------------------------
-        #  ORCHESTRATE URL COLLECTOR
-        # ---------------------------
-        # Add the sentinels to the url_queue
-        url_queue = self._queues["url"]
-        await url_queue.put(None)
+            serp_queue.put_nowait(None)
+        await asyncio.gather(
+            *[
+                self._serp_execute(
+                    queue_in=serp_queue, queue_out=url_queue, queue_bypass=out_queue
+                )
+                for _ in range(n_serp_wkrs)
+            ]
+        )
+        url_queue.put_nowait(None)
+        await self._collect_url(
+            queue_in=url_queue, queue_out=out_queue, queue_bypass=out_queue
+        )
 
-        # Wait for the url_collector to be concluded before adding the sentinels to the zyte_queue
-        url_collector = cast(asyncio.Task, self._workers["url"])
+        manifest = self._open_manifest(output)
         try:
-            logger.debug("Waiting for url_collector to conclude its tasks...")
-            await url_collector
-            logger.debug("...url_collector concluded its tasks")
-        except Exception as e:
-            logger.error(f"Gathering url_collector failed: {e}")
+            while not out_queue.empty():
+                product = out_queue.get_nowait()
+                if product is not None:
+                    self._write_manifest(manifest=manifest, product=product)
         finally:
-            await url_queue.join()
+            manifest.close()
+        logger.info(f"Stage search wrote {manifest.n_written} products to {output}")
 
-        # ---------------------------
-        #  ORCHESTRATE ZYTE WORKERS
-        # ---------------------------
-        # Add the sentinels to the zyte_queue
-        zyte_queue = self._queues["zyte"]
-        for _ in range(n_zyte_wkrs):
-            await zyte_queue.put(None)
+    async def zyte_stage(self, input: Path | str, output: Path | str) -> None:
+        """Fetches the product details of the products in the input manifest and writes them to the output manifest.
 
-        # Wait for the zyte_workers to be concluded before adding the sentinels to the proc_queue
-        zyte_workers = self._workers["zyte"]
-        try:
-            logger.debug("Waiting for zyte_workers to conclude their tasks...")
-            zyte_res = await asyncio.gather(*zyte_workers, return_exceptions=True)
-            for i, res in enumerate(zyte_res):
-                if isinstance(res, Exception):
-                    logger.error(f"Error in zyte_worker {i}: {res}")
-            logger.debug("...zyte_workers concluded their tasks")
-        except Exception as e:
-            logger.error(f"Gathering zyte_workers failed: {e}")
-        finally:
-            await zyte_queue.join()
+        Args:
+            input: The input manifest (c.f. func:`search_stage`).
+            output: The output manifest.
+        """
+        await self._run_stage(
+            name="zyte",
+            input=input,
+            output=output,
+            n_workers=self._n_zyte_wkrs,
+            process=self._fetch_details,
+        )
 
-        # ---------------------------
-        #  ORCHESTRATE PROC WORKERS
-        # ---------------------------
-        # Add the sentinels to the proc_queue
-        proc_queue = self._queues["proc"]
-        for _ in range(n_proc_wkrs):
-            await proc_queue.put(None)
+    async def proc_stage(
+        self, input: Path | str, output: Path | str, prompts: List[Prompt]
+    ) -> None:
+        """Classifies the products in the input manifest and writes them to the output manifest.
 
-        # Wait for the proc_workers to be concluded before adding the sentinels to the res_queue
-        proc_workers = self._workers["proc"]
-        try:
-            logger.debug("Waiting for proc_workers to conclude their tasks...")
-            proc_res = await asyncio.gather(*proc_workers, return_exceptions=True)
-            for i, res in enumerate(proc_res):
-                if isinstance(res, Exception):
-                    logger.error(f"Error in proc_worker {i}: {res}")
-            logger.debug("...proc_workers concluded their tasks")
-        except Exception as e:
-            logger.error(f"Gathering proc_workers failed: {e}")
-        finally:
-            await proc_queue.join()
+        With batch classification, all products are classified in batches (c.f. class:`BatchClassifier`).
 
-        # ---------------------------
-        #  ORCHESTRATE RES COLLECTOR
-        # ---------------------------
-        # Add the sentinels to the res_queue
-        res_queue = self._queues["res"]
-        await res_queue.put(None)
+        Args:
+            input: The input manifest (c.f. func:`zyte_stage`).
+            output: The output manifest.
+            prompts: The list of prompts to use for classification.
+        """
+        levels = self._processor.order_prompts(prompts)
+        self._processor.usage = TokenUsage()
+        self._processor.cascade_stats = CascadeStats()
+
+        if self._batch is not None:
+            manifest = self._open_manifest(output)
+            products = self.read_manifest(input)
+            self._batch_products = [
+                p for p in products if not p.filtered and p.record_id not in manifest
+            ]
+            done_queue: asyncio.Queue[ProductItem | None] = asyncio.Queue()
+            failed = await self._classify_batch(prompts=prompts, queue_out=done_queue)
+            try:
+                for product in products:
+                    if product.filtered:
+                        self._write_manifest(manifest=manifest, product=product)
+                while not done_queue.empty():
+                    classified = done_queue.get_nowait()
+                    if classified is not None and classified.record_id not in failed:
+                        self._write_manifest(manifest=manifest, product=classified)
+            finally:
+                manifest.close()
+            logger.info(
+                f"Stage proc wrote {manifest.n_written} products to {output} "
+                f"({len(failed)} failed)"
+            )
+            self._log_usage()
+            return
+
+        await self._run_stage(
+            name="proc",
+            input=input,
+            output=output,
+            n_workers=self._n_proc_wkrs,
+            process=lambda product: self._classify_product(
+                product=product, levels=levels
+            ),
+        )
+        self._log_usage()
 
-        # Wait for the res_collector to be concluded
-        res_collector = cast(asyncio.Task, self._workers["res"])
-        try:
-            logger.debug("Waiting for res_collector to conclude its tasks...")
-            await res_collector
-            logger.debug("...res_collector concluded its tasks")
-        except Exception as e:
-            logger.error(f"Gathering res_collector failed: {e}")
-        finally:
-            await res_queue.join()
+    async def collect_stage(self, input: Path | str) -> None:
+        """Collects the products of a manifest as results (c.f. func:`_collect_results`).
 
-        logger.info("Pipeline concluded; async framework is closed")
+        Args:
+            input: The input manifest (c.f. func:`proc_stage`).
+        """
+        queue: asyncio.Queue[ProductItem | None] = asyncio.Queue()
+        for product in self.read_manifest(input):
+            queue.put_nowait(product)
+        queue.put_nowait(None)
+        await self._collect_results(queue_in=queue)
+
+    def _log_usage(self) -> None:
+        """Logs the OpenAI usage (and the share of the local tier and the cascade metrics) of the run."""
+        usage = self._processor.usage
+        logger.info(
+            f"OpenAI usage: {usage.n_calls} calls, {usage.prompt_tokens} prompt and "
+            f"{usage.completion_tokens} completion tokens ({usage.n_compressed} descriptions "
+            f"compressed by {usage.tokens_removed} tokens)"
+        )
+        if n_local := usage.n_local + usage.n_local_escalated:
+            logger.info(
+                f"Local classifiers resolved {usage.n_local} of {n_local} classifications "
+                f"({usage.n_local / n_local:.1%}), {usage.n_local_escalated} were escalated to OpenAI"
+            )
+        stats = self._processor.cascade_stats
+        if stats.n_cheap:
+            latency_saved = stats.latency_saved
+            logger.info(
+                f"Cascade escalated {stats.escalation_rate:.1%} of {stats.n_cheap} classifications "
+                f"(latency saved: {'n/a' if latency_saved is None else f'{latency_saved:.1f}s'}, "
+                f"cost saved: {stats.cost_saved:.4f} USD)"
+            )
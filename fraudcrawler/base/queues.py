@@ -0,0 +1,298 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+from typing import Any, Callable, Coroutine, Dict, List, Set, Tuple
+
+from fraudcrawler.settings import QUEUE_DEFAULT_POLL_INTERVAL
+from fraudcrawler.base.backends import Message, QueueBackend
+
+logger = logging.getLogger(__name__)
+
+
+class PriorityQueue(asyncio.Queue):
+    """Queue returning the items with the highest priority first (FIFO among equal priorities).
+
+    The `None` sentinels always have the lowest priority, such that a worker only terminates once all
+    items put before the sentinel have been consumed; func:`put_first_nowait` puts an item (e.g. the
+    sentinel retiring a single worker) before all others instead. If `max_items` is given, putting an item into a
+    full queue sheds the item with the lowest priority (which may be the new item itself) and hands
+    it to `on_shed`.
+    """
+
+    def __init__(
+        self,
+        priority: Callable[[Any], float],
+        max_items: int | None = None,
+        on_shed: Callable[[Any], None] | None = None,
+    ):
+        """Initializes the queue.
+
+        Args:
+            priority: The function computing the priority of an item (higher is more important).
+            max_items: The maximal number of (non-sentinel) items before shedding (optional).
+            on_shed: The function called with every shed item (optional).
+        """
+        super().__init__()
+        self._priority = priority
+        self._max_items = max_items
+        self._on_shed = on_shed
+        self.n_shed = 0
+
+    def _init(self, maxsize: int) -> None:
+        self._queue: List[Tuple[float, int, Any]] = []
+        self._counter = itertools.count()
+        self._n_sentinels = 0
+        self._first = False
+
+    def _put(self, item: Any) -> None:
+        if self._first:
+            self._n_sentinels += int(item is None)
+            key = -math.inf
+        elif item is None:
+            self._n_sentinels += 1
+            key = math.inf
+        else:
+            key = -self._priority(item)
+        heapq.heappush(self._queue, (key, next(self._counter), item))
+
+    def _get(self) -> Any:
+        item = heapq.heappop(self._queue)[-1]
+        if item is None:
+            self._n_sentinels -= 1
+        return item
+
+    def put_first_nowait(self, item: Any) -> None:
+        """Puts an item before all other items (FIFO among the items put first)."""
+        self._first = True
+        try:
+            super().put_nowait(item)
+        finally:
+            self._first = False
+
+    def put_nowait(self, item: Any) -> None:
+        super().put_nowait(item)
+        if self._max_items is not None and item is not None:
+            while self.qsize() - self._n_sentinels > self._max_items:
+                self._shed()
+
+    def _shed(self) -> None:
+        """Removes the item with the lowest priority (sentinels excluded) and hands it to `on_shed`."""
+        idx = max(
+            (i for i, entry in enumerate(self._queue) if entry[-1] is not None),
+            key=lambda i: self._queue[i][:2],
+        )
+        item = self._queue.pop(idx)[-1]
+        heapq.heapify(self._queue)
+        self.task_done()
+        self.n_shed += 1
+        if self._on_shed is not None:
+            self._on_shed(item)
+
+
+class SharedQueue(asyncio.Queue):
+    """Queue keeping its items in a (shared) class:`QueueBackend`, such that several nodes consume the same work.
+
+    The items are serialized with `encode`/`decode`. An item got by a worker is acknowledged with
+    func:`task_done` (of the same worker task); items of crashed nodes are delivered again after the
+    visibility timeout of the backend. The queue registers its node as a producer until the first `None`
+    sentinel is put (i.e. the node's upstream stage is concluded); the sentinels are kept locally and only
+    consumed once the queue is exhausted on all nodes (no producers and no pending items).
+
+    The backend is called without blocking the event loop (c.f. func:`QueueBackend.call`): the writes of
+    func:`put_nowait` and func:`task_done` are done in the background (awaited by func:`join`) and
+    func:`qsize` returns the size seen by the last poll. While items are processed, their reservations
+    are extended every third of the visibility timeout, such that slow items are not delivered twice.
+    """
+
+    def __init__(
+        self,
+        backend: QueueBackend,
+        name: str,
+        producer: str,
+        encode: Callable[[Any], str],
+        decode: Callable[[str], Any],
+        priority: Callable[[Any], float] | None = None,
+        poll_interval: float = QUEUE_DEFAULT_POLL_INTERVAL,
+    ):
+        """Initializes the queue.
+
+        Args:
+            backend: The backend storing the items.
+            name: The name of the queue in the backend.
+            producer: The ID of the node (a restarted node must reuse the ID of the crashed one).
+            encode: The function serializing an item.
+            decode: The function deserializing an item.
+            priority: The function computing the priority of an item (higher is more important) (optional).
+            poll_interval: Seconds between polls of an empty backend queue (optional).
+        """
+        super().__init__()
+        self._backend = backend
+        self._name = name
+        self._producer = producer
+        self._encode = encode
+        self._decode = decode
+        self._priority = priority
+        self._poll_interval = poll_interval
+        self._size = 0
+        self._n_sentinels = 0
+        self._n_retiring = 0
+        self._n_unfinished = 0
+        self._all_done = asyncio.Event()
+        self._all_done.set()
+        self._in_flight: Dict[asyncio.Task | None, str] = {}
+        self._writes: Set[asyncio.Task] = set()
+        self._heartbeat: asyncio.Task | None = None
+        self._closed = False
+        backend.open(name, producer)
+
+    def qsize(self) -> int:
+        return self._size + self._n_sentinels + self._n_retiring
+
+    def empty(self) -> bool:
+        return self.qsize() == 0
+
+    def _spawn(self, write: Coroutine[Any, Any, None]) -> None:
+        """Runs a write to the backend in the background."""
+        task = asyncio.create_task(write)
+        self._writes.add(task)
+        task.add_done_callback(self._written)
+
+    def _written(self, task: asyncio.Task) -> None:
+        self._writes.discard(task)
+        if not task.cancelled() and (exc := task.exception()) is not None:
+            logger.error(f"Error writing to the {self._name} queue backend: {exc}")
+
+    def put_nowait(self, item: Any) -> None:
+        if item is None:
+            self._n_sentinels += 1
+            if not self._closed:
+                self._closed = True
+                self._spawn(self._close())
+            return
+        self._size += 1
+        self._spawn(self._write(item))
+
+    def put_first_nowait(self, item: Any) -> None:
+        """Puts a `None` sentinel retiring a single worker (c.f. class:`WorkerPool`) before all other items.
+
+        Unlike the sentinels of func:`put_nowait`, it does not unregister the node as producer.
+        """
+        if item is not None:
+            raise ValueError("Only sentinels can be put first into a shared queue")
+        self._n_retiring += 1
+
+    async def put(self, item: Any) -> None:
+        if item is None:
+            return self.put_nowait(item)
+        self._size += 1
+        await self._write(item)
+
+    async def _write(self, item: Any) -> None:
+        priority = self._priority(item) if self._priority is not None else 0.0
+        await self._backend.call(
+            self._backend.put, self._name, self._encode(item), priority
+        )
+
+    async def _close(self) -> None:
+        """Unregisters the node as producer once its previous writes are done."""
+        current = asyncio.current_task()
+        writes = [task for task in self._writes if task is not current]
+        await asyncio.gather(*writes, return_exceptions=True)
+        await self._backend.call(self._backend.close, self._name, self._producer)
+
+    def get_nowait(self) -> Any:
+        if self._n_retiring:
+            self._n_retiring -= 1
+            return self._deliver_sentinel()
+        message, self._size = self._reserve()
+        if message is not None:
+            return self._deliver(message)
+        if self._n_sentinels and self._exhausted():
+            self._n_sentinels -= 1
+            return self._deliver_sentinel()
+        raise asyncio.QueueEmpty
+
+    def _reserve(self) -> Tuple[Message | None, int]:
+        """Reserves the next item and returns it with the number of items left in the backend."""
+        message = self._backend.get(self._name)
+        return message, self._backend.size(self._name)
+
+    def _exhausted(self) -> bool:
+        """Checks whether no node will add or redeliver items to the queue anymore."""
+        return (
+            self._backend.n_producers(self._name) == 0
+            and self._backend.pending(self._name) == 0
+        )
+
+    def _deliver(self, message: Message) -> Any:
+        msg_id, payload = message
+        self._in_flight[asyncio.current_task()] = msg_id
+        if self._heartbeat is None or self._heartbeat.done():
+            self._heartbeat = asyncio.create_task(self._extend_leases())
+        self._n_unfinished += 1
+        self._all_done.clear()
+        return self._decode(payload)
+
+    def _deliver_sentinel(self) -> None:
+        self._n_unfinished += 1
+        self._all_done.clear()
+        return None
+
+    async def get(self) -> Any:
+        while True:
+            if self._n_retiring:
+                self._n_retiring -= 1
+                return self._deliver_sentinel()
+            reservation = asyncio.ensure_future(self._backend.call(self._reserve))
+            try:
+                message, self._size = await asyncio.shield(reservation)
+            except asyncio.CancelledError:
+                # Release an item reserved for the cancelled worker
+                reservation.add_done_callback(self._release)
+                raise
+            if message is not None:
+                return self._deliver(message)
+            if self._n_sentinels and await self._backend.call(self._exhausted):
+                self._n_sentinels -= 1
+                return self._deliver_sentinel()
+            await asyncio.sleep(self._poll_interval)
+
+    def _release(self, reservation: asyncio.Future) -> None:
+        if reservation.cancelled() or reservation.exception() is not None:
+            return
+        message, _ = reservation.result()
+        if message is not None:
+            self._spawn(self._backend.call(self._backend.nack, self._name, message[0]))
+
+    async def _extend_leases(self) -> None:
+        """Extends the reservations of the items in process (c.f. func:`QueueBackend.extend`).
+
+        The items of workers that ended without acknowledging them (e.g. cancelled) are released instead.
+        """
+        while self._in_flight:
+            await asyncio.sleep(self._backend.visibility_timeout / 3)
+            for task, msg_id in list(self._in_flight.items()):
+                if task is not None and task.done():
+                    self._in_flight.pop(task, None)
+                    await self._backend.call(self._backend.nack, self._name, msg_id)
+                elif task in self._in_flight:
+                    await self._backend.call(self._backend.extend, self._name, msg_id)
+
+    def task_done(self) -> None:
+        msg_id = self._in_flight.pop(asyncio.current_task(), None)
+        if msg_id is not None:
+            self._spawn(self._backend.call(self._backend.ack, self._name, msg_id))
+            if not self._in_flight and self._heartbeat is not None:
+                self._heartbeat.cancel()
+        if self._n_unfinished <= 0:
+            raise ValueError("task_done() called too many times")
+        self._n_unfinished -= 1
+        if self._n_unfinished == 0:
+            self._all_done.set()
+
+    async def join(self) -> None:
+        if self._n_unfinished > 0:
+            await self._all_done.wait()
+        await asyncio.gather(*self._writes, return_exceptions=True)
@@ -0,0 +1,463 @@
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from datetime import datetime
+import logging
+from typing import AsyncIterator, Deque, Dict, List
+import uuid
+
+from aiohttp import web
+from openai import AsyncOpenAI
+from pydantic import BaseModel, Field, ValidationError
+
+from fraudcrawler.settings import (
+    DEFAULT_N_PROC_WKRS,
+    DEFAULT_N_SERP_WKRS,
+    DEFAULT_N_ZYTE_WKRS,
+    PROCESSOR_DEFAULT_MODEL,
+    SERVICE_DEFAULT_HOST,
+    SERVICE_DEFAULT_JOB_TTL,
+    SERVICE_DEFAULT_MAX_JOBS,
+    SERVICE_DEFAULT_PORT,
+)
+from fraudcrawler.base.base import Deepness, Host, Language, Location, Prompt, Setup
+from fraudcrawler.base.backends import DedupIndex
+from fraudcrawler.base.cache import Cache
+from fraudcrawler.base.domains import DomainPolicy, DomainStatsStore
+from fraudcrawler.base.keys import api_key_pool
+from fraudcrawler.base.orchestrator import Orchestrator, ProductItem
+from fraudcrawler.scraping.enrich import Enricher
+from fraudcrawler.scraping.serp import SerpApi
+from fraudcrawler.scraping.zyte import ZyteApi
+
+logger = logging.getLogger(__name__)
+
+
+class FairScheduler:
+    """Shares the concurrent API calls per stage fairly between the jobs of a service.
+
+    Every stage has a capacity of concurrent calls over all jobs. When the capacity is exhausted, the
+    freed slots are handed to the waiting jobs in turn (round-robin), such that a huge job cannot starve
+    the small ones. Stages without a capacity are not limited.
+    """
+
+    def __init__(self, capacity: Dict[str, int]):
+        """Initializes the scheduler.
+
+        Args:
+            capacity: The max number of concurrent calls by stage (e.g. {"zyte": 10}).
+        """
+        self.capacity = capacity
+        self._active: Dict[str, int] = {stage: 0 for stage in capacity}
+        self._waiting: Dict[str, OrderedDict[str, Deque[asyncio.Future]]] = {
+            stage: OrderedDict() for stage in capacity
+        }
+
+    def n_waiting(self, stage: str) -> int:
+        """Returns the number of calls waiting for a slot of a stage."""
+        return sum(len(w) for w in self._waiting.get(stage, {}).values())
+
+    @asynccontextmanager
+    async def slot(self, stage: str, job_id: str) -> AsyncIterator[None]:
+        """Holds a slot of a stage for a call of a job.
+
+        Args:
+            stage: The name of the stage.
+            job_id: The ID of the job.
+        """
+        if stage not in self.capacity:
+            yield
+            return
+
+        waiting = self._waiting[stage]
+        if self._active[stage] < self.capacity[stage] and not waiting:
+            self._active[stage] += 1
+        else:
+            fut = asyncio.get_running_loop().create_future()
+            waiting.setdefault(job_id, deque()).append(fut)
+            try:
+                await fut
+            except asyncio.CancelledError:
+                # A slot handed over right before the cancellation is passed on
+                if fut.done() and not fut.cancelled():
+                    self._release(stage)
+                raise
+        try:
+            yield
+        finally:
+            self._release(stage)
+
+    def _release(self, stage: str) -> None:
+        """Hands a freed slot to the next waiting job (round-robin) or frees it."""
+        waiting = self._waiting[stage]
+        while waiting:
+            job_id, futures = waiting.popitem(last=False)
+            fut = futures.popleft()
+            if futures:
+                waiting[job_id] = futures  # the job queues up behind the others
+            if not fut.cancelled():
+                fut.set_result(None)
+                return
+        self._active[stage] -= 1
+
+
+class JobRequest(BaseModel):
+    """Model for the parameters of a search job (c.f. func:`Orchestrator.run`)."""
+
+    search_term: str
+    language: Language
+    location: Location
+    deepness: Deepness
+    prompts: List[Prompt]
+    marketplaces: List[Host] | None = None
+    excluded_urls: List[Host] | None = None
+
+
+class Job(BaseModel):
+    """Model for the status of a search job."""
+
+    id: str
+    search_term: str
+    status: str = "queued"  # queued, running, completed, failed or cancelled
+    created_at: datetime = Field(default_factory=datetime.now)
+    started_at: datetime | None = None
+    finished_at: datetime | None = None
+    n_products: int = 0
+    n_relevant: int = 0
+    error: str | None = None
+
+
+_FINAL_STATUSES = {"completed", "failed", "cancelled"}
+
+
+class _JobRun:
+    """The state of a job in the service: its status, its finished products and its task."""
+
+    def __init__(self, job: Job, request: JobRequest):
+        self.job = job
+        self.request = request
+        self.products: List[ProductItem] = []
+        self.task: asyncio.Task | None = None
+        self._changed = asyncio.Event()
+
+    def add(self, product: ProductItem) -> None:
+        self.products.append(product)
+        self.job.n_products += 1
+        self.job.n_relevant += int(product.is_relevant == 1)
+        self.notify()
+
+    def notify(self) -> None:
+        """Wakes up the streams of the job."""
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def stream(self) -> AsyncIterator[ProductItem]:
+        """Yields the finished products of the job (the earlier ones first) until the job is finished."""
+        i = 0
+        while True:
+            changed = self._changed
+            finished = self.job.status in _FINAL_STATUSES
+            while i < len(self.products):
+                yield self.products[i]
+                i += 1
+            if finished:
+                return
+            await changed.wait()
+
+
+class _JobOrchestrator(Orchestrator):
+    """Orchestrator of a single job, using the warm clients and the fair scheduler of the service."""
+
+    def __init__(self, scheduler: FairScheduler, run: _JobRun, **kwargs):
+        super().__init__(**kwargs)
+        self._run = run
+        self._scheduler = scheduler
+
+    @asynccontextmanager
+    async def _slot(self, stage: str) -> AsyncIterator[None]:
+        async with self._scheduler.slot(stage=stage, job_id=self._run.job.id):
+            async with super()._slot(stage=stage):
+                yield
+
+    async def _collect_results(
+        self, queue_in: asyncio.Queue[ProductItem | None]
+    ) -> None:
+        while True:
+            product = await queue_in.get()
+            queue_in.task_done()
+            if product is None:
+                break
+            self._run.add(product)
+
+
+class CrawlerService:
+    """Long-running crawler service running search jobs submitted over a local HTTP API.
+
+    The credentials are read once and the HTTP clients, the OpenAI client, the cache and the dedup
+    index are kept warm across the jobs. Up to `max_jobs` jobs run concurrently (further jobs are
+    queued) and share the API calls per stage fairly (c.f. class:`FairScheduler`).
+
+    Endpoints:
+        POST /jobs: Submits a job (c.f. class:`JobRequest`) and returns its status.
+        GET /jobs: Returns the status of all jobs.
+        GET /jobs/{job_id}: Returns the status of a job.
+        GET /jobs/{job_id}/results: Streams the finished products of a job (NDJSON) until it is finished.
+        DELETE /jobs/{job_id}: Cancels a job.
+    """
+
+    def __init__(
+        self,
+        cache: Cache | None = None,
+        dedup_index: DedupIndex | None = None,
+        domain_stats: DomainStatsStore | None = None,
+        domain_policy: DomainPolicy | None = None,
+        openai_model: str = PROCESSOR_DEFAULT_MODEL,
+        max_jobs: int = SERVICE_DEFAULT_MAX_JOBS,
+        capacity: Dict[str, int] | None = None,
+        job_ttl: float = SERVICE_DEFAULT_JOB_TTL,
+    ):
+        """Initializes the service with the credentials from the `.env` file.
+
+        Args:
+            cache: The cache for the SerpApi and DataForSEO responses and the classifications (optional).
+            dedup_index: The index of the URLs collected by all jobs; every URL is only crawled once (optional).
+            domain_stats: The persistent per-domain statistics, updated with the results of every job (optional).
+            domain_policy: The policy for domains with a proven zero yield in `domain_stats` (optional).
+            openai_model: The model to use for the processing (optional).
+            max_jobs: The max number of jobs running concurrently (optional).
+            capacity: The max number of concurrent calls per stage over all jobs (optional).
+            job_ttl: Seconds the status and products of a finished job are kept (optional).
+        """
+        self._setup = Setup()  # type: ignore[call-arg]
+        self._cache = cache
+        self._dedup_index = dedup_index
+        self._domain_stats = domain_stats
+        self._domain_policy = domain_policy
+        self._openai_model = openai_model
+        self._job_ttl = job_ttl
+        self._n_jobs = asyncio.Semaphore(max_jobs)
+        self.scheduler = FairScheduler(
+            capacity
+            or {
+                "serp": DEFAULT_N_SERP_WKRS,
+                "zyte": DEFAULT_N_ZYTE_WKRS,
+                "proc": DEFAULT_N_PROC_WKRS,
+            }
+        )
+        self.serpapi = SerpApi(api_key=self._setup.serpapi_key, cache=cache)
+        self.enricher = Enricher(
+            user=self._setup.dataforseo_user,
+            pwd=self._setup.dataforseo_pwd,
+            cache=cache,
+        )
+        self.zyteapi = ZyteApi(api_key=self._setup.zyteapi_key)
+        self.openai = api_key_pool(self._setup.openaiapi_key).map(
+            lambda key: AsyncOpenAI(api_key=key)
+        )
+        self._runs: Dict[str, _JobRun] = {}
+
+    async def start(self) -> None:
+        """Opens the persistent HTTP sessions of the clients."""
+        for client in [self.serpapi, self.enricher, self.zyteapi]:
+            await client.open()
+        logger.info("Crawler service started")
+
+    async def stop(self) -> None:
+        """Cancels the unfinished jobs and closes the clients."""
+        tasks = [r.task for r in self._runs.values() if r.task and not r.task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for client in [self.serpapi, self.enricher, self.zyteapi]:
+            await client.close()
+        if self._domain_stats is not None:
+            self._domain_stats.flush()
+        logger.info("Crawler service stopped")
+
+    def submit(self, request: JobRequest) -> Job:
+        """Submits a search job and returns its status.
+
+        Args:
+            request: The parameters of the job.
+        """
+        self._evict()
+        job = Job(id=uuid.uuid4().hex, search_term=request.search_term)
+        run = _JobRun(job=job, request=request)
+        run.task = asyncio.create_task(self._run_job(run))
+        self._runs[job.id] = run
+        logger.info(f'Submitted job {job.id} for search_term="{job.search_term}"')
+        return job
+
+    def _evict(self) -> None:
+        """Removes the finished jobs older than `job_ttl` (with their products)."""
+        now = datetime.now()
+        for job_id, run in list(self._runs.items()):
+            finished_at = run.job.finished_at
+            if finished_at and (now - finished_at).total_seconds() > self._job_ttl:
+                del self._runs[job_id]
+
+    def jobs(self) -> List[Job]:
+        """Returns the status of all jobs."""
+        self._evict()
+        return [r.job for r in self._runs.values()]
+
+    def job(self, job_id: str) -> Job | None:
+        """Returns the status of a job (None if unknown)."""
+        run = self._runs.get(job_id)
+        return run.job if run is not None else None
+
+    def cancel(self, job_id: str) -> Job | None:
+        """Cancels a job and returns its status (None if unknown)."""
+        run = self._runs.get(job_id)
+        if run is None:
+            return None
+        if run.task is not None and not run.task.done():
+            run.task.cancel()
+        return run.job
+
+    def stream(self, job_id: str) -> AsyncIterator[ProductItem]:
+        """Yields the finished products of a job as they complete, until the job is finished.
+
+        Args:
+            job_id: The ID of the job.
+        """
+        run = self._runs.get(job_id)
+        if run is None:
+            raise ValueError(f'No job with id="{job_id}"')
+        return run.stream()
+
+    def _create_orchestrator(self, run: _JobRun) -> Orchestrator:
+        """Creates the orchestrator of a job (sharing the warm clients and caches of the service)."""
+        return _JobOrchestrator(
+            scheduler=self.scheduler,
+            run=run,
+            serpapi_key=self._setup.serpapi_key,
+            dataforseo_user=self._setup.dataforseo_user,
+            dataforseo_pwd=self._setup.dataforseo_pwd,
+            zyteapi_key=self._setup.zyteapi_key,
+            openaiapi_key=self._setup.openaiapi_key,
+            openai_model=self._openai_model,
+            cache=self._cache,
+            domain_stats=self._domain_stats,
+            domain_policy=self._domain_policy,
+            dedup_index=self._dedup_index,
+            serpapi=self.serpapi,
+            enricher=self.enricher,
+            zyteapi=self.zyteapi,
+            openai_client=self.openai,
+        )
+
+    async def _run_job(self, run: _JobRun) -> None:
+        """Runs a job (once one of the `max_jobs` slots is free)."""
+        job, request = run.job, run.request
+        try:
+            async with self._n_jobs:
+                job.status = "running"
+                job.started_at = datetime.now()
+                run.notify()
+                orchestrator = self._create_orchestrator(run)
+                await orchestrator.run(
+                    search_term=request.search_term,
+                    language=request.language,
+                    location=request.location,
+                    deepness=request.deepness,
+                    prompts=request.prompts,
+                    marketplaces=request.marketplaces,
+                    excluded_urls=request.excluded_urls,
+                )
+            job.status = "completed"
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+            raise
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            logger.error(f"Job {job.id} failed: {e}")
+        finally:
+            job.finished_at = datetime.now()
+            run.notify()
+            logger.info(f"Job {job.id} {job.status} with {job.n_products} products")
+
+    # ---------------------------
+    #          HTTP API
+    # ---------------------------
+    @staticmethod
+    def _json(job: Job, status: int = 200) -> web.Response:
+        return web.Response(
+            text=job.model_dump_json(), status=status, content_type="application/json"
+        )
+
+    async def _post_job(self, request: web.Request) -> web.Response:
+        try:
+            job_request = JobRequest.model_validate(await request.json())
+        except (ValidationError, ValueError) as e:
+            raise web.HTTPBadRequest(text=str(e))
+        return self._json(self.submit(job_request), status=201)
+
+    async def _get_jobs(self, request: web.Request) -> web.Response:
+        return web.json_response([j.model_dump(mode="json") for j in self.jobs()])
+
+    async def _get_job(self, request: web.Request) -> web.Response:
+        job = self.job(request.match_info["job_id"])
+        if job is None:
+            raise web.HTTPNotFound()
+        return self._json(job)
+
+    async def _delete_job(self, request: web.Request) -> web.Response:
+        job = self.cancel(request.match_info["job_id"])
+        if job is None:
+            raise web.HTTPNotFound()
+        return self._json(job)
+
+    async def _get_results(self, request: web.Request) -> web.StreamResponse:
+        try:
+            products = self.stream(request.match_info["job_id"])
+        except ValueError:
+            raise web.HTTPNotFound()
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        async for product in products:
+            await response.write((product.model_dump_json() + "\n").encode())
+        await response.write_eof()
+        return response
+
+    def app(self) -> web.Application:
+        """Returns the web application of the HTTP API (starting and stopping the service with it)."""
+        app = web.Application()
+        app.add_routes(
+            [
+                web.post("/jobs", self._post_job),
+                web.get("/jobs", self._get_jobs),
+                web.get("/jobs/{job_id}", self._get_job),
+                web.delete("/jobs/{job_id}", self._delete_job),
+                web.get("/jobs/{job_id}/results", self._get_results),
+            ]
+        )
+
+        async def on_startup(_: web.Application) -> None:
+            await self.start()
+
+        async def on_cleanup(_: web.Application) -> None:
+            await self.stop()
+
+        app.on_startup.append(on_startup)
+        app.on_cleanup.append(on_cleanup)
+        return app
+
+    def serve(
+        self,
+        host: str = SERVICE_DEFAULT_HOST,
+        port: int = SERVICE_DEFAULT_PORT,
+        path: str | None = None,
+    ) -> None:
+        """Serves the HTTP API until interrupted.
+
+        Args:
+            host: The host to listen on (optional).
+            port: The port to listen on (optional).
+            path: The Unix socket to listen on instead of host and port (optional).
+        """
+        if path is not None:
+            web.run_app(self.app(), path=path)
+        else:
+            web.run_app(self.app(), host=host, port=port)
@@ -0,0 +1,303 @@
+from abc import ABC, abstractmethod
+import asyncio
+from datetime import datetime
+import json
+import logging
+from pathlib import Path
+import time
+from typing import Callable, Dict, List, Set, Tuple, cast
+
+from openai import AsyncOpenAI
+
+from fraudcrawler.settings import (
+    BATCH_COMPLETION_WINDOW,
+    BATCH_DEFAULT_DIR,
+    BATCH_DEFAULT_POLL_INTERVAL,
+    BATCH_DEFAULT_TIMEOUT,
+    BATCH_MAX_REQUESTS,
+    PROCESSOR_SKIPPED,
+)
+from fraudcrawler.base.base import Prompt
+from fraudcrawler.processing.processor import Processor
+
+logger = logging.getLogger(__name__)
+
+# The records to classify by their ID: (url, name, description)
+BatchRecords = Dict[str, Tuple[str, str | None, str | None]]
+
+
+class BatchBackend(ABC):
+    """Abstract base class for the backends executing batch files of OpenAI requests.
+
+    Abstract methods:
+        submit: Submits a batch file and returns the ID of the batch.
+        status: Returns the status of a batch (c.f. the statuses of the OpenAI Batch API).
+        results: Returns the response lines of a finished batch.
+    """
+
+    @abstractmethod
+    async def submit(self, filename: Path) -> str:
+        """Submits a batch file (JSONL of requests) and returns the ID of the batch.
+
+        Args:
+            filename: The batch file.
+        """
+        pass
+
+    @abstractmethod
+    async def status(self, batch_id: str) -> str:
+        """Returns the status of a batch (e.g. "in_progress", "completed", "failed", "expired").
+
+        Args:
+            batch_id: The ID of the batch.
+        """
+        pass
+
+    @abstractmethod
+    async def results(self, batch_id: str) -> List[dict]:
+        """Returns the response lines (incl. the failed requests) of a finished batch.
+
+        Args:
+            batch_id: The ID of the batch.
+        """
+        pass
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """Executes the batch files with the OpenAI Batch API."""
+
+    def __init__(self, api_key: str, completion_window: str = BATCH_COMPLETION_WINDOW):
+        """Initializes the backend.
+
+        Args:
+            api_key: The OpenAI API key.
+            completion_window: The time frame within which the batch is processed (optional).
+        """
+        self._client = AsyncOpenAI(api_key=api_key)
+        self._completion_window = completion_window
+
+    async def submit(self, filename: Path) -> str:
+        with open(filename, "rb") as file:
+            uploaded = await self._client.files.create(file=file, purpose="batch")
+        batch = await self._client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint="/v1/chat/completions",
+            completion_window=self._completion_window,  # type: ignore[arg-type]
+        )
+        return batch.id
+
+    async def status(self, batch_id: str) -> str:
+        batch = await self._client.batches.retrieve(batch_id)
+        return batch.status
+
+    async def results(self, batch_id: str) -> List[dict]:
+        batch = await self._client.batches.retrieve(batch_id)
+        lines: List[dict] = []
+        for file_id in [batch.output_file_id, batch.error_file_id]:
+            if file_id is None:
+                continue
+            content = await self._client.files.content(file_id)
+            lines.extend(json.loads(ln) for ln in content.text.splitlines() if ln)
+        return lines
+
+
+class LocalBatchBackend(BatchBackend):
+    """Local stand-in for the OpenAI Batch API (e.g. for testing), answering every request with a function.
+
+    The batches complete after `n_polls` status requests.
+    """
+
+    def __init__(self, answer: Callable[[dict], str], n_polls: int = 0):
+        """Initializes the backend.
+
+        Args:
+            answer: The function returning the answer (content) to the body of a request.
+            n_polls: The number of status requests before a batch is completed (optional).
+        """
+        self._answer = answer
+        self._n_polls = n_polls
+        self._batches: Dict[str, List[dict]] = {}
+        self._polls: Dict[str, int] = {}
+
+    async def submit(self, filename: Path) -> str:
+        batch_id = f"batch_{len(self._batches)}"
+        with open(filename) as file:
+            self._batches[batch_id] = [json.loads(ln) for ln in file if ln.strip()]
+        self._polls[batch_id] = 0
+        return batch_id
+
+    async def status(self, batch_id: str) -> str:
+        self._polls[batch_id] += 1
+        if self._polls[batch_id] <= self._n_polls:
+            return "in_progress"
+        return "completed"
+
+    async def results(self, batch_id: str) -> List[dict]:
+        lines = []
+        for i, request in enumerate(self._batches[batch_id]):
+            content = self._answer(request["body"])
+            body = {
+                "choices": [{"message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 1},
+            }
+            lines.append(
+                {
+                    "id": f"{batch_id}_req_{i}",
+                    "custom_id": request["custom_id"],
+                    "response": {"status_code": 200, "body": body},
+                    "error": None,
+                }
+            )
+        return lines
+
+
+class BatchClassifier:
+    """Classifies the products in batches (c.f. class:`BatchBackend`) instead of calling OpenAI per product.
+
+    For every level of prompts (c.f. func:`Processor.order_prompts`) the classification requests are
+    written to JSONL batch files, submitted and polled until completed; the responses are matched to
+    the products by their custom ID `<record_id>:<prompt_name>`.
+    """
+
+    _final_statuses = {"completed", "failed", "expired", "cancelled"}
+
+    def __init__(
+        self,
+        backend: BatchBackend,
+        directory: Path | str = BATCH_DEFAULT_DIR,
+        poll_interval: float = BATCH_DEFAULT_POLL_INTERVAL,
+        timeout: float = BATCH_DEFAULT_TIMEOUT,
+        max_requests: int = BATCH_MAX_REQUESTS,
+    ):
+        """Initializes the batch classifier.
+
+        Args:
+            backend: The backend executing the batch files.
+            directory: The directory to write the batch files to (optional).
+            poll_interval: Seconds between the status requests (optional).
+            timeout: Seconds to wait for a batch before giving up (optional).
+            max_requests: Max number of requests per batch file (optional).
+        """
+        self._backend = backend
+        self._directory = Path(directory)
+        self._poll_interval = poll_interval
+        self._timeout = timeout
+        self._max_requests = max_requests
+
+    def _write(self, requests: List[dict], name: str) -> Path:
+        """Writes the requests to a batch file."""
+        self._directory.mkdir(parents=True, exist_ok=True)
+        filename = self._directory / f"{name}.jsonl"
+        with open(filename, "w") as file:
+            for request in requests:
+                file.write(json.dumps(request) + "\n")
+        return filename
+
+    async def _execute(self, filename: Path) -> Dict[str, dict]:
+        """Submits a batch file, polls until the batch is finished and returns its responses by custom ID."""
+        batch_id = await self._backend.submit(filename)
+        logger.info(f"Submitted batch {batch_id} ({filename.name})")
+
+        start = time.monotonic()
+        while True:
+            status = await self._backend.status(batch_id)
+            if status in self._final_statuses:
+                break
+            if time.monotonic() - start > self._timeout:
+                logger.error(f"Batch {batch_id} not finished after {self._timeout}s")
+                return {}
+            await asyncio.sleep(self._poll_interval)
+
+        if status != "completed":
+            logger.error(f"Batch {batch_id} finished with status {status}")
+        lines = await self._backend.results(batch_id)
+        logger.info(f"Batch {batch_id} {status} with {len(lines)} responses")
+        return {ln["custom_id"]: ln for ln in lines}
+
+    async def classify_all(
+        self,
+        processor: Processor,
+        prompts: List[Prompt],
+        records: BatchRecords,
+        failed: Dict[str, Set[str]] | None = None,
+    ) -> Dict[str, Dict[str, int]]:
+        """Classifies the records with all prompts and returns the classifications by record ID.
+
+        Gated prompts (c.f. func:`Processor.classify_all`) are recorded as `PROCESSOR_SKIPPED`. As with
+        func:`Processor.classify`, the local tier and the cache are used before a request is added to the
+        batch and the valid answers are cached; the cascade does not apply, the batches use the main model.
+
+        Args:
+            processor: The processor creating the requests and parsing the responses.
+            prompts: The list of prompts.
+            records: The records to classify by their ID.
+            failed: Collects the names of the failed prompts by record ID (c.f. func:`Processor.parse_batch_response`) (optional).
+        """
+        classifications: Dict[str, Dict[str, int]] = {rid: {} for rid in records}
+        run_name = datetime.now().strftime("%Y%m%d%H%M%S")
+        for i, level in enumerate(processor.order_prompts(prompts)):
+            requests: List[dict] = []
+            pending: Dict[str, Tuple[str, Prompt]] = {}
+            for rid, (url, name, description) in records.items():
+                for prompt in level:
+                    if not processor.run_if_met(
+                        prompt=prompt, classifications=classifications[rid]
+                    ):
+                        classifications[rid][prompt.name] = PROCESSOR_SKIPPED
+                        continue
+                    # Local tier and cache first, only the remaining products are sent in the batch
+                    if name is not None and description is not None:
+                        classification = processor.classify_offline(
+                            prompt=prompt, url=url, name=name, description=description
+                        )
+                        if classification is not None:
+                            classifications[rid][prompt.name] = classification
+                            continue
+                    custom_id = f"{rid}:{prompt.name}"
+                    request = processor.batch_request(
+                        custom_id=custom_id,
+                        prompt=prompt,
+                        url=url,
+                        name=name,
+                        description=description,
+                    )
+                    if request is None:
+                        classifications[rid][prompt.name] = prompt.default_if_missing
+                        continue
+                    requests.append(request)
+                    pending[custom_id] = (rid, prompt)
+            if not requests:
+                continue
+
+            # Execute the batch files of the level concurrently
+            chunks = [
+                requests[j : j + self._max_requests]
+                for j in range(0, len(requests), self._max_requests)
+            ]
+            filenames = [
+                self._write(chunk, name=f"{run_name}_level{i}_{j}")
+                for j, chunk in enumerate(chunks)
+            ]
+            responses: Dict[str, dict] = {}
+            for res in await asyncio.gather(*[self._execute(f) for f in filenames]):
+                responses.update(res)
+
+            for custom_id, (rid, prompt) in pending.items():
+                errors: Set[str] = set()
+                classification = processor.parse_batch_response(
+                    prompt=prompt, response=responses.get(custom_id), failed=errors
+                )
+                classifications[rid][prompt.name] = classification
+                if errors:
+                    if failed is not None:
+                        failed.setdefault(rid, set()).update(errors)
+                    continue
+                url, name, description = records[rid]
+                processor.cache_classification(
+                    prompt=prompt,
+                    url=url,
+                    name=cast(str, name),
+                    description=cast(str, description),
+                    classification=classification,
+                )
+        return classifications
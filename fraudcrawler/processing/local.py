@@ -0,0 +1,364 @@
+import logging
+from pathlib import Path
+from pydantic import BaseModel
+from typing import Dict, List, NamedTuple, Sequence, Tuple
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from fraudcrawler.settings import (
+    LOCAL_CLASSIFIER_DEFAULT_DIR,
+    LOCAL_CLASSIFIER_DEFAULT_EPOCHS,
+    LOCAL_CLASSIFIER_DEFAULT_L2,
+    LOCAL_CLASSIFIER_DEFAULT_LEARNING_RATE,
+    LOCAL_CLASSIFIER_DEFAULT_THRESHOLD,
+    LOCAL_CLASSIFIER_N_FEATURES,
+)
+from fraudcrawler.scraping.terms import normalize_term
+
+logger = logging.getLogger(__name__)
+
+
+def product_text(url: str, name: str | None, description: str | None) -> str:
+    """Creates the text of a product used as input of the local classifiers."""
+    return f"{url}\n{name or ''}\n{description or ''}"
+
+
+class HashedFeatures(NamedTuple):
+    """Sparse feature matrix in coordinate format (row, column and value of the non-zero entries)."""
+
+    n_rows: int
+    rows: np.ndarray
+    cols: np.ndarray
+    vals: np.ndarray
+
+    def dot(self, weights: np.ndarray) -> np.ndarray:
+        """Computes `X @ weights` for a dense weight matrix of shape (n_features, n_classes)."""
+        contrib = self.vals[:, None] * weights[self.cols]
+        return np.stack(
+            [
+                np.bincount(self.rows, weights=contrib[:, c], minlength=self.n_rows)
+                for c in range(weights.shape[1])
+            ],
+            axis=1,
+        )
+
+    def tdot(self, grad: np.ndarray, n_features: int) -> np.ndarray:
+        """Computes `X.T @ grad` for a dense matrix of shape (n_rows, n_classes)."""
+        contrib = self.vals[:, None] * grad[self.rows]
+        return np.stack(
+            [
+                np.bincount(self.cols, weights=contrib[:, c], minlength=n_features)
+                for c in range(grad.shape[1])
+            ],
+            axis=1,
+        )
+
+
+def hash_features(
+    texts: Sequence[str], n_features: int = LOCAL_CLASSIFIER_N_FEATURES
+) -> HashedFeatures:
+    """Vectorizes texts into L2-normalized hashed uni- and bigram counts (signed hashing trick).
+
+    The hashes are stable across processes, such that trained weights can be stored and reloaded.
+
+    Args:
+        texts: The texts to vectorize.
+        n_features: The dimension of the feature vectors.
+    """
+    rows: List[int] = []
+    cols: List[int] = []
+    vals: List[float] = []
+    for i, text in enumerate(texts):
+        tokens = normalize_term(text).split()
+        grams = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        counts: Dict[int, float] = {}
+        for gram in grams:
+            h = zlib.crc32(gram.encode("utf-8"))
+            sign = 1.0 if h & 0x80000000 else -1.0
+            counts[h % n_features] = counts.get(h % n_features, 0.0) + sign
+        values = np.array(list(counts.values()))
+        values = np.sign(values) * np.log1p(np.abs(values))
+        norm = np.linalg.norm(values)
+        rows.extend([i] * len(counts))
+        cols.extend(counts)
+        vals.extend(values / norm if norm > 0 else values)
+    return HashedFeatures(
+        n_rows=len(texts),
+        rows=np.array(rows, dtype=np.int64),
+        cols=np.array(cols, dtype=np.int64),
+        vals=np.array(vals, dtype=np.float64),
+    )
+
+
+class LocalClassifier:
+    """Multinomial logistic regression on hashed text features (trained on CPU with numpy)."""
+
+    def __init__(
+        self, classes: List[int], n_features: int = LOCAL_CLASSIFIER_N_FEATURES
+    ):
+        """Initializes an untrained classifier.
+
+        Args:
+            classes: The classes of the prompt (c.f. attribute:`Prompt.allowed_classes`).
+            n_features: The dimension of the hashed feature vectors.
+        """
+        self.classes = list(classes)
+        self.n_features = n_features
+        self.weights = np.zeros((n_features, len(classes)))
+        self.bias = np.zeros(len(classes))
+
+    def _proba(self, x: HashedFeatures) -> np.ndarray:
+        logits = x.dot(self.weights) + self.bias
+        logits -= logits.max(axis=1, keepdims=True)
+        exp = np.exp(logits)
+        return exp / exp.sum(axis=1, keepdims=True)
+
+    def fit(
+        self,
+        texts: Sequence[str],
+        labels: Sequence[int],
+        epochs: int = LOCAL_CLASSIFIER_DEFAULT_EPOCHS,
+        learning_rate: float = LOCAL_CLASSIFIER_DEFAULT_LEARNING_RATE,
+        l2: float = LOCAL_CLASSIFIER_DEFAULT_L2,
+    ) -> "LocalClassifier":
+        """Trains the classifier with full-batch gradient descent on the cross-entropy loss.
+
+        Args:
+            texts: The product texts (c.f. func:`product_text`).
+            labels: The classes assigned by the LLM.
+            epochs: The number of gradient steps.
+            learning_rate: The step size.
+            l2: The L2 regularization of the weights.
+        """
+        x = hash_features(texts, n_features=self.n_features)
+        y = np.zeros((len(labels), len(self.classes)))
+        y[np.arange(len(labels)), [self.classes.index(lbl) for lbl in labels]] = 1.0
+        for _ in range(epochs):
+            grad = (self._proba(x) - y) / len(labels)
+            x_grad = x.tdot(grad, n_features=self.n_features)
+            self.weights -= learning_rate * (x_grad + l2 * self.weights)
+            self.bias -= learning_rate * grad.sum(axis=0)
+        return self
+
+    def predict(self, texts: Sequence[str]) -> List[Tuple[int, float]]:
+        """Returns the predicted class together with its probability for every text.
+
+        Args:
+            texts: The product texts (c.f. func:`product_text`).
+        """
+        proba = self._proba(hash_features(texts, n_features=self.n_features))
+        idx = proba.argmax(axis=1)
+        return [(self.classes[i], float(proba[j, i])) for j, i in enumerate(idx)]
+
+    def save(self, filename: Path | str) -> None:
+        """Stores the trained classifier in a `.npz` file."""
+        np.savez(filename, classes=self.classes, weights=self.weights, bias=self.bias)
+
+    @classmethod
+    def load(cls, filename: Path | str) -> "LocalClassifier":
+        """Loads a classifier stored with func:`save`."""
+        data = np.load(filename)
+        clf = cls(classes=data["classes"].tolist(), n_features=data["weights"].shape[0])
+        clf.weights = data["weights"]
+        clf.bias = data["bias"]
+        return clf
+
+
+class LocalClassifierTier:
+    """Local classification tier in front of the LLM (one class:`LocalClassifier` per prompt name).
+
+    Predictions with a probability of at least `threshold` are accepted; all other products (and
+    prompts without a local classifier) are passed on to the LLM.
+    """
+
+    def __init__(
+        self,
+        classifiers: Dict[str, LocalClassifier],
+        threshold: float = LOCAL_CLASSIFIER_DEFAULT_THRESHOLD,
+    ):
+        """Initializes the tier.
+
+        Args:
+            classifiers: The local classifiers by prompt name.
+            threshold: The minimal probability for accepting a local prediction.
+        """
+        self._classifiers = classifiers
+        self._threshold = threshold
+        self.n_accepted = 0
+        self.n_escalated = 0
+
+    @classmethod
+    def load(
+        cls,
+        directory: Path | str,
+        threshold: float = LOCAL_CLASSIFIER_DEFAULT_THRESHOLD,
+    ) -> "LocalClassifierTier":
+        """Loads all classifiers `<prompt name>.npz` of a directory (c.f. func:`train_local_classifiers`).
+
+        Args:
+            directory: The directory containing the stored classifiers.
+            threshold: The minimal probability for accepting a local prediction.
+        """
+        classifiers = {
+            fn.stem: LocalClassifier.load(fn)
+            for fn in sorted(Path(directory).glob("*.npz"))
+        }
+        return cls(classifiers=classifiers, threshold=threshold)
+
+    def has_classifier(self, prompt_name: str) -> bool:
+        """Whether the tier has a local classifier for a prompt."""
+        return prompt_name in self._classifiers
+
+    def classify(
+        self, prompt_name: str, url: str, name: str, description: str
+    ) -> int | None:
+        """Returns the confident local prediction of a prompt (or None if the LLM has to decide).
+
+        Args:
+            prompt_name: The name of the prompt.
+            url: Product URL.
+            name: Product name.
+            description: Product description.
+        """
+        clf = self._classifiers.get(prompt_name)
+        if clf is None:
+            return None
+        text = product_text(url=url, name=name, description=description)
+        cls, proba = clf.predict([text])[0]
+        if proba < self._threshold:
+            self.n_escalated += 1
+            return None
+        self.n_accepted += 1
+        return cls
+
+
+class LocalEvaluation(BaseModel):
+    """Model for the evaluation of a local classifier against the LLM labels of a test set.
+
+    `accuracy` is measured over all test products, `avoided_calls` is the share of products whose
+    prediction is confident enough to skip the LLM and `accepted_accuracy` the accuracy on these.
+    """
+
+    prompt: str
+    n_train: int
+    n_test: int
+    accuracy: float
+    avoided_calls: float
+    accepted_accuracy: float | None
+
+
+def load_labeled_products(
+    filenames: Sequence[Path | str], prompt_name: str, classes: List[int]
+) -> pd.DataFrame:
+    """Loads the products classified by the LLM from stored results (c.f. func:`FraudCrawlerClient.load_results`).
+
+    Only products with a label in `classes` are kept (i.e. no filtered or failed classifications).
+
+    Args:
+        filenames: The csv files of the stored results.
+        prompt_name: The name of the prompt (i.e. the column of its classifications).
+        classes: The allowed classes of the prompt.
+    """
+    frames = [pd.read_csv(fn) for fn in filenames]
+    frames = [df for df in frames if prompt_name in df.columns]
+    if not frames:
+        return pd.DataFrame(columns=["text", "label"])
+    df = pd.concat(frames, ignore_index=True)
+    df = df[df[prompt_name].isin(classes)].drop_duplicates(subset="url")
+    texts = [
+        product_text(url=u, name=n, description=d)
+        for u, n, d in zip(
+            df["url"],
+            df["product_name"].fillna(""),
+            df["product_description"].fillna(""),
+        )
+    ]
+    return pd.DataFrame({"text": texts, "label": df[prompt_name].astype(int).tolist()})
+
+
+def train_local_classifier(
+    texts: Sequence[str],
+    labels: Sequence[int],
+    classes: List[int],
+    prompt_name: str = "",
+    test_size: float = 0.2,
+    threshold: float = LOCAL_CLASSIFIER_DEFAULT_THRESHOLD,
+    seed: int = 0,
+) -> Tuple[LocalClassifier, LocalEvaluation]:
+    """Trains a local classifier on a random split of the labeled products and evaluates it on the rest.
+
+    Args:
+        texts: The product texts (c.f. func:`product_text`).
+        labels: The classes assigned by the LLM.
+        classes: The allowed classes of the prompt.
+        prompt_name: The name of the prompt (for the report).
+        test_size: The share of the products held out for the evaluation.
+        threshold: The minimal probability for accepting a local prediction.
+        seed: The seed of the split.
+    """
+    idx = np.random.default_rng(seed).permutation(len(texts))
+    n_test = int(round(len(texts) * test_size))
+    test, train = idx[:n_test], idx[n_test:]
+    clf = LocalClassifier(classes=classes).fit(
+        texts=[texts[i] for i in train], labels=[labels[i] for i in train]
+    )
+
+    preds = clf.predict([texts[i] for i in test]) if n_test else []
+    correct = np.array([cls == labels[i] for (cls, _), i in zip(preds, test)])
+    accepted = np.array([proba >= threshold for _, proba in preds], dtype=bool)
+    evaluation = LocalEvaluation(
+        prompt=prompt_name,
+        n_train=len(train),
+        n_test=n_test,
+        accuracy=float(correct.mean()) if n_test else 0.0,
+        avoided_calls=float(accepted.mean()) if n_test else 0.0,
+        accepted_accuracy=float(correct[accepted].mean()) if accepted.any() else None,
+    )
+    return clf, evaluation
+
+
+def train_local_classifiers(
+    classes: Dict[str, List[int]],
+    filenames: Sequence[Path | str],
+    directory: Path | str = LOCAL_CLASSIFIER_DEFAULT_DIR,
+    test_size: float = 0.2,
+    threshold: float = LOCAL_CLASSIFIER_DEFAULT_THRESHOLD,
+) -> List[LocalEvaluation]:
+    """Trains, evaluates and stores a local classifier for every prompt from stored results.
+
+    The classifiers are stored as `<directory>/<prompt name>.npz` (c.f. func:`LocalClassifierTier.load`).
+
+    Args:
+        classes: The allowed classes by prompt name.
+        filenames: The csv files of the stored results.
+        directory: The directory to store the classifiers in.
+        test_size: The share of the products held out for the evaluation.
+        threshold: The minimal probability for accepting a local prediction.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    evaluations = []
+    for prompt_name, prompt_classes in classes.items():
+        df = load_labeled_products(
+            filenames=filenames, prompt_name=prompt_name, classes=prompt_classes
+        )
+        if df.empty:
+            logger.warning(f'No labeled products found for prompt="{prompt_name}".')
+            continue
+        clf, evaluation = train_local_classifier(
+            texts=df["text"].tolist(),
+            labels=df["label"].tolist(),
+            classes=prompt_classes,
+            prompt_name=prompt_name,
+            test_size=test_size,
+            threshold=threshold,
+        )
+        clf.save(directory / f"{prompt_name}.npz")
+        logger.info(
+            f'Local classifier for prompt="{prompt_name}": accuracy={evaluation.accuracy:.3f}, '
+            f"avoided calls={evaluation.avoided_calls:.1%}, accuracy on accepted={evaluation.accepted_accuracy}"
+        )
+        evaluations.append(evaluation)
+    return evaluations
@@ -1,26 +1,127 @@
+import asyncio
+import hashlib
+import json
 import logging
+import math
+from pydantic import BaseModel
+import time
+from typing import Dict, List, Set, Tuple, cast
 
 from openai import AsyncOpenAI
 
-from fraudcrawler.base.base import Prompt
-from fraudcrawler.settings import PROCESSOR_USER_PROMPT_TEMPLATE
+from fraudcrawler.base.base import Prompt, SingleFlight
+from fraudcrawler.base.cache import Cache
+from fraudcrawler.base.keys import KeyPool, api_key_pool
+from fraudcrawler.processing.local import LocalClassifierTier
+from fraudcrawler.processing.tokens import (
+    TokenUsage,
+    clean_text,
+    compress_text,
+    count_tokens,
+)
+from fraudcrawler.settings import (
+    OPENAI_DIGIT_TOKEN_OFFSET,
+    OPENAI_PRICES_PER_1M_TOKENS,
+    PROCESSOR_CACHE_TTL,
+    PROCESSOR_CASCADE_DEFAULT_MODEL,
+    PROCESSOR_CASCADE_DEFAULT_THRESHOLD,
+    PROCESSOR_DEFAULT_MAX_DESCRIPTION_TOKENS,
+    PROCESSOR_SKIPPED,
+    PROCESSOR_USER_PROMPT_TEMPLATE,
+)
 
 
 logger = logging.getLogger(__name__)
 
 
+class Cascade(BaseModel):
+    """Model for the cascade of a cheap and the main model.
+
+    Every product is first classified by the cheap `model` (with the output restricted to the
+    allowed classes); only answers with a probability below `threshold` are escalated to the main model.
+    """
+
+    model: str = PROCESSOR_CASCADE_DEFAULT_MODEL
+    threshold: float = PROCESSOR_CASCADE_DEFAULT_THRESHOLD
+
+
+class CascadeStats(BaseModel):
+    """Model for the metrics of the cascade.
+
+    The latency and cost saved compare the cascade against classifying every product with the main
+    model; the main model's latency is measured on the escalated calls and its cost is estimated from
+    the token usage of the cheap calls (same prompts).
+    """
+
+    n_cheap: int = 0
+    n_escalated: int = 0
+    cheap_latency: float = 0.0
+    n_main: int = 0
+    main_latency: float = 0.0
+    cheap_cost: float = 0.0
+    main_cost_avoided: float = 0.0
+
+    @property
+    def escalation_rate(self) -> float | None:
+        """The share of the cheap classifications escalated to the main model."""
+        return self.n_escalated / self.n_cheap if self.n_cheap else None
+
+    @property
+    def latency_saved(self) -> float | None:
+        """The total latency (in seconds) saved (None before the first escalation)."""
+        if not self.n_main:
+            return None
+        n_accepted = self.n_cheap - self.n_escalated
+        return n_accepted * self.main_latency / self.n_main - self.cheap_latency
+
+    @property
+    def cost_saved(self) -> float:
+        """The cost (in USD) saved."""
+        return self.main_cost_avoided - self.cheap_cost
+
+
 class Processor:
     """Processes product data for classification based on a prompt configuration."""
 
-    def __init__(self, api_key: str, model: str):
+    _cache_namespace = "openai#classification"
+
+    def __init__(
+        self,
+        api_key: str | List[str] | KeyPool[str],
+        model: str,
+        local_tier: LocalClassifierTier | None = None,
+        cascade: Cascade | None = None,
+        max_description_tokens: int | None = PROCESSOR_DEFAULT_MAX_DESCRIPTION_TOKENS,
+        cache: Cache | None = None,
+        cache_ttl: float = PROCESSOR_CACHE_TTL,
+        client: AsyncOpenAI | KeyPool[AsyncOpenAI] | None = None,
+    ):
         """Initializes the Processor.
 
         Args:
-            api_key: The OpenAI API key.
+            api_key: The OpenAI API key, or several keys (a list, comma separated or a class:`KeyPool`) used in turn.
             model: The OpenAI model to use.
+            local_tier: Local classifiers whose confident predictions replace the OpenAI call (optional).
+            cascade: Classify with a cheap model first and escalate the uncertain answers to `model` (optional).
+            max_description_tokens: The token budget of the cleaned product description (optional; None for no limit).
+            cache: The cache for the classifications (optional).
+            cache_ttl: Time (in seconds) a cached classification is used (optional).
+            client: A pre-built (e.g. warm) OpenAI client, or a pool of them, replacing the ones of `api_key` (optional).
         """
-        self._client = AsyncOpenAI(api_key=api_key)
+        if isinstance(client, AsyncOpenAI):
+            client = KeyPool([client])
+        self._clients = client or api_key_pool(api_key).map(
+            lambda key: AsyncOpenAI(api_key=key)
+        )
         self._model = model
+        self._local_tier = local_tier
+        self._cascade = cascade
+        self._max_description_tokens = max_description_tokens
+        self._cache = cache
+        self._cache_ttl = cache_ttl
+        self._single_flight = SingleFlight()
+        self.cascade_stats = CascadeStats()
+        self.usage = TokenUsage()
 
     async def _call_openai_api(
         self,
@@ -29,21 +130,195 @@ class Processor:
         **kwargs,
     ) -> str:
         """Calls the OpenAI API with the given user prompt."""
-        response = await self._client.chat.completions.create(
-            model=self._model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-            **kwargs,
-        )
+        async with self._clients.acquire() as client:
+            response = await client.chat.completions.create(
+                model=self._model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt},
+                ],
+                **kwargs,
+            )
+        if response.usage is not None:
+            self.usage.add(
+                prompt_tokens=response.usage.prompt_tokens,
+                completion_tokens=response.usage.completion_tokens,
+            )
         content = response.choices[0].message.content
         if not content:
             raise ValueError("Empty response from OpenAI API")
         return content
 
+    async def _call_openai_api_with_confidence(
+        self,
+        model: str,
+        system_prompt: str,
+        user_prompt: str,
+        **kwargs,
+    ) -> Tuple[str, float, Tuple[int, int]]:
+        """Calls the OpenAI API with logprobs and returns the content, the probability of its first token and the token usage (prompt, completion)."""
+        async with self._clients.acquire() as client:
+            response = await client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt},
+                ],
+                logprobs=True,
+                **kwargs,
+            )
+        choice = response.choices[0]
+        content = choice.message.content
+        if not content or choice.logprobs is None or not choice.logprobs.content:
+            raise ValueError("Empty response from OpenAI API")
+        probability = math.exp(choice.logprobs.content[0].logprob)
+        usage = response.usage
+        tokens = (usage.prompt_tokens, usage.completion_tokens) if usage else (0, 0)
+        if usage is not None:
+            self.usage.add(prompt_tokens=tokens[0], completion_tokens=tokens[1])
+        return content, probability, tokens
+
+    @staticmethod
+    def _logit_bias(allowed_classes: List[int]) -> Dict[str, int] | None:
+        """Restricts the output to the digit tokens of the allowed classes (None if a class is not a single digit)."""
+        if not all(0 <= cls <= 9 for cls in allowed_classes):
+            return None
+        return {str(OPENAI_DIGIT_TOKEN_OFFSET + cls): 100 for cls in allowed_classes}
+
+    @staticmethod
+    def _cost(model: str, tokens: Tuple[int, int]) -> float:
+        """Computes the cost (in USD) of a call from its token usage (0 for unknown models)."""
+        input_price, output_price = OPENAI_PRICES_PER_1M_TOKENS.get(model, (0.0, 0.0))
+        return (tokens[0] * input_price + tokens[1] * output_price) / 1e6
+
+    async def _classify_cheap(
+        self, cascade: Cascade, prompt: Prompt, user_prompt: str
+    ) -> int | None:
+        """Classifies with the cheap model of the cascade; returns None if the answer is to be escalated."""
+        logit_bias = self._logit_bias(prompt.allowed_classes)
+        if logit_bias is None:
+            return None
+
+        stats = self.cascade_stats
+        start = time.monotonic()
+        try:
+            content, probability, tokens = await self._call_openai_api_with_confidence(
+                model=cascade.model,
+                system_prompt=prompt.system_prompt,
+                user_prompt=user_prompt,
+                max_tokens=1,
+                logit_bias=logit_bias,
+            )
+            classification = int(content.strip())
+        except Exception as e:
+            logger.warning(f"Cheap classification with {cascade.model} failed: {e}")
+            stats.n_cheap += 1
+            stats.n_escalated += 1
+            stats.cheap_latency += time.monotonic() - start
+            return None
+
+        stats.n_cheap += 1
+        stats.cheap_latency += time.monotonic() - start
+        stats.cheap_cost += self._cost(model=cascade.model, tokens=tokens)
+        if (
+            probability < cascade.threshold
+            or classification not in prompt.allowed_classes
+        ):
+            stats.n_escalated += 1
+            return None
+        stats.main_cost_avoided += self._cost(model=self._model, tokens=tokens)
+        return classification
+
+    @staticmethod
+    def order_prompts(prompts: List[Prompt]) -> List[List[Prompt]]:
+        """Orders the prompts by their dependencies into levels; the prompts of a level only depend on earlier levels.
+
+        Raises a ValueError for unknown dependencies and cyclic dependencies.
+
+        Args:
+            prompts: The list of prompts.
+        """
+        deps = {p.name: set(p.depends_on) | set(p.run_if) for p in prompts}
+        unknown = {d for dps in deps.values() for d in dps} - set(deps)
+        if unknown:
+            raise ValueError(f"Prompts depend on unknown prompts {sorted(unknown)}")
+
+        levels: List[List[Prompt]] = []
+        done: Set[str] = set()
+        remaining = list(prompts)
+        while remaining:
+            level = [p for p in remaining if deps[p.name] <= done]
+            if not level:
+                names = [p.name for p in remaining]
+                raise ValueError(f"Cyclic dependencies between the prompts {names}")
+            levels.append(level)
+            done |= {p.name for p in level}
+            remaining = [p for p in remaining if p.name not in done]
+        return levels
+
+    @staticmethod
+    def run_if_met(prompt: Prompt, classifications: Dict[str, int]) -> bool:
+        """Checks whether the gating condition `run_if` of a prompt is met by the classifications of its dependencies."""
+        return all(
+            classifications.get(dep) in cls for dep, cls in prompt.run_if.items()
+        )
+
+    async def classify_all(
+        self,
+        prompts: List[Prompt] | List[List[Prompt]],
+        url: str,
+        name: str | None,
+        description: str | None,
+        failed: Set[str] | None = None,
+    ) -> Dict[str, int]:
+        """Classifies a product with all prompts, evaluated as a graph of dependencies (c.f. func:`order_prompts`).
+
+        The prompts of one level run concurrently. A prompt whose gating condition `run_if` is not met
+        (including gates on skipped prompts) is not run and recorded as `PROCESSOR_SKIPPED`.
+
+        Args:
+            prompts: The list of prompts (or their levels as returned by func:`order_prompts`).
+            url: Product URL.
+            name: Product name.
+            description: Product description.
+            failed: Collects the names of the prompts whose classification failed (c.f. func:`classify`) (optional).
+        """
+        levels = (
+            cast(List[List[Prompt]], prompts)
+            if prompts and isinstance(prompts[0], list)
+            else self.order_prompts(cast(List[Prompt], prompts))
+        )
+        classifications: Dict[str, int] = {}
+        for level in levels:
+            to_run = []
+            for prompt in level:
+                if self.run_if_met(prompt=prompt, classifications=classifications):
+                    to_run.append(prompt)
+                else:
+                    logger.debug(f'Skipping prompt "{prompt.name}" for "{name}"')
+                    classifications[prompt.name] = PROCESSOR_SKIPPED
+            results = await asyncio.gather(
+                *[
+                    self.classify(
+                        prompt=prompt,
+                        url=url,
+                        name=name,
+                        description=description,
+                        failed=failed,
+                    )
+                    for prompt in to_run
+                ]
+            )
+            classifications.update({p.name: r for p, r in zip(to_run, results)})
+        return classifications
+
     async def classify(
-        self, prompt: Prompt, url: str, name: str | None, description: str | None
+        self,
+        prompt: Prompt,
+        url: str,
+        name: str | None,
+        description: str | None,
+        failed: Set[str] | None = None,
     ) -> int:
         """A generic classification method that classified a product based on a prompt object.
 
@@ -52,12 +327,19 @@ class Processor:
             url: Product URL (often used in the user_prompt).
             name: Product name (often used in the user_prompt).
             description: Product description (often used in the user_prompt).
+            failed: Collects the name of the prompt if the API call failed or its response isn't in allowed_classes (optional).
 
         Note:
             This method returns `prompt.default_if_missing` if:
                 - 'name' or 'description' is None
                 - an error occurs during the API call
                 - if the response isn't in allowed_classes.
+
+            Concurrent classifications of the same product with the same prompt share one API call.
+            With a local tier, its confident predictions are returned without calling the API; with a
+            cascade, the confident answers of the cheap model are returned without calling the main model.
+            With a cache, the classifications of unchanged products (same model, prompt, url, name and
+            description) are reused.
         """
         # If required fields are missing, return the prompt's default fallback if provided.
         if name is None or description is None:
@@ -66,32 +348,262 @@ class Processor:
             )
             return prompt.default_if_missing
 
-        # Substitute placeholders in user_prompt with the relevant arguments
-        user_prompt = PROCESSOR_USER_PROMPT_TEMPLATE.format(
+        classification = self.classify_offline(
+            prompt=prompt, url=url, name=name, description=description
+        )
+        if classification is not None:
+            return classification
+
+        dump = json.dumps([self._model, prompt.model_dump(), url, name, description])
+        key = hashlib.sha256(dump.encode("utf-8")).hexdigest()
+        classification = await self._single_flight.do(
+            key=key,
+            func=lambda: self._classify(
+                prompt=prompt, url=url, name=name, description=description
+            ),
+        )
+        if classification not in prompt.allowed_classes:
+            if failed is not None:
+                failed.add(prompt.name)
+            return prompt.default_if_missing
+
+        # Only cache valid classifications (not the fallbacks of failed calls)
+        self.cache_classification(
+            prompt=prompt,
+            url=url,
+            name=name,
+            description=description,
+            classification=classification,
+        )
+        return classification
+
+    def _cache_key(self, prompt: Prompt, url: str, name: str, description: str) -> str:
+        """Returns the key of a classification in the cache (same model, prompt, url, name and description)."""
+        return Cache.make_key(
+            namespace=self._cache_namespace,
+            model=self._model,
+            prompt=prompt.model_dump(),
+            url=url,
+            name=name,
+            description=description,
+        )
+
+    def classify_offline(
+        self, prompt: Prompt, url: str, name: str, description: str
+    ) -> int | None:
+        """Classifies a product without calling OpenAI, i.e. with the local tier or the cache; None if neither applies.
+
+        Args:
+            prompt: The prompt.
+            url: Product URL.
+            name: Product name.
+            description: Product description.
+        """
+        if self._local_tier is not None and self._local_tier.has_classifier(
+            prompt.name
+        ):
+            classification = self._local_tier.classify(
+                prompt_name=prompt.name, url=url, name=name, description=description
+            )
+            if classification in prompt.allowed_classes:
+                logger.debug(
+                    f'Local classification for "{name}" (prompt={prompt.name}): {classification}'
+                )
+                self.usage.n_local += 1
+                return classification
+            self.usage.n_local_escalated += 1
+
+        if self._cache is not None:
+            entry = self._cache.get(
+                self._cache_key(
+                    prompt=prompt, url=url, name=name, description=description
+                )
+            )
+            if entry is not None and entry.age() < self._cache_ttl:
+                logger.debug(
+                    f'Cached classification for "{name}" (prompt={prompt.name})'
+                )
+                return entry.value
+        return None
+
+    def cache_classification(
+        self, prompt: Prompt, url: str, name: str, description: str, classification: int
+    ) -> None:
+        """Stores a (valid) classification in the cache, if any (c.f. func:`classify_offline`).
+
+        Args:
+            prompt: The prompt.
+            url: Product URL.
+            name: Product name.
+            description: Product description.
+            classification: The classification.
+        """
+        if self._cache is not None:
+            self._cache.set(
+                self._cache_key(
+                    prompt=prompt, url=url, name=name, description=description
+                ),
+                classification,
+            )
+
+    def _prepare_description(self, prompt: Prompt, name: str, description: str) -> str:
+        """Cleans the description and compresses it to the token budget of the prompt (c.f. func:`compress_text`)."""
+        description = clean_text(description)
+        max_tokens = prompt.max_description_tokens or self._max_description_tokens
+        if max_tokens is None:
+            return description
+        n_tokens = count_tokens(description, model=self._model)
+        if n_tokens <= max_tokens:
+            return description
+        compressed = compress_text(
+            description, max_tokens=max_tokens, model=self._model, query=name
+        )
+        self.usage.n_compressed += 1
+        self.usage.tokens_removed += n_tokens - count_tokens(
+            compressed, model=self._model
+        )
+        return compressed
+
+    def _user_prompt(
+        self, prompt: Prompt, url: str, name: str, description: str
+    ) -> str:
+        """Substitutes the placeholders in the user prompt template with the product (and prepared description)."""
+        description = self._prepare_description(
+            prompt=prompt, name=name, description=description
+        )
+        return PROCESSOR_USER_PROMPT_TEMPLATE.format(
             context=prompt.context,
             url=url,
             name=name,
             description=description,
         )
 
+    def batch_request(
+        self,
+        custom_id: str,
+        prompt: Prompt,
+        url: str,
+        name: str | None,
+        description: str | None,
+    ) -> dict | None:
+        """Creates the request of a classification for the OpenAI Batch API (one line of the batch file).
+
+        Returns None if `name` or `description` is missing (c.f. func:`classify`).
+
+        Args:
+            custom_id: The ID of the request (to match the response).
+            prompt: The prompt.
+            url: Product URL.
+            name: Product name.
+            description: Product description.
+        """
+        if name is None or description is None:
+            return None
+        user_prompt = self._user_prompt(
+            prompt=prompt, url=url, name=name, description=description
+        )
+        return {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": self._model,
+                "messages": [
+                    {"role": "system", "content": prompt.system_prompt},
+                    {"role": "user", "content": user_prompt},
+                ],
+                "max_tokens": 1,
+            },
+        }
+
+    def parse_batch_response(
+        self, prompt: Prompt, response: dict | None, failed: Set[str] | None = None
+    ) -> int:
+        """Parses the classification from a response of the OpenAI Batch API (one line of the output file).
+
+        Returns `prompt.default_if_missing` for missing or failed responses and classifications not in the allowed classes.
+
+        Args:
+            prompt: The prompt of the request.
+            response: The response line (None if missing).
+            failed: Collects the name of the prompt if the fallback `default_if_missing` is returned (optional).
+        """
+        classification = self._parse_batch_response(prompt=prompt, response=response)
+        if classification is None:
+            if failed is not None:
+                failed.add(prompt.name)
+            return prompt.default_if_missing
+        return classification
+
+    def _parse_batch_response(
+        self, prompt: Prompt, response: dict | None
+    ) -> int | None:
+        """Parses a response of the OpenAI Batch API (c.f. func:`parse_batch_response`); None if it failed."""
+        if response is None or response.get("error"):
+            error = response.get("error") if response else "missing response"
+            logger.error(
+                f'Batch classification with prompt "{prompt.name}" failed: {error}'
+            )
+            return None
+        try:
+            body = response["response"]["body"]
+            usage = body.get("usage")
+            if usage:
+                self.usage.add(
+                    prompt_tokens=usage["prompt_tokens"],
+                    completion_tokens=usage["completion_tokens"],
+                )
+            classification = int(body["choices"][0]["message"]["content"].strip())
+        except Exception as e:
+            logger.error(
+                f'Error parsing batch response for prompt "{prompt.name}": {e}'
+            )
+            return None
+        if classification not in prompt.allowed_classes:
+            logger.warning(
+                f"Classification '{classification}' not in allowed classes {prompt.allowed_classes}"
+            )
+            return None
+        return classification
+
+    async def _classify(
+        self, prompt: Prompt, url: str, name: str, description: str
+    ) -> int | None:
+        """Classifies a product by calling the OpenAI API (c.f. func:`classify`); None if the call failed."""
+        user_prompt = self._user_prompt(
+            prompt=prompt, url=url, name=name, description=description
+        )
+
         # Call the OpenAI API
         try:
             logger.debug(
                 f'Calling OpenAI API for classification (name="{name}", prompt="{prompt.name}")'
             )
-            content = await self._call_openai_api(
-                system_prompt=prompt.system_prompt,
-                user_prompt=user_prompt,
-                max_tokens=1,
-            )
-            classification = int(content.strip())
+            cheap = None
+            if self._cascade is not None:
+                cheap = await self._classify_cheap(
+                    cascade=self._cascade, prompt=prompt, user_prompt=user_prompt
+                )
+            if cheap is not None:
+                classification = cheap
+            else:
+                start = time.monotonic()
+                content = await self._call_openai_api(
+                    system_prompt=prompt.system_prompt,
+                    user_prompt=user_prompt,
+                    max_tokens=1,
+                )
+                if self._cascade is not None:
+                    self.cascade_stats.n_main += 1
+                    self.cascade_stats.main_latency += time.monotonic() - start
+                classification = int(content.strip())
 
             # Enforce that the classification is in the allowed classes
             if classification not in prompt.allowed_classes:
                 logger.warning(
                     f"Classification '{classification}' not in allowed classes {prompt.allowed_classes}"
                 )
-                return prompt.default_if_missing
+                return None
 
             logger.info(
                 f'Classification for "{name}" (prompt={prompt.name}): {classification}'
@@ -102,4 +614,4 @@ class Processor:
             logger.error(
                 f'Error classifying product "{name}" with prompt "{prompt.name}": {e}'
             )
-            return prompt.default_if_missing
+            return None
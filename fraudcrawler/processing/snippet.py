@@ -0,0 +1,95 @@
+from abc import ABC, abstractmethod
+import logging
+from typing import List
+
+from fraudcrawler.settings import SNIPPET_FILTER_DEFAULT_MODEL
+from fraudcrawler.base.base import Prompt
+from fraudcrawler.processing.processor import Processor
+from fraudcrawler.scraping.terms import normalize_term
+
+logger = logging.getLogger(__name__)
+
+
+class SnippetFilter(ABC):
+    """Abstract base class for the pre-classification of search results by their title and snippet.
+
+    Abstract methods:
+        keep: Decides whether a search result is passed on to Zyte.
+
+    A snippet filter runs before the (paid) page extraction and must only drop the clearly irrelevant
+    results; results without title and snippet are always kept.
+    """
+
+    @abstractmethod
+    async def keep(self, url: str, title: str | None, snippet: str | None) -> bool:
+        """Decides whether a search result is kept.
+
+        Args:
+            url: The URL of the search result.
+            title: The title of the search result.
+            snippet: The snippet of the search result.
+        """
+        pass
+
+
+class KeywordSnippetFilter(SnippetFilter):
+    """Rule based snippet filter on (normalized) keywords.
+
+    A search result is dropped if its title or snippet contains any of the `exclude` keywords or,
+    if `require` is given, none of the `require` keywords.
+    """
+
+    def __init__(
+        self, exclude: List[str] | None = None, require: List[str] | None = None
+    ):
+        """Initializes the filter.
+
+        Args:
+            exclude: The keywords marking irrelevant search results (e.g. "beipackzettel", "forum").
+            require: The keywords of which at least one must be present (optional).
+        """
+        self._exclude = [normalize_term(kw) for kw in exclude or []]
+        self._require = [normalize_term(kw) for kw in require or []]
+
+    @staticmethod
+    def _contains(text: str, keyword: str) -> bool:
+        return f" {keyword} " in f" {text} "
+
+    async def keep(self, url: str, title: str | None, snippet: str | None) -> bool:
+        if not title and not snippet:
+            return True
+        text = normalize_term(f"{title or ''} {snippet or ''}")
+        if any(self._contains(text, kw) for kw in self._exclude):
+            return False
+        if self._require and not any(self._contains(text, kw) for kw in self._require):
+            return False
+        return True
+
+
+class LLMSnippetFilter(SnippetFilter):
+    """Snippet filter classifying the title and snippet with a cheap OpenAI model.
+
+    A search result is only dropped if the `prompt` classifies it as 0; missing or failed
+    classifications (c.f. attribute:`Prompt.default_if_missing`) keep the result.
+    """
+
+    def __init__(
+        self, api_key: str, prompt: Prompt, model: str = SNIPPET_FILTER_DEFAULT_MODEL
+    ):
+        """Initializes the filter.
+
+        Args:
+            api_key: The OpenAI API key.
+            prompt: The prompt for classifying the title (as name) and the snippet (as description).
+            model: The OpenAI model to use (optional).
+        """
+        self._processor = Processor(api_key=api_key, model=model)
+        self._prompt = prompt
+
+    async def keep(self, url: str, title: str | None, snippet: str | None) -> bool:
+        if not title and not snippet:
+            return True
+        classification = await self._processor.classify(
+            prompt=self._prompt, url=url, name=title or "", description=snippet or ""
+        )
+        return classification != 0
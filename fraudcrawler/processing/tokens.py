@@ -0,0 +1,149 @@
+import html
+import logging
+import math
+from pydantic import BaseModel
+import re
+from typing import Any, Dict, List, Set
+
+from fraudcrawler.settings import TOKENS_APPROX_CHARS_PER_TOKEN
+from fraudcrawler.scraping.terms import normalize_term
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - tiktoken is optional
+    tiktoken = None  # type: ignore[assignment]
+
+logger = logging.getLogger(__name__)
+
+_TAG_PATTERN = re.compile(
+    r"<(script|style)\b.*?</\1>|<[^>]+>", re.IGNORECASE | re.DOTALL
+)
+_WHITESPACE_PATTERN = re.compile(r"[ \t\r\f\v]+")
+_NEWLINES_PATTERN = re.compile(r"\s*\n\s*")
+_SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+|\n+")
+
+_encodings: Dict[str, Any] = {}
+
+
+def _get_encoding(model: str) -> Any:
+    """Returns the tiktoken encoding of a model (None if tiktoken is not installed or its encoding cannot be loaded)."""
+    if tiktoken is None:
+        return None
+    if model not in _encodings:
+        try:
+            try:
+                _encodings[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _encodings[model] = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            # tiktoken downloads the encodings on first use, which fails e.g. without internet access
+            logger.warning(
+                f"Could not load the tiktoken encoding of model={model} ({e}); tokens are approximated"
+            )
+            _encodings[model] = None
+    return _encodings[model]
+
+
+def count_tokens(text: str, model: str) -> int:
+    """Counts the tokens of a text with the tokenizer of the model.
+
+    Without tiktoken installed, the number of tokens is approximated by the number of characters.
+
+    Args:
+        text: The text.
+        model: The OpenAI model.
+    """
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return math.ceil(len(text) / TOKENS_APPROX_CHARS_PER_TOKEN)
+    return len(encoding.encode(text))
+
+
+def truncate_tokens(text: str, max_tokens: int, model: str) -> str:
+    """Cuts a text after `max_tokens` tokens (c.f. func:`count_tokens`)."""
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return text[: max_tokens * TOKENS_APPROX_CHARS_PER_TOKEN]
+    return encoding.decode(encoding.encode(text)[:max_tokens])
+
+
+def clean_text(text: str) -> str:
+    """Removes the HTML markup (tags, scripts, entities) and whitespace noise from a text.
+
+    Duplicate lines (e.g. repeated navigation or legal boilerplate) are only kept once.
+
+    Args:
+        text: The text to clean.
+    """
+    text = html.unescape(_TAG_PATTERN.sub("\n", text))
+    text = _WHITESPACE_PATTERN.sub(" ", text)
+    lines = _NEWLINES_PATTERN.split(text)
+    return "\n".join(dict.fromkeys(ln.strip() for ln in lines if ln.strip()))
+
+
+def compress_text(
+    text: str, max_tokens: int, model: str, query: str | None = None
+) -> str:
+    """Extractively compresses a text to at most `max_tokens` tokens by keeping its most informative sentences.
+
+    The sentences are scored by the sum of the inverse sentence frequencies of their words (rare
+    words are informative, boilerplate repeated across sentences is not), with a bonus for the words
+    of `query` (e.g. the product name) and for the leading sentences. The best sentences are kept in
+    their original order; a single sentence exceeding the budget is cut.
+
+    Args:
+        text: The (cleaned) text.
+        max_tokens: The token budget.
+        model: The OpenAI model (for counting the tokens).
+        query: The text whose words are preferred (optional).
+    """
+    if count_tokens(text, model=model) <= max_tokens:
+        return text
+
+    sentences = [s.strip() for s in _SENTENCE_PATTERN.split(text) if s.strip()]
+    words = [set(normalize_term(s).split()) for s in sentences]
+    doc_freq: Dict[str, int] = {}
+    for wrds in words:
+        for w in wrds:
+            doc_freq[w] = doc_freq.get(w, 0) + 1
+    query_words: Set[str] = set(normalize_term(query).split()) if query else set()
+    n = len(sentences)
+
+    def score(i: int) -> float:
+        idf = sum(math.log(1 + n / doc_freq[w]) for w in words[i])
+        bonus = 2.0 * len(words[i] & query_words) + 1.0 / (1 + i)
+        return (idf + bonus) / math.sqrt(1 + len(words[i]))
+
+    selected: List[int] = []
+    n_tokens = 0
+    for i in sorted(range(n), key=score, reverse=True):
+        n_sent = count_tokens(sentences[i], model=model) + 1
+        if n_tokens + n_sent <= max_tokens:
+            selected.append(i)
+            n_tokens += n_sent
+    if not selected:
+        return truncate_tokens(sentences[0], max_tokens=max_tokens, model=model)
+    return " ".join(sentences[i] for i in sorted(selected))
+
+
+class TokenUsage(BaseModel):
+    """Model for the token usage of the OpenAI calls (and the calls and tokens saved by the local tier and the compression)."""
+
+    n_calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    n_compressed: int = 0
+    tokens_removed: int = 0
+    n_local: int = 0
+    n_local_escalated: int = 0
+
+    def add(self, prompt_tokens: int, completion_tokens: int) -> None:
+        """Adds the usage of an OpenAI call."""
+        self.n_calls += 1
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+
+    def merge(self, other: "TokenUsage") -> None:
+        """Adds the usage of another run (e.g. of a shard)."""
+        for field in type(self).model_fields:
+            setattr(self, field, getattr(self, field) + getattr(other, field))
@@ -0,0 +1,39 @@
+import argparse
+import logging
+
+from fraudcrawler import CrawlerService, DiskCache
+from fraudcrawler.settings import (
+    SERVICE_DEFAULT_HOST,
+    SERVICE_DEFAULT_MAX_JOBS,
+    SERVICE_DEFAULT_PORT,
+)
+
+LOG_FMT = "%(asctime)s | %(name)s | %(funcName)s | %(levelname)s | %(message)s"
+LOG_LVL = "INFO"
+DATE_FMT = "%Y-%m-%d %H:%M:%S"
+logging.basicConfig(format=LOG_FMT, level=LOG_LVL, datefmt=DATE_FMT)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the crawler service accepting search jobs over a local HTTP API."
+    )
+    parser.add_argument("--host", default=SERVICE_DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_DEFAULT_PORT)
+    parser.add_argument(
+        "--path", default=None, help="Unix socket to listen on (instead of host/port)"
+    )
+    parser.add_argument("--max-jobs", type=int, default=SERVICE_DEFAULT_MAX_JOBS)
+    parser.add_argument(
+        "--cache", action="store_true", help="Cache the responses on disk"
+    )
+    args = parser.parse_args()
+
+    service = CrawlerService(
+        cache=DiskCache() if args.cache else None, max_jobs=args.max_jobs
+    )
+    service.serve(host=args.host, port=args.port, path=args.path)
+
+
+if __name__ == "__main__":
+    main()
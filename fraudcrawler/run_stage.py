@@ -0,0 +1,83 @@
+import argparse
+import asyncio
+import json
+import logging
+
+from fraudcrawler import (
+    Deepness,
+    Enrichment,
+    FraudCrawlerClient,
+    Language,
+    Location,
+    Prompt,
+)
+
+LOG_FMT = "%(asctime)s | %(name)s | %(funcName)s | %(levelname)s | %(message)s"
+LOG_LVL = "INFO"
+DATE_FMT = "%Y-%m-%d %H:%M:%S"
+logging.basicConfig(format=LOG_FMT, level=LOG_LVL, datefmt=DATE_FMT)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run a single pipeline stage from an input to an output manifest (JSONL or Parquet)."
+    )
+    stages = parser.add_subparsers(dest="stage", required=True)
+
+    search = stages.add_parser(
+        "search", help="SERP (and enrichment) with URL collection"
+    )
+    search.add_argument("--search-term", required=True)
+    search.add_argument("--language", default="German")
+    search.add_argument("--location", default="Switzerland")
+    search.add_argument("--num-results", type=int, default=10)
+    search.add_argument("--additional-terms", type=int, default=0)
+    search.add_argument("--additional-urls-per-term", type=int, default=0)
+    search.add_argument("--output", required=True)
+
+    zyte = stages.add_parser("zyte", help="Product details from Zyte")
+    zyte.add_argument("--input", required=True)
+    zyte.add_argument("--output", required=True)
+
+    proc = stages.add_parser("proc", help="Classification of the products")
+    proc.add_argument("--input", required=True)
+    proc.add_argument("--output", required=True)
+    proc.add_argument(
+        "--prompts", required=True, help="JSON file with a list of prompts"
+    )
+
+    collect = stages.add_parser("collect", help="Save the products as results (csv)")
+    collect.add_argument("--input", required=True)
+    args = parser.parse_args()
+
+    client = FraudCrawlerClient()
+    if args.stage == "search":
+        deepness = Deepness(num_results=args.num_results)
+        if args.additional_terms:
+            deepness.enrichment = Enrichment(
+                additional_terms=args.additional_terms,
+                additional_urls_per_term=args.additional_urls_per_term,
+            )
+        asyncio.run(
+            client.search_stage(
+                output=args.output,
+                search_term=args.search_term,
+                language=Language(name=args.language),
+                location=Location(name=args.location),
+                deepness=deepness,
+            )
+        )
+    elif args.stage == "zyte":
+        asyncio.run(client.zyte_stage(input=args.input, output=args.output))
+    elif args.stage == "proc":
+        with open(args.prompts, "r") as file:
+            prompts = [Prompt(**p) for p in json.load(file)]
+        asyncio.run(
+            client.proc_stage(input=args.input, output=args.output, prompts=prompts)
+        )
+    else:
+        client.collect_manifest(filename=args.input)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,21 @@
+import asyncio
 from base64 import b64encode
 from collections import defaultdict
+import heapq
 import logging
 from pydantic import BaseModel
-from typing import Dict, List, Iterator
-
-from fraudcrawler.settings import ENRICHMENT_DEFAULT_LIMIT
+from typing import Callable, Dict, List, Iterator
+
+from fraudcrawler.settings import (
+    ENRICHMENT_CACHE_TTL,
+    ENRICHMENT_DEFAULT_LIMIT,
+    ENRICHMENT_MAX_TASKS_PER_POST,
+    KEY_POOL_QUARANTINE_STATUS,
+)
 from fraudcrawler.base.base import Location, Language, AsyncClient
+from fraudcrawler.base.cache import Cache
+from fraudcrawler.base.keys import CredentialError, KeyPool, split_keys
+from fraudcrawler.scraping.terms import normalize_term
 
 
 logger = logging.getLogger(__name__)
@@ -28,18 +38,40 @@ class Enricher(AsyncClient):
     _suggestions_endpoint = "/v3/dataforseo_labs/google/keyword_suggestions/live"
     _keywords_endpoint = "/v3/dataforseo_labs/google/related_keywords/live"
 
-    def __init__(self, user: str, pwd: str):
+    def __init__(
+        self,
+        user: str | List[str],
+        pwd: str | List[str],
+        cache: Cache | None = None,
+        cache_ttl: float = ENRICHMENT_CACHE_TTL,
+    ):
         """Initializes the DataForSeoApiClient with the given username and password.
 
         Args:
-            user: The username for DataForSEO API.
-            pwd: The password for DataForSEO API.
+            user: The username for DataForSEO API, or the usernames of several accounts (a list or comma separated) used in turn.
+            pwd: The password for DataForSEO API, or the passwords of the accounts (in the same order).
+            cache: The cache for the DataForSEO responses (optional).
+            cache_ttl: Time (in seconds) a cached response is used (optional).
         """
-        self._user = user
-        self._pwd = pwd
+        super().__init__()
+        users, pwds = split_keys(user), split_keys(pwd)
+        if len(users) != len(pwds):
+            raise ValueError(
+                f"Got {len(users)} DataForSEO users but {len(pwds)} passwords"
+            )
+        self._accounts = KeyPool(
+            [self._auth_headers(u, p) for u, p in zip(users, pwds)]
+        )
+        self._cache = cache
+        self._cache_ttl = cache_ttl
+        self._n_calls = 0
+
+    @classmethod
+    def _auth_headers(cls, user: str, pwd: str) -> Dict[str, str]:
+        """Returns the request headers of a DataForSEO account."""
         auth = f"{user}:{pwd}"
-        auth = b64encode(auth.encode(self._auth_encoding)).decode(self._auth_encoding)
-        self._headers = {
+        auth = b64encode(auth.encode(cls._auth_encoding)).decode(cls._auth_encoding)
+        return {
             "Authorization": f"Basic {auth}",
             "Content-Encoding": "gzip",
         }
@@ -60,6 +92,83 @@ class Enricher(AsyncClient):
                 items = result.get("items") or []
                 yield from items
 
+    @staticmethod
+    def _align_tasks(requested: List[dict], received: List[dict]) -> List[dict]:
+        """Aligns the tasks of a DataForSEO response with the requested tasks.
+
+        DataForSEO echoes the data of each task in the field `data`; the tasks are matched by their
+        keyword and, if that is not possible, by their position. Missing tasks are returned as `{}`.
+
+        Args:
+            requested: The task data as sent to DataForSEO.
+            received: The tasks as returned by DataForSEO.
+        """
+        by_keyword: Dict[str, dict] = {}
+        for task in received:
+            keyword = (task.get("data") or {}).get("keyword")
+            if keyword is not None:
+                by_keyword.setdefault(keyword, task)
+        if all(req["keyword"] in by_keyword for req in requested):
+            return [by_keyword[req["keyword"]] for req in requested]
+        logger.debug(
+            "Could not match DataForSEO tasks by keyword; matching by position."
+        )
+        return [received[i] if i < len(received) else {} for i in range(len(requested))]
+
+    async def _post_chunk(self, url: str, data: List[dict]) -> dict:
+        """Posts a chunk of tasks with the next account (c.f. class:`KeyPool`).
+
+        DataForSEO reports auth and quota errors in the response body, with status codes extending the
+        HTTP status by two digits (e.g. 40200 for an exhausted balance); they are raised such that the
+        account is quarantined.
+        """
+        async with self._accounts.acquire() as headers:
+            resp = await self.post(url=url, headers=headers, data=data)
+            status = resp.get("status_code") or 20000
+            if status // 100 in KEY_POOL_QUARANTINE_STATUS:
+                raise CredentialError(
+                    f"DataForSEO error {status}: {resp.get('status_message')}",
+                    status=status // 100,
+                )
+        return resp
+
+    async def _post_tasks(self, endpoint: str, tasks: List[dict]) -> List[dict]:
+        """Posts a list of tasks to a DataForSEO endpoint and returns the resulting tasks in the same order.
+
+        The tasks are packed into chunks of `ENRICHMENT_MAX_TASKS_PER_POST` which are posted concurrently.
+        The resulting task of a failed POST is returned as `{}`.
+
+        Args:
+            endpoint: The DataForSEO endpoint (without base).
+            tasks: The data of the tasks.
+        """
+        url = f"{self._base_endpoint}{endpoint}"
+        chunks = [
+            tasks[i : i + ENRICHMENT_MAX_TASKS_PER_POST]
+            for i in range(0, len(tasks), ENRICHMENT_MAX_TASKS_PER_POST)
+        ]
+        logger.debug(
+            f'DataForSEO url="{url}" with {len(tasks)} tasks in {len(chunks)} POST(s).'
+        )
+        self._n_calls += len(chunks)
+        responses = await asyncio.gather(
+            *[self._post_chunk(url=url, data=chk) for chk in chunks],
+            return_exceptions=True,
+        )
+
+        results: List[dict] = []
+        for chk, resp in zip(chunks, responses):
+            if isinstance(resp, BaseException):
+                logger.error(
+                    f'DataForSEO POST to url="{url}" failed with error: {resp}.'
+                )
+                results.extend({} for _ in chk)
+                continue
+            results.extend(
+                self._align_tasks(requested=chk, received=resp.get("tasks") or [])
+            )
+        return results
+
     @staticmethod
     def _parse_suggested_keyword(item: dict) -> Keyword:
         """Parses a keyword from an item in the DataForSEO suggested keyword search response.
@@ -126,7 +235,35 @@ class Enricher(AsyncClient):
             limit: The upper limit of suggestions to get.
         """
 
-        # Data must be a list of dictionaries setting a number of search tasks; here we only have one task.
+        logger.debug(
+            f'DataForSEO search for suggested keywords with search_term="{search_term}".'
+        )
+        batch = await self._get_suggested_keywords_batch(
+            search_terms=[search_term],
+            language=language,
+            location=location,
+            limit=limit,
+        )
+        keywords = batch[search_term]
+        logger.debug(f"Found {len(keywords)} suggestions from DataForSEO search.")
+        return keywords
+
+    async def _get_suggested_keywords_batch(
+        self,
+        search_terms: List[str],
+        language: Language,
+        location: Location,
+        limit: int = ENRICHMENT_DEFAULT_LIMIT,
+    ) -> Dict[str, List[Keyword]]:
+        """Get keyword suggestions for many search_terms with as few POSTs as possible.
+
+        Args:
+            search_terms: The search terms to use for the queries.
+            language: The language to use for the search.
+            location: The location to use for the search.
+            limit: The upper limit of suggestions to get per search_term.
+        """
+        # Data must be a list of dictionaries setting a number of search tasks; here we have one task per search_term.
         data = [
             {
                 "keyword": search_term,
@@ -136,27 +273,13 @@ class Enricher(AsyncClient):
                 "include_serp_info": True,
                 "include_seed_keyword": True,
             }
+            for search_term in search_terms
         ]
-        logger.debug(
-            f'DataForSEO search for suggested keywords with search_term="{search_term}".'
+        return await self._fetch_keywords(
+            endpoint=self._suggestions_endpoint,
+            data=data,
+            extract=self._extract_suggested_keywords,
         )
-        try:
-            url = f"{self._base_endpoint}{self._suggestions_endpoint}"
-            logger.debug(f'DataForSEO url="{url}" with data="{data}".')
-            sugg_data = await self.post(url=url, headers=self._headers, data=data)
-        except Exception as e:
-            logger.error(f"DataForSEO suggested search failed with error: {e}.")
-
-        # Extract the keywords from the response
-        try:
-            keywords = self._extract_suggested_keywords(data=sugg_data)
-        except Exception as e:
-            logger.error(
-                f"Failed to extract suggested keywords from DataForSEO response with error: {e}."
-            )
-
-        logger.debug(f"Found {len(keywords)} suggestions from DataForSEO search.")
-        return keywords
 
     @staticmethod
     def _parse_related_keyword(item: dict) -> Keyword:
@@ -226,7 +349,35 @@ class Enricher(AsyncClient):
             limit: The upper limit of suggestions to get.
         """
 
-        # Data must be a list of dictionaries setting a number of search tasks; here we only have one task.
+        logger.debug(
+            f'DataForSEO search for related keywords with search_term="{search_term}".'
+        )
+        batch = await self._get_related_keywords_batch(
+            search_terms=[search_term],
+            language=language,
+            location=location,
+            limit=limit,
+        )
+        keywords = batch[search_term]
+        logger.debug(f"Found {len(keywords)} related keywords from DataForSEO search.")
+        return keywords
+
+    async def _get_related_keywords_batch(
+        self,
+        search_terms: List[str],
+        language: Language,
+        location: Location,
+        limit: int = ENRICHMENT_DEFAULT_LIMIT,
+    ) -> Dict[str, List[Keyword]]:
+        """Get related keywords for many search_terms with as few POSTs as possible.
+
+        Args:
+            search_terms: The search terms to use for the queries.
+            language: The language to use for the search.
+            location: The location to use for the search.
+            limit: The upper limit of related keywords to get per search_term.
+        """
+        # Data must be a list of dictionaries setting a number of search tasks; here we have one task per search_term.
         data = [
             {
                 "keyword": search_term,
@@ -234,28 +385,107 @@ class Enricher(AsyncClient):
                 "location_name": location.name,
                 "limit": limit,
             }
+            for search_term in search_terms
         ]
-        logger.debug(
-            f'DataForSEO search for related keywords with search_term="{search_term}".'
+        return await self._fetch_keywords(
+            endpoint=self._keywords_endpoint,
+            data=data,
+            extract=self._extract_related_keywords,
         )
-        try:
-            url = f"{self._base_endpoint}{self._keywords_endpoint}"
-            logger.debug(f'DataForSEO url="{url}" with data="{data}".')
-            rel_data = await self.post(url=url, headers=self._headers, data=data)
-        except Exception as e:
-            logger.error(f"DataForSEO related keyword search failed with error: {e}.")
-
-        # Extract the keywords from the response
-        try:
-            keywords = self._extract_related_keywords(data=rel_data)
-        except Exception as e:
-            logger.error(
-                f"Failed to extract related keywords from DataForSEO response with error: {e}."
-            )
 
-        logger.debug(f"Found {len(keywords)} related keywords from DataForSEO search.")
+    async def _fetch_keywords(
+        self,
+        endpoint: str,
+        data: List[dict],
+        extract: Callable[[dict], List[Keyword]],
+    ) -> Dict[str, List[Keyword]]:
+        """Fetches the keywords for the given tasks; fresh cached responses are used instead of posting the tasks.
+
+        Args:
+            endpoint: The DataForSEO endpoint (without base).
+            data: The data of the tasks.
+            extract: The function extracting the keywords from a DataForSEO response.
+        """
+        keys = {
+            task["keyword"]: Cache.make_key(namespace=endpoint, **task) for task in data
+        }
+
+        # Get the keywords from the cache
+        keywords: Dict[str, List[Keyword]] = {}
+        missing = []
+        for task in data:
+            search_term = task["keyword"]
+            entry = self._cache.get(keys[search_term]) if self._cache else None
+            if entry is not None and entry.age() < self._cache_ttl:
+                keywords[search_term] = [Keyword(**kw) for kw in entry.value]
+            else:
+                missing.append(task)
+        if len(keywords):
+            logger.debug(f"Found {len(keywords)} DataForSEO tasks in the cache.")
+        if not missing:
+            return keywords
+
+        # Post the remaining tasks and cache the successful ones
+        search_terms = [task["keyword"] for task in missing]
+        tasks = await self._post_tasks(endpoint=endpoint, tasks=missing)
+        fetched = self._split_keywords(
+            search_terms=search_terms, tasks=tasks, extract=extract
+        )
+        if self._cache is not None:
+            for search_term, task in zip(search_terms, tasks):
+                if task.get("result") is not None:
+                    value = [kw.model_dump() for kw in fetched[search_term]]
+                    self._cache.set(keys[search_term], value)
+        keywords.update(fetched)
+        return keywords
+
+    @staticmethod
+    def _split_keywords(
+        search_terms: List[str],
+        tasks: List[dict],
+        extract: Callable[[dict], List[Keyword]],
+    ) -> Dict[str, List[Keyword]]:
+        """Splits the aligned tasks of a DataForSEO response back into keywords per search_term.
+
+        Args:
+            search_terms: The search terms in the order of the tasks.
+            tasks: The resulting tasks (aligned with the search_terms).
+            extract: The function extracting the keywords from a DataForSEO response.
+        """
+        keywords: Dict[str, List[Keyword]] = {}
+        for search_term, task in zip(search_terms, tasks):
+            try:
+                keywords[search_term] = extract({"tasks": [task]})
+            except Exception as e:
+                logger.error(
+                    f'Failed to extract keywords for search_term="{search_term}" from DataForSEO response with error: {e}.'
+                )
+                keywords[search_term] = []
         return keywords
 
+    @staticmethod
+    def _select_terms(
+        search_term: str, keywords: List[Keyword], n_terms: int
+    ) -> List[str]:
+        """Aggregates the keywords by volume and returns the top n_terms (excluding the search_term itself).
+
+        Args:
+            search_term: The search term the keywords were found for.
+            keywords: The suggested and related keywords.
+            n_terms: The number of additional terms.
+        """
+        # Remove original keyword and aggregate them by volume
+        keywords = [kw for kw in keywords if kw.text != search_term]
+        kw_vol: Dict[str, int] = defaultdict(int)
+        for kw in keywords:
+            kw_vol[kw.text] = max(kw.volume, kw_vol[kw.text])
+        keywords = [Keyword(text=k, volume=v) for k, v in kw_vol.items()]
+        logger.debug(f"Found {len(keywords)} additional unique keywords.")
+
+        # Sort the keywords by volume and get the top n_terms
+        keywords = sorted(keywords, key=lambda kw: kw.volume, reverse=True)
+        return [kw.text for kw in keywords[:n_terms]]
+
     async def apply(
         self,
         search_term: str,
@@ -275,29 +505,164 @@ class Enricher(AsyncClient):
         logger.info(
             f'Applying enrichment for search_term="{search_term}" and n_terms="{n_terms}".'
         )
-        suggested = await self._get_suggested_keywords(
-            search_term=search_term,
-            location=location,
-            language=language,
-            limit=n_terms,
+        suggested, related = await asyncio.gather(
+            self._get_suggested_keywords(
+                search_term=search_term,
+                location=location,
+                language=language,
+                limit=n_terms,
+            ),
+            self._get_related_keywords(
+                search_term=search_term,
+                location=location,
+                language=language,
+                limit=n_terms,
+            ),
         )
-        related = await self._get_related_keywords(
-            search_term=search_term,
-            location=location,
-            language=language,
-            limit=n_terms,
+        terms = self._select_terms(
+            search_term=search_term, keywords=suggested + related, n_terms=n_terms
         )
+        logger.info(f"Produced {len(terms)} additional search_terms.")
+        return terms
 
-        # Remove original keyword and aggregate them by volume
-        keywords = [kw for kw in suggested + related if kw.text != search_term]
-        kw_vol: Dict[str, int] = defaultdict(int)
-        for kw in keywords:
-            kw_vol[kw.text] = max(kw.volume, kw_vol[kw.text])
-        keywords = [Keyword(text=k, volume=v) for k, v in kw_vol.items()]
-        logger.debug(f"Found {len(keywords)} additional unique keywords.")
+    async def apply_batch(
+        self,
+        search_terms: List[str],
+        language: Language,
+        location: Location,
+        n_terms: int,
+    ) -> Dict[str, List[str]]:
+        """Applies the enrichment to many search_terms at once.
+
+        The search_terms are packed into multi-task POSTs (suggested and related keywords are
+        requested concurrently), such that the number of requests is independent of the number
+        of search_terms up to `ENRICHMENT_MAX_TASKS_PER_POST`.
+
+        Args:
+            search_terms: The search terms to use for the queries.
+            location: The location to use for the search.
+            language: The language to use for the search.
+            n_terms: The number of additional terms per search_term.
+        """
+        search_terms = list(dict.fromkeys(search_terms))
+        logger.info(
+            f'Applying enrichment for {len(search_terms)} search_terms and n_terms="{n_terms}".'
+        )
+        suggested, related = await asyncio.gather(
+            self._get_suggested_keywords_batch(
+                search_terms=search_terms,
+                location=location,
+                language=language,
+                limit=n_terms,
+            ),
+            self._get_related_keywords_batch(
+                search_terms=search_terms,
+                location=location,
+                language=language,
+                limit=n_terms,
+            ),
+        )
+        terms = {
+            st: self._select_terms(
+                search_term=st, keywords=suggested[st] + related[st], n_terms=n_terms
+            )
+            for st in search_terms
+        }
+        logger.info(
+            f"Produced {sum(len(t) for t in terms.values())} additional search_terms."
+        )
+        return terms
+
+    async def expand(
+        self,
+        search_term: str,
+        language: Language,
+        location: Location,
+        n_terms: int,
+        max_depth: int,
+        max_calls: int | None = None,
+    ) -> List[str]:
+        """Applies a multi-level enrichment to a search_term (e.g. expanding the suggestions of the suggestions).
+
+        The terms to expand are kept in a frontier ordered by their search volume; in every step the
+        best terms of the frontier (up to `ENRICHMENT_MAX_TASKS_PER_POST`) are expanded together with one
+        POST per endpoint. Terms are deduplicated by their normalized form (c.f. func:`normalize_term`),
+        such that spelling variants are neither expanded nor returned twice. Responses found in the cache
+        (if configured) do not count towards `max_calls`.
+
+        Args:
+            search_term: The search term to use for the query.
+            location: The location to use for the search.
+            language: The language to use for the search.
+            n_terms: The number of additional terms.
+            max_depth: The maximal number of expansion levels (`max_depth=1` expands the search_term only).
+            max_calls: The maximal number of DataForSEO requests (optional).
+        """
+        logger.info(
+            f'Applying enrichment for search_term="{search_term}", n_terms="{n_terms}" and max_depth="{max_depth}".'
+        )
+        n_calls_start = self._n_calls
+
+        # The best keyword (highest volume) found for every normalized term
+        seed = normalize_term(search_term)
+        found: Dict[str, Keyword] = {}
+
+        # The frontier contains (-volume, counter, depth, term); the counter keeps the order stable
+        frontier: List[tuple] = [(0, 0, 0, search_term)]
+        expanded = {seed}
+        counter = 1
+        while frontier:
+            n_calls = self._n_calls - n_calls_start
+            if max_calls is not None and n_calls + 2 > max_calls:
+                logger.debug(f"Enrichment budget of {max_calls} calls is exhausted.")
+                break
+
+            # Pop the best terms from the frontier
+            batch: List[tuple] = []
+            while frontier and len(batch) < ENRICHMENT_MAX_TASKS_PER_POST:
+                batch.append(heapq.heappop(frontier))
+            terms = [trm for _, _, _, trm in batch]
+            logger.debug(f"Expanding {len(terms)} terms from the enrichment frontier.")
+
+            # Get the keywords for all of them at once
+            suggested, related = await asyncio.gather(
+                self._get_suggested_keywords_batch(
+                    search_terms=terms,
+                    location=location,
+                    language=language,
+                    limit=n_terms,
+                ),
+                self._get_related_keywords_batch(
+                    search_terms=terms,
+                    location=location,
+                    language=language,
+                    limit=n_terms,
+                ),
+            )
+
+            # Collect the new keywords and push them onto the frontier
+            for _, _, depth, trm in batch:
+                for kw in suggested.get(trm, []) + related.get(trm, []):
+                    norm = normalize_term(kw.text)
+                    if not norm or norm == seed:
+                        continue
+                    if norm not in found or kw.volume > found[norm].volume:
+                        found[norm] = Keyword(
+                            text=found[norm].text if norm in found else kw.text,
+                            volume=kw.volume,
+                        )
+                    if depth + 1 < max_depth and norm not in expanded:
+                        expanded.add(norm)
+                        heapq.heappush(
+                            frontier, (-kw.volume, counter, depth + 1, kw.text)
+                        )
+                        counter += 1
 
         # Sort the keywords by volume and get the top n_terms
-        keywords = sorted(keywords, key=lambda kw: kw.volume, reverse=True)
+        keywords = sorted(found.values(), key=lambda kw: kw.volume, reverse=True)
         terms = [kw.text for kw in keywords[:n_terms]]
-        logger.info(f"Produced {len(terms)} additional search_terms.")
+        logger.info(
+            f"Produced {len(terms)} additional search_terms (from {len(found)} unique keywords) "
+            f"with {self._n_calls - n_calls_start} DataForSEO requests."
+        )
         return terms
@@ -1,22 +1,39 @@
 import asyncio
 import logging
-from pydantic import BaseModel
-from typing import List
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Set
 from urllib.parse import urlparse
 
-from fraudcrawler.settings import MAX_RETRIES, RETRY_DELAY
+from fraudcrawler.settings import (
+    MAX_RETRIES,
+    RETRY_DELAY,
+    SERP_CACHE_STALE_TTL,
+    SERP_CACHE_TTL,
+    SERP_MAX_QUERY_WORDS,
+)
 from fraudcrawler.base.base import Host, Language, Location, AsyncClient
+from fraudcrawler.base.cache import Cache
+from fraudcrawler.base.keys import KeyPool, api_key_pool
 import re
 
 logger = logging.getLogger(__name__)
 
 
 class SerpResult(BaseModel):
-    """Model for a single search result from SerpApi."""
+    """Model for a single search result from SerpApi.
+
+    Next to the url, the metadata of the organic result is kept (the `position` within its google
+    search, the `title`, the `snippet` and the detected rich snippet `extensions` such as price or rating).
+    """
 
     url: str
     domain: str
     marketplace_name: str
+    rank: int | None = None
+    position: int | None = None
+    title: str | None = None
+    snippet: str | None = None
+    extensions: Dict[str, Any] = Field(default_factory=dict)
     filtered: bool = False
     filtered_at_stage: str | None = None
 
@@ -28,24 +45,36 @@ class SerpApi(AsyncClient):
     _engine = "google"
     _default_marketplace_name = "Google"
     _hostname_pattern = r"^(?:https?:\/\/)?([^\/:?#]+)"
+    _cache_namespace = f"{_endpoint}#organic_results"
 
     def __init__(
         self,
-        api_key: str,
+        api_key: str | List[str] | KeyPool[str],
         max_retries: int = MAX_RETRIES,
         retry_delay: int = RETRY_DELAY,
+        cache: Cache | None = None,
+        cache_ttl: float = SERP_CACHE_TTL,
+        cache_stale_ttl: float = SERP_CACHE_STALE_TTL,
     ):
         """Initializes the SerpApiClient with the given API key.
 
         Args:
-            api_key: The API key for SerpApi.
+            api_key: The API key for SerpApi, or several keys (a list, comma separated or a class:`KeyPool`) used in turn.
             max_retries: Maximum number of retries for API calls.
             retry_delay: Delay between retries in seconds.
+            cache: The cache for the search results (optional).
+            cache_ttl: Time (in seconds) a cached result is fresh (optional).
+            cache_stale_ttl: Additional time (in seconds) a stale cached result is served while it is refreshed (optional).
         """
         super().__init__()
-        self._api_key = api_key
+        self._keys = api_key_pool(api_key)
         self._max_retries = max_retries
         self._retry_delay = retry_delay
+        self._cache = cache
+        self._cache_ttl = cache_ttl
+        self._cache_stale_ttl = cache_stale_ttl
+        self._refreshing: Set[str] = set()
+        self._refresh_tasks: Set[asyncio.Task] = set()
 
     def _get_domain(self, url: str) -> str:
         """Extracts the second-level domain together with the top-level domain (e.g. `google.com`).
@@ -73,20 +102,22 @@ class SerpApi(AsyncClient):
             hostname = hostname[4:]
         return hostname
 
-    async def _search(
+    async def _fetch(
         self,
         search_string: str,
         language: Language,
         location: Location,
         num_results: int,
-    ) -> List[str]:
-        """Performs a search using SerpApi and returns the URLs of the results.
+        start: int = 0,
+    ) -> List[dict]:
+        """Performs a search request to SerpApi and returns the organic results (c.f. func:`_parse_organic_result`).
 
         Args:
             search_string: The search string (with potentially added site: parameters).
             language: The language to use for the query ('hl' parameter).
             location: The location to use for the query ('gl' parameter).
             num_results: Max number of results to return.
+            start: The offset of the results (for fetching further result pages).
 
         The SerpAPI parameters are:
             engine: The search engine to use ('google' NOT 'google_shopping').
@@ -97,7 +128,7 @@ class SerpApi(AsyncClient):
             gl: The country code to use for the search.
             hl: The language code to use for the search.
             num: The number of results to return.
-            api_key: The API key to use for the search.
+            start: The offset of the results.
         """
         # Setup the parameters
         params = {
@@ -110,7 +141,7 @@ class SerpApi(AsyncClient):
             "gl": location.code,
             "hl": language.code,
             "num": num_results,
-            "api_key": self._api_key,
+            "start": start,
         }
 
         # Perform the request
@@ -121,7 +152,10 @@ class SerpApi(AsyncClient):
                 logger.debug(
                     f'Performing SerpAPI search with q="{search_string}" (Attempt {attempts + 1}).'
                 )
-                response = await self.get(url=self._endpoint, params=params)
+                async with self._keys.acquire() as api_key:
+                    response = await self.get(
+                        url=self._endpoint, params={**params, "api_key": api_key}
+                    )
                 break
             except Exception as e:
                 logger.error(f"SerpAPI search failed with error: {e}.")
@@ -140,12 +174,127 @@ class SerpApi(AsyncClient):
             )
             return []
 
-        # Extract urls
-        urls = [res.get("link") for res in results]
+        # Extract the urls together with their metadata
+        organic = [
+            self._parse_organic_result(res) for res in results if res.get("link")
+        ]
         logger.debug(
-            f'Found {len(urls)} URLs from SerpApi search for q="{search_string}".'
+            f'Found {len(organic)} URLs from SerpApi search for q="{search_string}".'
+        )
+        return organic
+
+    @staticmethod
+    def _parse_organic_result(result: dict) -> dict:
+        """Keeps the url and the metadata of an organic result of SerpApi.
+
+        The detected extensions of the rich snippet (e.g. `{"price": 29.9, "currency": "CHF"}`) are merged
+        into a flat dictionary.
+
+        Args:
+            result: The organic result as returned by SerpApi.
+        """
+        extensions: Dict[str, Any] = {}
+        rich_snippet = result.get("rich_snippet") or {}
+        for part in ("top", "bottom"):
+            detected = (rich_snippet.get(part) or {}).get("detected_extensions") or {}
+            extensions.update(detected)
+        return {
+            "link": result["link"],
+            "position": result.get("position"),
+            "title": result.get("title"),
+            "snippet": result.get("snippet"),
+            "extensions": extensions,
+        }
+
+    async def _search(
+        self,
+        search_string: str,
+        language: Language,
+        location: Location,
+        num_results: int,
+        start: int = 0,
+    ) -> List[dict]:
+        """Performs a search using SerpApi (or the cache) and returns the organic results.
+
+        Concurrent identical searches share one in-flight request. Fresh cached results are returned
+        directly. Stale results (older than `cache_ttl` but not older than `cache_ttl + cache_stale_ttl`)
+        are returned as well, while a background task refreshes them.
+
+        Args:
+            search_string: The search string (with potentially added site: parameters).
+            language: The language to use for the query ('hl' parameter).
+            location: The location to use for the query ('gl' parameter).
+            num_results: Max number of results to return.
+            start: The offset of the results (for fetching further result pages).
+        """
+        kwargs = {
+            "search_string": search_string,
+            "language": language,
+            "location": location,
+            "num_results": num_results,
+            "start": start,
+        }
+        key = Cache.make_key(
+            namespace=self._cache_namespace,
+            q=search_string,
+            hl=language.code,
+            gl=location.code,
+            num=num_results,
+            start=start,
         )
-        return urls
+        if self._cache is None:
+            return await self._coalesce(key, lambda: self._fetch(**kwargs))  # type: ignore[arg-type]
+
+        entry = self._cache.get(key)
+        if entry is not None:
+            age = entry.age()
+            if age < self._cache_ttl:
+                logger.debug(f'Using cached SerpAPI results for q="{search_string}".')
+                return entry.value
+            if age < self._cache_ttl + self._cache_stale_ttl:
+                logger.debug(
+                    f'Using stale SerpAPI results for q="{search_string}" while refreshing them.'
+                )
+                if key not in self._refreshing:
+                    self._refreshing.add(key)
+                    task = asyncio.create_task(self._refresh(key=key, **kwargs))  # type: ignore[arg-type]
+                    self._refresh_tasks.add(task)
+                    task.add_done_callback(self._refresh_tasks.discard)
+                return entry.value
+
+        organic = await self._coalesce(key, lambda: self._fetch(**kwargs))  # type: ignore[arg-type]
+        self._cache.set(key, organic)
+        return organic
+
+    async def _refresh(
+        self,
+        key: str,
+        search_string: str,
+        language: Language,
+        location: Location,
+        num_results: int,
+        start: int = 0,
+    ) -> None:
+        """Refreshes a cached search result in the background."""
+        try:
+            organic = await self._coalesce(
+                key,
+                lambda: self._fetch(
+                    search_string=search_string,
+                    language=language,
+                    location=location,
+                    num_results=num_results,
+                    start=start,
+                ),
+            )
+            if self._cache is not None:
+                self._cache.set(key, organic)
+        except Exception as e:
+            logger.warning(
+                f'Refreshing cached SerpAPI results for q="{search_string}" failed with error: {e}.'
+            )
+        finally:
+            self._refreshing.discard(key)
 
     @staticmethod
     def _keep_url(url: str, country_code: str) -> bool:
@@ -162,6 +311,11 @@ class SerpApi(AsyncClient):
         url: str,
         location: Location,
         marketplaces: List[Host] | None,
+        rank: int | None = None,
+        position: int | None = None,
+        title: str | None = None,
+        snippet: str | None = None,
+        extensions: Dict[str, Any] | None = None,
     ) -> SerpResult:
         """From a given url it creates the class:`SerpResult` instance.
 
@@ -171,6 +325,11 @@ class SerpApi(AsyncClient):
             url: The URL to be processed.
             location:  The location to use for the query.
             marketplaces: The list of marketplaces to compare the URL against.
+            rank: The rank of the URL within the search results (optional).
+            position: The position of the URL within its google search (optional).
+            title: The title of the search result (optional).
+            snippet: The snippet of the search result (optional).
+            extensions: The detected rich snippet extensions (optional).
         """
         # Filter for county code
         filtered = not self._keep_url(url=url, country_code=location.code)
@@ -192,10 +351,66 @@ class SerpApi(AsyncClient):
             url=url,
             domain=domain,
             marketplace_name=marketplace_name,
+            rank=rank,
+            position=position,
+            title=title,
+            snippet=snippet,
+            extensions=extensions or {},
             filtered=filtered,
             filtered_at_stage=filtered_at_stage,
         )
 
+    @staticmethod
+    def _get_search_strings(
+        search_term: str,
+        marketplaces: List[Host] | None,
+        max_words: int = SERP_MAX_QUERY_WORDS,
+    ) -> List[str]:
+        """Creates the search strings by sharding the marketplace domains into `site:` queries.
+
+        Each `site:<domain>` counts as one word and each `OR` operator as another one; the domains
+        are distributed over as many shards as needed for no search string to exceed `max_words`.
+
+        Args:
+            search_term: The search term to use for the query.
+            marketplaces: The marketplaces to include in the search.
+            max_words: The maximal number of words per search string.
+        """
+        sites = list(
+            dict.fromkeys(dom for host in marketplaces or [] for dom in host.domains)
+        )
+        if not sites:
+            return [search_term]
+
+        # The first site costs one word, every further site one word plus its preceding `OR`
+        n_free = max_words - len(search_term.split())
+        shard_size = max(1, (n_free + 1) // 2)
+        shards = [sites[i : i + shard_size] for i in range(0, len(sites), shard_size)]
+        return [f"{search_term} site:" + " OR site:".join(shrd) for shrd in shards]
+
+    @staticmethod
+    def _interleave_results(
+        results_per_shard: List[List[dict]], num_results: int
+    ) -> List[dict]:
+        """Merges the organic results of several shards rank by rank, dropping duplicate URLs.
+
+        The first results of all shards come before the second results of all shards and so on,
+        such that no shard is starved when the total is cut at `num_results`.
+
+        Args:
+            results_per_shard: The ranked organic results of each shard.
+            num_results: Max number of results to return.
+        """
+        results: List[dict] = []
+        seen = set()
+        max_len = max((len(shrd) for shrd in results_per_shard), default=0)
+        for rank in range(max_len):
+            for shrd in results_per_shard:
+                if rank < len(shrd) and (res := shrd[rank])["link"] not in seen:
+                    seen.add(res["link"])
+                    results.append(res)
+        return results[:num_results]
+
     async def apply(
         self,
         search_term: str,
@@ -204,6 +419,7 @@ class SerpApi(AsyncClient):
         num_results: int,
         marketplaces: List[Host] | None = None,
         excluded_urls: List[Host] | None = None,
+        start: int = 0,
     ) -> List[SerpResult]:
         """Performs a search using SerpApi, filters based on country code and returns the URLs.
 
@@ -214,30 +430,59 @@ class SerpApi(AsyncClient):
             num_results: Max number of results to return (default: 10).
             marketplaces: The marketplaces to include in the search.
             excluded_urls: The URLs to exclude from the search.
+            start: The offset of the results (for fetching further result pages).
         """
         # Setup the parameters
         logger.info(f'Performing SerpAPI search for search_term="{search_term}".')
 
-        # Setup the search string
-        search_string = search_term
-        if marketplaces:
-            sites = [dom for host in marketplaces for dom in host.domains]
-            search_string += " site:" + " OR site:".join(s for s in sites)
-
-        # Perform the search
-        urls = await self._search(
-            search_string=search_string,
-            language=language,
-            location=location,
-            num_results=num_results,
+        # Setup the search strings (one per shard of marketplace domains)
+        search_strings = self._get_search_strings(
+            search_term=search_term, marketplaces=marketplaces
+        )
+
+        # Perform the searches concurrently and merge them rank by rank
+        shards = await asyncio.gather(
+            *[
+                self._search(
+                    search_string=search_string,
+                    language=language,
+                    location=location,
+                    num_results=num_results,
+                    start=start,
+                )
+                for search_string in search_strings
+            ],
+            return_exceptions=True,
+        )
+        organic_per_shard: List[List[dict]] = []
+        err: BaseException | None = None
+        for search_string, shrd in zip(search_strings, shards):
+            if isinstance(shrd, BaseException):
+                logger.error(
+                    f'SerpAPI search for q="{search_string}" failed with error: {shrd}.'
+                )
+                err = shrd
+                continue
+            organic_per_shard.append(shrd)
+        if not organic_per_shard and err is not None:
+            raise err
+        organic = self._interleave_results(
+            results_per_shard=organic_per_shard, num_results=num_results
         )
 
         # Form the SerpResult objects
         results = [
             self._create_serp_result(
-                url=url, location=location, marketplaces=marketplaces
+                url=res["link"],
+                location=location,
+                marketplaces=marketplaces,
+                rank=rank,
+                position=res.get("position"),
+                title=res.get("title"),
+                snippet=res.get("snippet"),
+                extensions=res.get("extensions"),
             )
-            for url in urls
+            for rank, res in enumerate(organic, start=start + 1)
         ]
 
         # Filter out the excluded URLs
@@ -246,6 +491,6 @@ class SerpApi(AsyncClient):
             results = [res for res in results if res.domain not in excluded]
 
         logger.info(
-            f'Produced {len(results)} results from SerpApi search with q="{search_string}".'
+            f'Produced {len(results)} results from {len(search_strings)} SerpApi search(es) for search_term="{search_term}".'
         )
         return results
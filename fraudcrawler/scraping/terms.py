@@ -0,0 +1,92 @@
+import re
+from typing import Dict
+import unicodedata
+
+# German umlauts are commonly transliterated (e.g. Kühlschrank/Kuehlschrank)
+_TRANSLITERATIONS = str.maketrans({"ä": "ae", "ö": "oe", "ü": "ue", "ß": "ss"})
+# Umlaut plurals (e.g. Kühlschrank/Kühlschränke) are matched by dropping the umlauts
+_FOLDINGS = str.maketrans({"ß": "ss"})
+_NON_ALNUM_PATTERN = re.compile(r"[^0-9a-z]+")
+
+
+def _normalize(term: str, table: Dict[int, str]) -> str:
+    term = term.casefold().translate(table)
+    term = unicodedata.normalize("NFKD", term)
+    term = "".join(c for c in term if not unicodedata.combining(c))
+    return _NON_ALNUM_PATTERN.sub(" ", term).strip()
+
+
+def normalize_term(term: str) -> str:
+    """Normalizes a search term such that spelling variants are mapped onto the same string.
+
+    The term is case-folded, umlauts are transliterated, remaining diacritics are removed and all
+    non-alphanumeric characters are collapsed into single whitespaces
+    (e.g. `"Kühl-Schrank "` and `"kuehl schrank"` both become `"kuehl schrank"`).
+
+    Args:
+        term: The search term to normalize.
+    """
+    return _normalize(term, _TRANSLITERATIONS)
+
+
+# Common plural endings (german and english), longest first; "er" is left alone as it mostly
+# forms nouns (e.g. Drucker/Druck, Kocher/Koch) rather than plurals
+_PLURAL_SUFFIXES = ("en", "es", "e", "n", "s")
+_MIN_STEM_LEN = 4
+
+
+def _stem_token(token: str) -> str:
+    """Removes a common plural ending from a (normalized) token."""
+    for sfx in _PLURAL_SUFFIXES:
+        if token.endswith(sfx) and len(token) - len(sfx) >= _MIN_STEM_LEN:
+            return token[: -len(sfx)]
+    return token
+
+
+def term_signature(term: str) -> str:
+    """Creates a signature of a search term that is shared by its plural and word order variants.
+
+    Like func:`normalize_term`, but the umlauts are dropped instead of transliterated (only real umlauts,
+    such that e.g. `"Poet"` and `"Pot"` stay apart), plural endings are removed and the words are sorted,
+    such that e.g. `"Kühlschränke Bosch"` and `"Bosch Kühlschrank"` have the same signature. Transliterated
+    spellings (`"bosch kuehlschrank"`) are matched by their normalized form (c.f. class:`TermDeduplicator`).
+
+    Args:
+        term: The search term.
+    """
+    tokens = _normalize(term, _FOLDINGS).split()
+    return " ".join(sorted(_stem_token(tkn) for tkn in tokens))
+
+
+class TermDeduplicator:
+    """Keeps track of the search terms of a run and detects near-identical variants.
+
+    Two terms are variants if they have the same normalized form (c.f. func:`normalize_term`) or the
+    same signature (c.f. func:`term_signature`).
+    """
+
+    def __init__(self):
+        self._representatives: Dict[str, str] = {}
+        self.mapping: Dict[str, str] = {}
+        self.n_duplicates = 0
+
+    def add(self, term: str) -> bool:
+        """Adds a term and returns whether it is new (i.e. not a variant of an earlier term).
+
+        Every added term is mapped onto the first term it is a variant of (c.f. attribute:`mapping`).
+
+        Args:
+            term: The search term.
+        """
+        keys = (normalize_term(term), term_signature(term))
+        representative = next(
+            (self._representatives[k] for k in keys if k in self._representatives),
+            term,
+        )
+        for key in keys:
+            self._representatives.setdefault(key, representative)
+        is_new = term not in self.mapping and representative == term
+        self.mapping.setdefault(term, representative)
+        if not is_new:
+            self.n_duplicates += 1
+        return is_new
@@ -10,6 +10,7 @@ from fraudcrawler.settings import (
     ZYTE_DEFALUT_PROBABILITY_THRESHOLD,
 )
 from fraudcrawler.base.base import AsyncClient
+from fraudcrawler.base.keys import KeyPool, api_key_pool
 
 logger = logging.getLogger(__name__)
 
@@ -32,24 +33,27 @@ class ZyteApi(AsyncClient):
 
     def __init__(
         self,
-        api_key: str,
+        api_key: str | List[str] | KeyPool[str],
         max_retries: int = MAX_RETRIES,
         retry_delay: int = RETRY_DELAY,
     ):
         """Initializes the ZyteApiClient with the given API key and retry configurations.
 
         Args:
-            api_key: The API key for Zyte API.
+            api_key: The API key for Zyte API, or several keys (a list, comma separated or a class:`KeyPool`) used in turn.
             max_retries: Maximum number of retries for API calls.
             retry_delay: Delay between retries in seconds.
         """
-        self._aiohttp_basic_auth = aiohttp.BasicAuth(api_key)
+        super().__init__()
+        self._keys = api_key_pool(api_key)
         self._max_retries = max_retries
         self._retry_delay = retry_delay
 
     async def get_details(self, url: str) -> dict:
         """Fetches product details for a single URL.
 
+        Concurrent calls for the same URL share one in-flight request.
+
         Args:
             url: The URL to fetch product details from.
 
@@ -71,6 +75,14 @@ class ZyteApi(AsyncClient):
                 }
             }
         """
+        return await self._coalesce(url, lambda: self._get_details(url=url))
+
+    async def _get_details(self, url: str) -> dict:
+        """Fetches product details for a single URL (c.f. func:`get_details`) with retries.
+
+        Args:
+            url: The URL to fetch product details from.
+        """
         logger.info(f"Fetching product details by Zyte for URL {url}.")
         attempts = 0
         err = None
@@ -79,11 +91,12 @@ class ZyteApi(AsyncClient):
                 logger.debug(
                     f"Fetch product details for URL {url} (Attempt {attempts + 1})."
                 )
-                product = await self.post(
-                    url=self._endpoint,
-                    data={"url": url, **self._config},
-                    auth=self._aiohttp_basic_auth,
-                )
+                async with self._keys.acquire() as api_key:
+                    product = await self.post(
+                        url=self._endpoint,
+                        data={"url": url, **self._config},
+                        auth=aiohttp.BasicAuth(api_key),
+                    )
                 return product
             except Exception as e:
                 logger.debug(
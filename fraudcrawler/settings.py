@@ -5,12 +5,31 @@ MAX_RETRIES = 3
 RETRY_DELAY = 2
 ROOT_DIR = Path(__file__).parents[1]
 
+# Cache settings
+CACHE_DEFAULT_FILENAME = ROOT_DIR / "data" / "cache" / "responses.sqlite"
+
+# Domain statistics settings
+DOMAIN_STATS_DEFAULT_FILENAME = ROOT_DIR / "data" / "cache" / "domains.sqlite"
+DOMAIN_POLICY_DEFAULT_MIN_SEEN = (
+    20  # seen products without a relevant one to prove zero yield
+)
+DOMAIN_POLICY_DEFAULT_RESAMPLE_RATE = (
+    0.05  # share of zero yield products processed anyway
+)
+
 # Serp settings
 GOOGLE_LOCATIONS_FILENAME = ROOT_DIR / "fraudcrawler" / "base" / "google-locations.json"
 GOOGLE_LANGUAGES_FILENAME = ROOT_DIR / "fraudcrawler" / "base" / "google-languages.json"
+SERP_MAX_QUERY_WORDS = 32  # google ignores all words of a query beyond this limit
+SERP_CACHE_TTL = 6 * 60 * 60  # cached results are fresh for 6h...
+SERP_CACHE_STALE_TTL = (
+    24 * 60 * 60
+)  # ...and served (while being refreshed) for another 24h
 
 # Enrichment settings
 ENRICHMENT_DEFAULT_LIMIT = 10
+ENRICHMENT_MAX_TASKS_PER_POST = 100  # DataForSEO accepts up to 100 tasks per POST
+ENRICHMENT_CACHE_TTL = 7 * 24 * 60 * 60  # keyword data changes slowly
 
 # Zyte settings
 ZYTE_DEFALUT_PROBABILITY_THRESHOLD = 0.1
@@ -18,14 +37,99 @@ ZYTE_DEFALUT_PROBABILITY_THRESHOLD = 0.1
 # Processor settings
 PROCESSOR_DEFAULT_MODEL = "gpt-4o"
 PROCESSOR_DEFAULT_IF_MISSING = -1
+PROCESSOR_SKIPPED = -2  # classification of prompts skipped by their gating condition
+PROCESSOR_DEFAULT_MAX_DESCRIPTION_TOKENS = (
+    1024  # token budget of the product description
+)
+PROCESSOR_CACHE_TTL = (
+    30 * 24 * 60 * 60
+)  # classifications of unchanged products are reused
+TOKENS_APPROX_CHARS_PER_TOKEN = 4  # approximation without tiktoken
+SNIPPET_FILTER_DEFAULT_MODEL = "gpt-4o-mini"
+PROCESSOR_CASCADE_DEFAULT_MODEL = "gpt-4o-mini"
+PROCESSOR_CASCADE_DEFAULT_THRESHOLD = 0.95  # min probability of the cheap answer
+OPENAI_DIGIT_TOKEN_OFFSET = (
+    15  # the tokens "0"-"9" have the ids 15-24 (cl100k_base, o200k_base)
+)
+OPENAI_PRICES_PER_1M_TOKENS = {  # USD (input, output)
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+}
 PROCESSOR_USER_PROMPT_TEMPLATE = (
     "Context: {context}\n\nProduct Details: {name}\n{description}\\n\nRelevance:"
 )
 
+# Local classifier settings
+LOCAL_CLASSIFIER_N_FEATURES = 2**18  # dimension of the hashed features
+LOCAL_CLASSIFIER_DEFAULT_THRESHOLD = 0.9  # min probability to accept a local prediction
+LOCAL_CLASSIFIER_DEFAULT_EPOCHS = 200
+LOCAL_CLASSIFIER_DEFAULT_LEARNING_RATE = 5.0
+LOCAL_CLASSIFIER_DEFAULT_L2 = 1e-4
+LOCAL_CLASSIFIER_DEFAULT_DIR = ROOT_DIR / "data" / "models"
+
+# Batch settings
+BATCH_DEFAULT_DIR = ROOT_DIR / "data" / "batches"
+BATCH_COMPLETION_WINDOW = "24h"
+BATCH_MAX_REQUESTS = (
+    50_000  # max number of requests per batch file of the OpenAI Batch API
+)
+BATCH_DEFAULT_POLL_INTERVAL = 60  # seconds
+BATCH_DEFAULT_TIMEOUT = 25 * 3600  # seconds
+
 # Orchestrator settings
 PRODUCT_ITEM_DEFAULT_IS_RELEVANT = -1
 
+# Priority settings (higher priority items are processed first)
+PRIORITY_SEARCH_TERM_TYPE = {"initial": 1.0, "enriched": 0.0}
+PRIORITY_RANK_WEIGHT = 1.0  # weight of 1 / serp_rank
+PRIORITY_MARKETPLACE_WEIGHT = 1.0  # bonus for urls of the given marketplaces
+PRIORITY_DOMAIN_YIELD_WEIGHT = (
+    1.0  # weight of the (smoothed) share of relevant products of a domain
+)
+PRIORITY_ZERO_YIELD_PENALTY = 10.0  # malus for deprioritized zero yield domains
+
 # Async settings
 DEFAULT_N_SERP_WKRS = 10
 DEFAULT_N_ZYTE_WKRS = 10
 DEFAULT_N_PROC_WKRS = 10
+
+# Shared queue settings
+QUEUE_DEFAULT_VISIBILITY_TIMEOUT = (
+    300  # seconds before an unacknowledged item is delivered again
+)
+QUEUE_DEFAULT_POLL_INTERVAL = 0.2  # seconds between polls of an empty shared queue
+SHARD_DEFAULT_DIR = ROOT_DIR / "data" / "shards"
+
+# Key pool settings
+KEY_POOL_DEFAULT_COOLDOWN = (
+    60.0  # seconds a key is quarantined after an auth/quota error
+)
+KEY_POOL_MAX_COOLDOWN = (
+    60 * 60
+)  # the cooldown doubles with every further error up to this limit
+KEY_POOL_QUARANTINE_STATUS = (401, 402, 403, 429)  # HTTP status of auth/quota errors
+KEY_POOL_POLL_INTERVAL = 0.1  # seconds between polls while no key is available
+
+# Autoscaling settings
+AUTOSCALE_DEFAULT_INTERVAL = 1.0  # seconds between two scaling decisions
+AUTOSCALE_DEFAULT_DRAIN_TIME = 5.0  # seconds in which a stage should drain its queue
+AUTOSCALE_DEFAULT_MAX_ERROR_RATE = 0.2  # above this error rate a stage is scaled down
+AUTOSCALE_EWMA_ALPHA = 0.2
+
+# Journal settings
+JOURNAL_DEFAULT_DIR = ROOT_DIR / "data" / "journals"
+
+# Service settings
+SERVICE_DEFAULT_HOST = "127.0.0.1"
+SERVICE_DEFAULT_PORT = 8080
+SERVICE_DEFAULT_MAX_JOBS = 4  # jobs running concurrently (further jobs are queued)
+SERVICE_DEFAULT_JOB_TTL = (
+    24 * 60 * 60
+)  # seconds a finished job (and its products) is kept
+
+# Adaptive depth settings
+ADAPTIVE_DEFAULT_PAGE_SIZE = 10  # number of results per additional SERP page
+ADAPTIVE_DEFAULT_MIN_YIELD = (
+    0.2  # min share of relevant products to fetch the next page
+)
+ADAPTIVE_DEFAULT_MAX_RESULTS = 100  # max number of results per search_term
@@ -0,0 +1,53 @@
+import argparse
+import logging
+
+from fraudcrawler.settings import (
+    LOCAL_CLASSIFIER_DEFAULT_DIR,
+    LOCAL_CLASSIFIER_DEFAULT_THRESHOLD,
+    ROOT_DIR,
+)
+from fraudcrawler.processing.local import train_local_classifiers
+
+LOG_FMT = "%(asctime)s | %(name)s | %(funcName)s | %(levelname)s | %(message)s"
+LOG_LVL = "INFO"
+DATE_FMT = "%Y-%m-%d %H:%M:%S"
+logging.basicConfig(format=LOG_FMT, level=LOG_LVL, datefmt=DATE_FMT)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Train the local classifiers on the stored (LLM labeled) results."
+    )
+    parser.add_argument("--prompts", nargs="+", default=["relevance", "seriousness"])
+    parser.add_argument("--classes", nargs="+", type=int, default=[0, 1])
+    parser.add_argument(
+        "--threshold", type=float, default=LOCAL_CLASSIFIER_DEFAULT_THRESHOLD
+    )
+    parser.add_argument("--test-size", type=float, default=0.2)
+    args = parser.parse_args()
+
+    # Train and evaluate the classifiers on all stored results
+    filenames = sorted((ROOT_DIR / "data" / "results").glob("*.csv"))
+    evaluations = train_local_classifiers(
+        classes={name: args.classes for name in args.prompts},
+        filenames=filenames,
+        directory=LOCAL_CLASSIFIER_DEFAULT_DIR,
+        test_size=args.test_size,
+        threshold=args.threshold,
+    )
+
+    # Show the evaluation
+    print()
+    title = f"Local classifiers (threshold={args.threshold})"
+    print(title)
+    print("=" * len(title))
+    for evl in evaluations:
+        print(
+            f"{evl.prompt}: accuracy={evl.accuracy:.3f}, avoided calls={evl.avoided_calls:.1%}, "
+            f"accuracy on accepted={evl.accepted_accuracy}, #train={evl.n_train}, #test={evl.n_test}"
+        )
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,49 @@
-from fraudcrawler.base.base import Setup, Host, Location, Language
+import asyncio
+from concurrent.futures import Future
+import json
+import pickle
+import time
+
+import aiohttp
+import pandas as pd
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+from fraudcrawler.base.base import (
+    AdaptiveDepth,
+    Setup,
+    Host,
+    Location,
+    Language,
+    Deepness,
+    Enrichment,
+    Prompt,
+    SingleFlight,
+)
+from fraudcrawler.base.adaptive import AdaptiveDepthTracker
+from fraudcrawler.base.autoscale import Autoscaler, Autoscaling, StageStats, WorkerPool
+from fraudcrawler.base.backends import (
+    MemoryDedupIndex,
+    MemoryQueueBackend,
+    MemoryRateBudget,
+    SQLiteDedupIndex,
+    SQLiteQueueBackend,
+    SQLiteRateBudget,
+)
+from fraudcrawler.base.domains import DomainPolicy, DomainStatsStore
+from fraudcrawler.base.journal import RunJournal
+from fraudcrawler.base.keys import KeyPool, KeyPoolExhausted, api_key_pool
+from fraudcrawler.base.manifest import ManifestWriter, read_records
+from fraudcrawler.base.cache import Cache, DiskCache, MemoryCache
+from fraudcrawler.base.queues import PriorityQueue, SharedQueue
+from fraudcrawler.base.client import FraudCrawlerClient, Results
+from fraudcrawler.base.orchestrator import Orchestrator, ProductItem
+from fraudcrawler.base.service import CrawlerService, FairScheduler
+from fraudcrawler.processing.batch import BatchClassifier, LocalBatchBackend
+from fraudcrawler.processing.processor import Processor
+from fraudcrawler.processing.snippet import KeywordSnippetFilter
+from fraudcrawler.processing.tokens import TokenUsage
+from fraudcrawler.scraping.serp import SerpResult
 
 
 def test_setup():
@@ -46,3 +91,1354 @@ def test_language():
     language = Language(name="German")
     assert language.name == "German"
     assert language.code == "de"
+
+
+def test_cache_make_key():
+    key = Cache.make_key(namespace="ns", q="Kühlschrank  kaufen ", num=10)
+    assert key.startswith("ns:")
+    assert key == Cache.make_key(namespace="ns", num=10, q="kühlschrank kaufen")
+    assert key != Cache.make_key(namespace="ns", q="kühlschrank kaufen", num=20)
+    assert key != Cache.make_key(namespace="other", q="kühlschrank kaufen", num=10)
+
+
+def test_memory_cache():
+    cache = MemoryCache()
+    assert cache.get("key") is None
+    cache.set("key", ["a", "b"])
+    entry = cache.get("key")
+    assert entry is not None
+    assert entry.value == ["a", "b"]
+    assert 0 <= entry.age() < 1
+
+
+def test_disk_cache(tmp_path):
+    filename = tmp_path / "cache.sqlite"
+    cache = DiskCache(filename=filename)
+    cache.set("key", [{"text": "a", "volume": 1}])
+
+    # A new instance (e.g. after a restart) finds the entry
+    entry = DiskCache(filename=filename).get("key")
+    assert entry is not None
+    assert entry.value == [{"text": "a", "volume": 1}]
+
+    assert cache.purge(max_age=3600) == 0
+    assert cache.purge(max_age=-1) == 1
+    assert cache.get("key") is None
+
+
+@pytest.mark.asyncio
+async def test_single_flight():
+    single_flight = SingleFlight()
+    calls = []
+
+    async def func(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        if value == "fail":
+            raise ValueError(value)
+        return value
+
+    results = await asyncio.gather(
+        *[single_flight.do(key="a", func=lambda: func("a")) for _ in range(3)],
+        single_flight.do(key="b", func=lambda: func("b")),
+    )
+    assert results == ["a", "a", "a", "b"]
+    assert calls == ["a", "b"]
+    assert len(single_flight) == 0
+
+    # Errors are shared by all waiters
+    results = await asyncio.gather(
+        *[single_flight.do(key="c", func=lambda: func("fail")) for _ in range(2)],
+        return_exceptions=True,
+    )
+    assert all(isinstance(res, ValueError) for res in results)
+    assert calls == ["a", "b", "fail"]
+
+    # Calls after completion are not coalesced
+    assert await single_flight.do(key="a", func=lambda: func("a")) == "a"
+    assert calls == ["a", "b", "fail", "a"]
+
+
+@pytest.mark.asyncio
+async def test_key_pool_selection():
+    # Least loaded: the key with the fewest calls in flight, then the fewest calls
+    pool = KeyPool(["a", "b", "c"])
+    async with pool.acquire() as first:
+        async with pool.acquire() as second:
+            assert {first, second} == {"a", "b"}
+            assert pool.select() == "c"
+    assert pool.n_calls == [1, 1, 0]
+    assert pool.select() == "c"
+
+    # Round robin
+    pool = KeyPool(["a", "b", "c"], strategy="round_robin")
+    keys = []
+    for _ in range(4):
+        async with pool.acquire() as key:
+            keys.append(key)
+    assert keys == ["a", "b", "c", "a"]
+
+    # Per-key quotas: concurrent calls wait for a free key, used up keys are skipped
+    pool = KeyPool(["a", "b"], max_in_flight=1, max_calls=2)
+    in_flight = []
+
+    async def call():
+        async with pool.acquire() as key:
+            in_flight.append(key)
+            assert in_flight.count(key) == 1
+            await asyncio.sleep(0.01)
+            in_flight.remove(key)
+
+    await asyncio.gather(*[call() for _ in range(4)])
+    assert pool.n_calls == [2, 2]
+    with pytest.raises(KeyPoolExhausted):
+        async with pool.acquire():
+            pass
+
+    # Comma separated keys (e.g. from the .env file)
+    assert len(api_key_pool("a, b,c")) == 3
+    assert len(api_key_pool("a")) == 1
+
+
+@pytest.mark.asyncio
+async def test_key_pool_quarantine():
+    def error(status):
+        return aiohttp.ClientResponseError(
+            request_info=None,  # type: ignore[arg-type]
+            history=(),
+            status=status,
+        )
+
+    pool = KeyPool(["a", "b"], cooldown=0.05)
+    with pytest.raises(aiohttp.ClientResponseError):
+        async with pool.acquire() as key:
+            assert key == "a"
+            raise error(429)
+    assert pool.quarantined() == ["a"]
+    assert pool.select() == "b"
+
+    # Other errors do not quarantine the key
+    with pytest.raises(aiohttp.ClientResponseError):
+        async with pool.acquire() as key:
+            raise error(500)
+    assert pool.quarantined() == ["a"]
+
+    # The key is used again after the cooldown, which doubles with every further error
+    await asyncio.sleep(0.06)
+    assert pool.quarantined() == []
+    pool.quarantine("a")
+    await asyncio.sleep(0.06)
+    assert pool.quarantined() == ["a"]
+    await asyncio.sleep(0.06)
+    assert pool.quarantined() == []
+    assert pool.n_quarantined == [2, 0]
+
+    # While all keys are quarantined, the calls wait for the first one to return
+    pool.quarantine("a")
+    pool.quarantine("b")
+    start = time.monotonic()
+    async with pool.acquire():
+        pass
+    assert time.monotonic() - start >= 0.04
+
+    # A single key is never quarantined (the client retries as before)
+    pool = KeyPool(["a"])
+    with pytest.raises(aiohttp.ClientResponseError):
+        async with pool.acquire():
+            raise error(429)
+    assert pool.n_quarantined == [0]
+    assert pool.select() == "a"
+
+
+class _Orchestrator(Orchestrator):
+    """Orchestrator with stubbed clients collecting the results in memory."""
+
+    def __init__(self, **kwargs):
+        super().__init__(
+            serpapi_key="x",
+            dataforseo_user="x",
+            dataforseo_pwd="x",
+            zyteapi_key="x",
+            openaiapi_key="x",
+            **kwargs,
+        )
+        self.results: list = []
+        self.zyte_urls: list = []
+        self.proc_urls: list = []
+        self.serp_starts: list = []
+        self.classification = 1
+        self._serpapi.apply = self._serp_apply  # type: ignore[method-assign]
+        self._zyteapi.get_details = self._get_details  # type: ignore[method-assign]
+        self._processor.classify = self._classify  # type: ignore[method-assign]
+
+    async def _serp_apply(self, search_term, num_results, start=0, **kwargs):
+        self.serp_starts.append(start)
+        idx = range(start, start + num_results)
+        urls = [f"https://shop{i}.ch/{search_term}" for i in idx]
+        urls += [f"https://shop{i}.it/{search_term}" for i in idx]
+        urls += urls[:1]  # duplicate
+        return [
+            SerpResult(
+                url=url,
+                domain=url.split("/")[2],
+                marketplace_name="Google",
+                title=f"{search_term} bei {url.split('/')[2]}",
+                filtered=url.split("/")[2].endswith(".it"),
+                filtered_at_stage="country code filtering" if ".it/" in url else None,
+            )
+            for url in urls
+        ]
+
+    async def _get_details(self, url):
+        self.zyte_urls.append(url)
+        probability = 0.0 if url.startswith("https://shop0") else 0.9
+        return {
+            "url": url,
+            "product": {
+                "name": url,
+                "description": "sildenafil",
+                "metadata": {"probability": probability},
+            },
+        }
+
+    async def _classify(self, prompt, url, name, description, failed=None):
+        self.proc_urls.append(url)
+        return self.classification
+
+    async def _collect_results(self, queue_in):
+        while True:
+            product = await queue_in.get()
+            queue_in.task_done()
+            if product is None:
+                break
+            self.results.append(product)
+
+
+_PROMPTS = [
+    Prompt(
+        name="relevance",
+        context="context",
+        system_prompt="system prompt",
+        allowed_classes=[0, 1],
+    )
+]
+
+
+@pytest.mark.asyncio
+async def test_orchestrator_filtered_bypass():
+    orc = _Orchestrator()
+    await orc.run(
+        search_term="sildenafil",
+        language=Language(name="German"),
+        location=Location(name="Switzerland"),
+        deepness=Deepness(num_results=3),
+        prompts=_PROMPTS,
+    )
+    assert len(orc.results) == 7
+    assert all(isinstance(p, ProductItem) for p in orc.results)
+    stages = sorted(p.filtered_at_stage or "" for p in orc.results)
+    assert stages == [
+        "",
+        "",
+        "URL collection (current run deduplication)",
+        "Zyte probability threshold",
+        "country code filtering",
+        "country code filtering",
+        "country code filtering",
+    ]
+
+    # Filtered products never reach the later stages
+    assert sorted(orc.zyte_urls) == [f"https://shop{i}.ch/sildenafil" for i in range(3)]
+    assert sorted(orc.proc_urls) == [f"https://shop{i}.ch/sildenafil" for i in (1, 2)]
+
+
+@pytest.mark.asyncio
+async def test_worker_pool():
+    queue: asyncio.Queue = asyncio.Queue()
+    processed = []
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            queue.task_done()
+            if item is None:
+                break
+            processed.append(item)
+
+    pool = WorkerPool(
+        name="test",
+        queue=queue,
+        worker=worker,
+        n_workers=2,
+        min_workers=1,
+        max_workers=3,
+    )
+    assert pool.n_workers == 2
+    assert pool.add() is True
+    assert pool.add() is False
+    assert pool.retire() is True
+    assert pool.retire() is True
+    assert pool.retire() is False
+    assert pool.n_workers == 3 and pool.n_retiring == 2
+    await asyncio.sleep(0.01)
+    assert pool.n_workers == 1 and pool.n_retiring == 0
+
+    for i in range(5):
+        await queue.put(i)
+    results = await pool.close()
+    assert all(res is None for res in results)
+    assert sorted(processed) == list(range(5))
+    assert pool.n_workers == 0
+
+
+@pytest.mark.asyncio
+async def test_worker_pool_retire_with_backlog():
+    queue = PriorityQueue(priority=lambda item: 0.0)
+    n_running = 0
+    concurrency = []
+
+    async def worker():
+        nonlocal n_running
+        while True:
+            item = await queue.get()
+            if item is None:
+                queue.task_done()
+                break
+            n_running += 1
+            concurrency.append(n_running)
+            await asyncio.sleep(0.01)
+            n_running -= 1
+            queue.task_done()
+
+    for i in range(40):
+        queue.put_nowait(i)
+    pool = WorkerPool(name="test", queue=queue, worker=worker, n_workers=4)
+    await asyncio.sleep(0.015)
+
+    # The retired workers finish their current item and leave the backlog to the remaining one
+    for _ in range(3):
+        assert pool.retire() is True
+    await asyncio.sleep(0.015)
+    assert pool.n_workers == 1 and pool.n_retiring == 0
+    concurrency.clear()
+    await asyncio.sleep(0.05)
+    assert queue.qsize() > 0
+    assert max(concurrency) == 1
+    await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_autoscaler_step():
+    queues = {
+        name: PriorityQueue(priority=lambda item: 0.0) for name in ["zyte", "proc"]
+    }
+
+    def make_worker(queue):
+        async def worker():
+            while await queue.get() is not None:
+                await asyncio.sleep(3600)
+
+        return worker
+
+    pools = {
+        name: WorkerPool(
+            name=name,
+            queue=q,
+            worker=make_worker(q),
+            n_workers=2,
+            min_workers=1,
+            max_workers=5,
+        )
+        for name, q in queues.items()
+    }
+    stats = {name: StageStats() for name in pools}
+    for stage_stats in stats.values():
+        stage_stats.record(start=time.monotonic() - 1.0)
+    config = Autoscaling(max_total_wkrs=4, drain_time=1.0)
+    autoscaler = Autoscaler(
+        pools=pools, stats=stats, config=config, shared=["zyte", "proc"]
+    )
+
+    # The zyte stage is the bottleneck and takes a worker from the idle proc stage
+    for i in range(10):
+        queues["zyte"].put_nowait(i)
+    await asyncio.sleep(0)
+    autoscaler.step()
+    assert pools["zyte"].n_workers == 2
+    assert pools["proc"].n_workers == 2 and pools["proc"].n_retiring == 1
+    await asyncio.sleep(0.01)
+    assert pools["proc"].n_workers == 1
+    autoscaler.step()
+    assert pools["zyte"].n_workers == 3
+
+    # A stage with a high error rate is scaled down once its busy worker has finished
+    stats["zyte"].error_rate = 0.5
+    autoscaler.step()
+    autoscaler.step()
+    assert pools["zyte"].n_workers == 3 and pools["zyte"].n_retiring == 1
+
+    for pool in pools.values():
+        for task in pool._tasks:
+            task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_orchestrator_autoscaling():
+    orc = _Orchestrator(autoscaling=Autoscaling(interval=0.01, max_zyte_wkrs=2))
+    await orc.run(
+        search_term="sildenafil",
+        language=Language(name="German"),
+        location=Location(name="Switzerland"),
+        deepness=Deepness(num_results=5),
+        prompts=_PROMPTS,
+    )
+    assert len(orc.results) == 11
+    assert sorted(orc.proc_urls) == [
+        f"https://shop{i}.ch/sildenafil" for i in range(1, 5)
+    ]
+
+
+def test_priority_queue():
+    shed = []
+    queue = PriorityQueue(priority=lambda x: x, max_items=3, on_shed=shed.append)
+    for item in [1, None, 5, 3, 4]:
+        queue.put_nowait(item)
+    assert shed == [1]
+    assert queue.n_shed == 1
+    assert [queue.get_nowait() for _ in range(4)] == [5, 4, 3, None]
+
+    # Among equal priorities the queue is FIFO and sheds the newest item
+    queue = PriorityQueue(priority=lambda x: 0, max_items=2, on_shed=shed.append)
+    for item in ["a", "b", "c"]:
+        queue.put_nowait(item)
+    assert shed == [1, "c"]
+    assert [queue.get_nowait() for _ in range(2)] == ["a", "b"]
+
+
+def test_orchestrator_priority():
+    orc = _Orchestrator()
+    kwargs = {
+        "search_term": "sildenafil",
+        "marketplace_name": "Google",
+        "domain": "a.ch",
+    }
+    initial = ProductItem(url="1", search_term_type="initial", serp_rank=1, **kwargs)
+    initial_low = ProductItem(
+        url="2", search_term_type="initial", serp_rank=10, **kwargs
+    )
+    enriched = ProductItem(url="3", search_term_type="enriched", serp_rank=1, **kwargs)
+    assert orc._priority(initial) > orc._priority(initial_low) > orc._priority(enriched)
+
+    kwargs["marketplace_name"] = "Ricardo"
+    marketplace = ProductItem(
+        url="4", search_term_type="enriched", serp_rank=1, **kwargs
+    )
+    assert orc._priority(marketplace) > orc._priority(enriched)
+
+    # Domains yielding relevant products are preferred
+    kwargs.update(marketplace_name="Google", domain="b.ch")
+    other = ProductItem(url="5", search_term_type="enriched", serp_rank=1, **kwargs)
+    assert orc._priority(other) == orc._priority(enriched)
+    for _ in range(3):
+        orc._update_domain_yield(
+            ProductItem(url="6", search_term_type="enriched", is_relevant=1, **kwargs)
+        )
+    assert orc._priority(other) > orc._priority(enriched)
+
+
+@pytest.mark.asyncio
+async def test_orchestrator_shedding():
+    orc = _Orchestrator(max_queue_size=1, n_zyte_wkrs=1)
+    await orc.run(
+        search_term="sildenafil",
+        language=Language(name="German"),
+        location=Location(name="Switzerland"),
+        deepness=Deepness(num_results=5),
+        prompts=_PROMPTS,
+    )
+    assert len(orc.results) == 11
+    shed = [
+        p for p in orc.results if p.filtered_at_stage == "Priority shedding (overload)"
+    ]
+    assert len(shed) > 0
+    assert all(p.url not in orc.zyte_urls for p in shed)
+    # The top ranked products are not shed
+    assert "https://shop0.ch/sildenafil" in orc.zyte_urls
+
+
+def test_adaptive_depth_tracker():
+    tracker = AdaptiveDepthTracker(
+        config=AdaptiveDepth(page_size=2, min_yield=0.5, max_results=4)
+    )
+    item = {"search_term": "a", "num_results": 2}
+    tracker.add_term(item)
+    tracker.add_term({"search_term": "b", "num_results": 2})
+    tracker.close()
+
+    # The next page is requested once all products of the current page are finished
+    assert tracker.page_fetched(search_term="a", n_products=2) is None
+    assert tracker.product_finished("a", classified=True, relevant=True) is None
+    nxt = tracker.product_finished("a", classified=True, relevant=False)
+    assert nxt == {"search_term": "a", "num_results": 2, "start": 2}
+
+    # A search_term with a low yield is stopped early
+    assert tracker.page_fetched(search_term="b", n_products=2) is None
+    tracker.product_finished("b", classified=True, relevant=False)
+    assert tracker.product_finished("b", classified=False, relevant=False) is None
+    assert tracker.n_stopped_early == 1
+    assert not tracker.done.is_set()
+
+    # The cap max_results ends the search_term
+    tracker.page_fetched(search_term="a", n_products=2)
+    tracker.product_finished("a", classified=True, relevant=True)
+    assert tracker.product_finished("a", classified=True, relevant=True) is None
+    assert tracker.done.is_set()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("classification, starts", [(1, [0, 3, 6]), (0, [0])])
+async def test_orchestrator_adaptive_depth(classification, starts):
+    orc = _Orchestrator()
+    orc.classification = classification
+    await orc.run(
+        search_term="sildenafil",
+        language=Language(name="German"),
+        location=Location(name="Switzerland"),
+        deepness=Deepness(
+            num_results=3,
+            adaptive=AdaptiveDepth(page_size=3, min_yield=0.5, max_results=9),
+        ),
+        prompts=_PROMPTS,
+    )
+    assert orc.serp_starts == starts
+    assert len(orc.results) == 7 * len(starts)
+
+
+@pytest.mark.asyncio
+async def test_orchestrator_adaptive_depth_crash():
+    orc = _Orchestrator()
+
+    async def crash(product):
+        raise RuntimeError("unexpected")
+
+    # A crashed zyte worker never finishes its product, the run fails instead of waiting for it
+    orc._fetch_details = crash  # type: ignore[method-assign]
+    with pytest.raises(RuntimeError, match="zyte workers ended"):
+        await asyncio.wait_for(
+            orc.run(
+                search_term="sildenafil",
+                language=Language(name="German"),
+                location=Location(name="Switzerland"),
+                deepness=Deepness(
+                    num_results=3,
+                    adaptive=AdaptiveDepth(page_size=3, min_yield=0.5, max_results=9),
+                ),
+                prompts=_PROMPTS,
+            ),
+            timeout=5,
+        )
+
+
+def test_domain_stats_store(tmp_path):
+    filename = tmp_path / "domains.sqlite"
+    store = DomainStatsStore(filename=filename)
+    policy = DomainPolicy(min_seen=2)
+    for cls in [0, 0]:
+        store.update(
+            domain="news.ch",
+            kept=True,
+            classifications={"relevance": cls},
+            is_relevant=False,
+        )
+    store.update(domain="shop.ch", kept=False, classifications={}, is_relevant=False)
+    store.flush()
+
+    # The statistics persist across instances
+    store = DomainStatsStore(filename=filename)
+    stats = store.get("news.ch")
+    assert (stats.n_seen, stats.n_kept, stats.n_relevant) == (2, 2, 0)
+    assert stats.relevance_rate("relevance") == 0.0
+    assert store.get("shop.ch").relevance_rate("relevance") is None
+    assert store.is_zero_yield("news.ch", policy=policy)
+    assert not store.is_zero_yield("shop.ch", policy=policy)
+    assert not store.is_zero_yield("unknown.ch", policy=policy)
+
+    # The flushes of several processes add up (the pickled copy leaves the pending updates to the original)
+    store.update(domain="shop.ch", kept=True, classifications={}, is_relevant=True)
+    other = pickle.loads(pickle.dumps(store))
+    other.update(domain="shop.ch", kept=True, classifications={}, is_relevant=True)
+    other.flush()
+    store.flush()
+    stats = DomainStatsStore(filename=filename).get("shop.ch")
+    assert (stats.n_seen, stats.n_kept, stats.n_relevant) == (3, 2, 2)
+
+
+@pytest.mark.asyncio
+async def test_orchestrator_domain_policy():
+    store = DomainStatsStore(filename=None)
+    for _ in range(3):
+        store.update(
+            domain="shop1.ch",
+            kept=True,
+            classifications={"relevance": 0},
+            is_relevant=False,
+        )
+    policy = DomainPolicy(min_seen=3, resample_rate=0.0)
+    orc = _Orchestrator(domain_stats=store, domain_policy=policy)
+    await orc.run(
+        search_term="sildenafil",
+        language=Language(name="German"),
+        location=Location(name="Switzerland"),
+        deepness=Deepness(num_results=3),
+        prompts=_PROMPTS,
+    )
+    skipped = [
+        p.url
+        for p in orc.results
+        if p.filtered_at_stage == "URL collection (zero yield domain)"
+    ]
+    assert skipped == ["https://shop1.ch/sildenafil"]
+    assert "https://shop1.ch/sildenafil" not in orc.zyte_urls
+
+    # The statistics are updated with the results of the run
+    assert store.get("shop0.ch").n_seen == 1
+    assert store.get("shop0.ch").n_kept == 0
+    assert store.get("shop2.ch").n_relevant == 1
+    assert store.get("shop1.ch").n_seen == 3
+
+    # Deprioritized zero yield domains are processed last
+    orc._domain_policy = DomainPolicy(action="deprioritize", min_seen=3)
+    kwargs = {"search_term": "s", "search_term_type": "initial", "serp_rank": 1}
+    zero = ProductItem(url="1", marketplace_name="Google", domain="shop1.ch", **kwargs)
+    other = ProductItem(url="2", marketplace_name="Google", domain="shop9.ch", **kwargs)
+    assert orc._priority(zero) < orc._priority(other)
+    assert not orc._skip_domain("shop1.ch")
+
+
+@pytest.mark.asyncio
+async def test_orchestrator_snippet_filter():
+    orc = _Orchestrator(snippet_filter=KeywordSnippetFilter(exclude=["shop2 ch"]))
+    await orc.run(
+        search_term="sildenafil",
+        language=Language(name="German"),
+        location=Location(name="Switzerland"),
+        deepness=Deepness(num_results=3),
+        prompts=_PROMPTS,
+    )
+    assert len(orc.results) == 7
+    dropped = [
+        p.url
+        for p in orc.results
+        if p.filtered_at_stage == "SERP snippet pre-classification"
+    ]
+    assert dropped == ["https://shop2.ch/sildenafil"]
+    assert "https://shop2.ch/sildenafil" not in orc.zyte_urls
+
+    # The SERP metadata is kept on the products
+    assert all(p.serp_title.startswith("sildenafil bei") for p in orc.results)
+
+
+@pytest.mark.asyncio
+async def test_orchestrator_batch(tmp_path):
+    backend = LocalBatchBackend(answer=lambda body: "1", n_polls=1)
+    orc = _Orchestrator(
+        batch=BatchClassifier(backend=backend, directory=tmp_path, poll_interval=0)
+    )
+    await orc.run(
+        search_term="sildenafil",
+        language=Language(name="German"),
+        location=Location(name="Switzerland"),
+        deepness=Deepness(num_results=3),
+        prompts=_PROMPTS,
+    )
+    assert len(orc.results) == 7
+
+    # The products are classified in one batch instead of per product
+    assert orc.proc_urls == []
+    assert len(list(tmp_path.glob("*.jsonl"))) == 1
+    classified = [p for p in orc.results if not p.filtered]
+    assert sorted(p.url for p in classified) == [
+        f"https://shop{i}.ch/sildenafil" for i in (1, 2)
+    ]
+    assert all(p.classifications == {"relevance": 1} for p in classified)
+    assert all(p.is_relevant == 1 for p in classified)
+
+
+@pytest.mark.asyncio
+async def test_orchestrator_reprocess():
+    orc = _Orchestrator()
+    await orc.run(
+        search_term="sildenafil",
+        language=Language(name="German"),
+        location=Location(name="Switzerland"),
+        deepness=Deepness(num_results=3),
+        prompts=_PROMPTS,
+    )
+    products = list(orc.results)
+    orc.results, orc.zyte_urls, orc.proc_urls = [], [], []
+
+    # Only the processing step is run again with the new prompts
+    orc.classification = 0
+    prompts = _PROMPTS + [_PROMPTS[0].model_copy(update={"name": "seriousness"})]
+    await orc.reprocess(products=products, prompts=prompts)
+    assert len(orc.results) == 7
+    assert orc.zyte_urls == []
+    assert len(orc.proc_urls) == 4
+    classified = [p for p in orc.results if not p.filtered]
+    assert len(classified) == 2
+    assert all(
+        p.classifications == {"relevance": 0, "seriousness": 0} for p in classified
+    )
+    assert all(p.is_relevant == 0 for p in classified)
+    assert all(p.classifications == {} for p in orc.results if p.filtered)
+
+    # The products of the previous run are not modified
+    assert all(
+        p.classifications == {"relevance": 1} for p in products if not p.filtered
+    )
+
+
+@pytest.mark.asyncio
+async def test_orchestrator_stream():
+    orc = _Orchestrator()
+    run = dict(
+        search_term="sildenafil",
+        language=Language(name="German"),
+        location=Location(name="Switzerland"),
+        deepness=Deepness(num_results=3),
+        prompts=_PROMPTS,
+    )
+    streamed = [p async for p in orc.stream(**run)]
+    assert len(streamed) == 7
+    assert [p.url for p in streamed] == [p.url for p in orc.results]
+
+    # Closing the stream early cancels the run without processing the blocked products
+    def blocked_orchestrator():
+        orc = _Orchestrator()
+        blocked = asyncio.Event()
+        get_details = orc._get_details
+
+        async def _blocking_get_details(url):
+            await blocked.wait()
+            return await get_details(url)
+
+        orc._zyteapi.get_details = _blocking_get_details  # type: ignore[method-assign]
+        return orc
+
+    orc = blocked_orchestrator()
+    stream = orc.stream(**run)
+    product = await anext(stream)
+    assert product.filtered
+    await asyncio.wait_for(stream.aclose(), timeout=1)
+    assert asyncio.all_tasks() == {asyncio.current_task()}
+    assert orc.proc_urls == []
+    assert all(p.filtered for p in orc.results)
+
+    # Cancelling the consumer cancels the run as well
+    orc = blocked_orchestrator()
+    consumed: list = []
+
+    async def consume():
+        async for p in orc.stream(**run):
+            consumed.append(p)
+
+    task = asyncio.create_task(consume())
+    while not consumed:
+        await asyncio.sleep(0.01)
+    task.cancel()
+    await asyncio.wait([task], timeout=1)
+    assert task.cancelled()
+    assert asyncio.all_tasks() == {asyncio.current_task()}
+    assert orc.proc_urls == []
+
+
+@pytest.mark.asyncio
+async def test_client_load_products(tmp_path):
+    products = [
+        ProductItem(
+            search_term="sildenafil",
+            search_term_type="initial",
+            url="https://shop1.ch/sildenafil",
+            marketplace_name="Google",
+            domain="shop1.ch",
+            serp_rank=1,
+            serp_extensions={"rating": 4.5},
+            product_name="Sildenafil 50mg",
+            product_description="Potenzmittel",
+            product_images=["https://shop1.ch/1.jpg"],
+            probability=0.9,
+            classifications={"relevance": 1},
+            is_relevant=1,
+        ),
+        ProductItem(
+            search_term="sildenafil",
+            search_term_type="initial",
+            url="https://shop1.it/sildenafil",
+            marketplace_name="Google",
+            domain="shop1.it",
+            filtered=True,
+            filtered_at_stage="country code filtering",
+        ),
+    ]
+    queue: asyncio.Queue = asyncio.Queue()
+    for product in products + [None]:
+        queue.put_nowait(product)
+
+    # Save the results as csv (c.f. func:`FraudCrawlerClient._collect_results`)
+    filename = tmp_path / "sildenafil_de_ch_20250101000000.csv"
+    client = FraudCrawlerClient.__new__(FraudCrawlerClient)
+    client._results = [Results(search_term="sildenafil", filename=filename)]
+    await client._collect_results(queue_in=queue)
+
+    loaded = FraudCrawlerClient.load_products(filename)
+    assert [p.url for p in loaded] == [p.url for p in products]
+    assert loaded[0].product_name == "Sildenafil 50mg"
+    assert loaded[0].product_images == ["https://shop1.ch/1.jpg"]
+    assert loaded[0].serp_rank == 1
+    assert loaded[0].classifications == {}
+    assert loaded[1].filtered and loaded[1].product_description is None
+
+
+def test_run_journal(tmp_path):
+    journal = RunJournal(run_id="run", directory=tmp_path)
+    assert journal.params is None
+    item = {"search_term": "sildenafil", "num_results": 3}
+    journal.write_params({"search_term": "sildenafil"})
+    journal.write_serp(key=RunJournal.serp_key(item), products=[{"url": "a"}])
+    journal.write_zyte(product={"url": "a", "product_name": "A"})
+    journal.write_classifications(url="a", classifications={"relevance": 1})
+    journal.close()
+
+    # A truncated last line (of a killed run) is ignored
+    with open(journal.filename, "a") as file:
+        file.write('{"event": "proc", "url": "b", "classi')
+
+    journal = RunJournal(run_id="run", directory=tmp_path)
+    assert journal.params == {"search_term": "sildenafil"}
+    assert journal.terms() is None
+    assert journal.serp(RunJournal.serp_key({**item, "start": 0})) == [{"url": "a"}]
+    assert journal.serp(RunJournal.serp_key({**item, "start": 3})) is None
+    assert journal.zyte("a") == {"url": "a", "product_name": "A"}
+    assert journal.classifications("a") == {"relevance": 1}
+    assert journal.classifications("b") is None
+    assert journal.n_replayed == 3
+
+    # Writing after a truncated line starts a new line
+    journal.write_classifications(url="b", classifications={"relevance": 0})
+    journal.close()
+    journal = RunJournal(run_id="run", directory=tmp_path)
+    assert journal.classifications("b") == {"relevance": 0}
+    journal.close(remove=True)
+    assert not journal.filename.exists()
+
+
+@pytest.mark.asyncio
+async def test_orchestrator_resume(tmp_path):
+    kwargs = {
+        "search_term": "sildenafil",
+        "language": Language(name="German"),
+        "location": Location(name="Switzerland"),
+        "deepness": Deepness(num_results=3),
+        "prompts": _PROMPTS,
+    }
+
+    # The Zyte call of one product fails in the interrupted run
+    orc = _Orchestrator()
+    get_details = orc._get_details
+
+    async def failing_get_details(url):
+        if url == "https://shop2.ch/sildenafil":
+            raise RuntimeError("connection lost")
+        return await get_details(url)
+
+    orc._zyteapi.get_details = failing_get_details  # type: ignore[method-assign]
+
+    # The classification of another product fails (returning the fallback)
+    classify = orc._processor.classify
+
+    async def failing_classify(prompt, url, name, description, failed=None):
+        if url == "https://shop1.ch/sildenafil":
+            failed.add(prompt.name)
+            return prompt.default_if_missing
+        return await classify(prompt, url, name, description)
+
+    orc._processor.classify = failing_classify  # type: ignore[method-assign]
+    journal = RunJournal(run_id="run", directory=tmp_path)
+    await orc.run(**kwargs, journal=journal)
+    journal.close()
+    assert len(orc.results) == 7
+
+    # Only the failed work is repeated when resuming
+    orc = _Orchestrator()
+    journal = RunJournal(run_id="run", directory=tmp_path)
+    await orc.run(**kwargs, journal=journal)
+    assert len(orc.results) == 7
+    assert orc.zyte_urls == ["https://shop2.ch/sildenafil"]
+    assert sorted(orc.proc_urls) == [
+        "https://shop1.ch/sildenafil",
+        "https://shop2.ch/sildenafil",
+    ]
+    assert orc.serp_starts == []
+    classified = [p for p in orc.results if not p.filtered]
+    assert all(p.classifications == {"relevance": 1} for p in classified)
+    assert all(p.product_name == p.url for p in classified)
+
+
+def test_manifest(tmp_path):
+    filename = tmp_path / "manifest.jsonl"
+    manifest = ManifestWriter(filename)
+    assert manifest.write({"record_id": "a", "value": 1})
+    assert not manifest.write({"record_id": "a", "value": 2})
+    manifest.close()
+    with open(filename, "a") as file:
+        file.write('{"record_id": "b", "val')
+
+    # Existing records are skipped (a truncated last line is ignored)
+    manifest = ManifestWriter(filename)
+    assert "a" in manifest and "b" not in manifest
+    assert manifest.write({"record_id": "b", "value": 3})
+    manifest.close()
+    assert [r["record_id"] for r in read_records(filename)] == ["a", "b"]
+
+
+def test_manifest_parquet(tmp_path, monkeypatch):
+    filename = tmp_path / "manifest.parquet"
+    manifest = ManifestWriter(filename, json_columns=["classifications"])
+    manifest.write({"record_id": "a", "classifications": {"relevance": 1}})
+    manifest.write({"record_id": "b", "classifications": {}})
+    manifest.close()
+    records = read_records(filename, json_columns=["classifications"])
+    assert records == [
+        {"record_id": "a", "classifications": {"relevance": 1}},
+        {"record_id": "b", "classifications": {}},
+    ]
+
+    # Without pyarrow the Parquet manifests fail with a hint on how to install it
+    monkeypatch.setattr("fraudcrawler.base.manifest.pyarrow", None)
+    with pytest.raises(ImportError, match=r"vianu-fraudcrawler\[parquet\]"):
+        ManifestWriter(filename)
+
+
+@pytest.mark.asyncio
+async def test_orchestrator_stages(tmp_path):
+    orc = _Orchestrator()
+    get_details = orc._get_details
+    failing = {"https://shop2.ch/sildenafil"}
+
+    async def failing_get_details(url):
+        if url in failing:
+            raise RuntimeError("connection lost")
+        return await get_details(url)
+
+    orc._zyteapi.get_details = failing_get_details  # type: ignore[method-assign]
+    await orc.search_stage(
+        output=tmp_path / "search.jsonl",
+        search_term="sildenafil",
+        language=Language(name="German"),
+        location=Location(name="Switzerland"),
+        deepness=Deepness(num_results=3),
+    )
+    searched = orc.read_manifest(tmp_path / "search.jsonl")
+    assert len(searched) == 6  # one record per URL
+    assert len({p.record_id for p in searched}) == 6
+
+    # The failed products are not written and repeated when retrying the stage
+    await orc.zyte_stage(
+        input=tmp_path / "search.jsonl", output=tmp_path / "zyte.jsonl"
+    )
+    assert len(orc.read_manifest(tmp_path / "zyte.jsonl")) == 5
+    failing.clear()
+    orc.zyte_urls.clear()
+    await orc.zyte_stage(
+        input=tmp_path / "search.jsonl", output=tmp_path / "zyte.jsonl"
+    )
+    assert orc.zyte_urls == ["https://shop2.ch/sildenafil"]
+
+    # Neither a failed classification nor an error is written (the other workers go on)
+    classify = orc._processor.classify
+
+    async def failing_classify(prompt, url, name, description, failed=None):
+        if url == "https://shop1.ch/sildenafil":
+            failed.add(prompt.name)
+            return prompt.default_if_missing
+        if url == "https://shop2.ch/sildenafil":
+            raise RuntimeError("classification error")
+        return await classify(prompt, url, name, description)
+
+    orc._processor.classify = failing_classify  # type: ignore[method-assign]
+    await orc.proc_stage(
+        input=tmp_path / "zyte.jsonl", output=tmp_path / "proc.jsonl", prompts=_PROMPTS
+    )
+    assert len(orc.read_manifest(tmp_path / "proc.jsonl")) == 4
+    orc._processor.classify = classify  # type: ignore[method-assign]
+    await orc.proc_stage(
+        input=tmp_path / "zyte.jsonl", output=tmp_path / "proc.jsonl", prompts=_PROMPTS
+    )
+    assert sorted(orc.proc_urls) == [f"https://shop{i}.ch/sildenafil" for i in (1, 2)]
+
+    await orc.collect_stage(input=tmp_path / "proc.jsonl")
+    assert len(orc.results) == 6
+    relevant = sorted(p.url for p in orc.results if p.is_relevant == 1)
+    assert relevant == [f"https://shop{i}.ch/sildenafil" for i in (1, 2)]
+
+
+@pytest.mark.parametrize("kind", ["memory", "sqlite"])
+def test_queue_backend(tmp_path, kind):
+    if kind == "memory":
+        backend = MemoryQueueBackend(visibility_timeout=0.05)
+        index = MemoryDedupIndex()
+    else:
+        backend = SQLiteQueueBackend(tmp_path / "q.sqlite", visibility_timeout=0.05)
+        index = SQLiteDedupIndex(tmp_path / "q.sqlite")
+    backend.put("a", "low", priority=0)
+    backend.put("a", "high", priority=1)
+    backend.put("a", "low2", priority=0)
+    backend.put("b", "other")
+    assert backend.size("a") == 3
+
+    # Highest priority first, FIFO among equal priorities
+    msg_id, payload = backend.get("a")
+    assert payload == "high"
+    backend.ack("a", msg_id)
+    msg_id, payload = backend.get("a")
+    assert payload == "low"
+    backend.nack("a", msg_id)
+    assert backend.get("a")[1] == "low"
+    assert backend.get("a")[1] == "low2"
+    assert backend.get("a") is None and backend.size("a") == 0
+
+    # Unacknowledged messages are delivered again after the visibility timeout
+    assert backend.pending("a") == 2
+    time.sleep(0.1)
+    assert backend.size("a") == 2
+    assert backend.get("b")[1] == "other"
+
+    backend.open("a", producer="node1")
+    backend.open("a", producer="node1")
+    backend.open("a", producer="node2")
+    backend.close("a", producer="node1")
+    assert backend.n_producers("a") == 1 and backend.n_producers("b") == 0
+
+    assert index.add("https://shop.ch/x")
+    assert not index.add("https://shop.ch/x")
+
+
+@pytest.mark.asyncio
+async def test_shared_queue():
+    backend = MemoryQueueBackend()
+    queue = SharedQueue(
+        backend=backend, name="q", producer="node1", encode=str, decode=int
+    )
+    other = SharedQueue(
+        backend=backend, name="q", producer="node2", encode=str, decode=int
+    )
+    queue.put_nowait(1)
+    queue.put_nowait(None)
+    queue.put_nowait(2)
+    assert queue.qsize() == 3
+    await queue.join()  # the writes are done in the background
+    assert backend.n_producers("q") == 1
+
+    # The sentinel is only consumed once the queue is exhausted on all nodes
+    items = []
+    for _ in range(2):
+        items.append(await queue.get())
+        queue.task_done()
+    assert items == [1, 2]
+    with pytest.raises(asyncio.QueueEmpty):
+        queue.get_nowait()
+    other.put_nowait(None)
+    assert await asyncio.wait_for(queue.get(), timeout=1) is None
+    queue.task_done()
+    await asyncio.wait_for(queue.join(), timeout=1)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("kind", ["memory", "sqlite"])
+async def test_shared_queue_leases(tmp_path, kind):
+    if kind == "memory":
+        backend = MemoryQueueBackend(visibility_timeout=0.6)
+    else:
+        backend = SQLiteQueueBackend(tmp_path / "q.sqlite", visibility_timeout=0.6)
+    queue = SharedQueue(
+        backend=backend, name="q", producer="node1", encode=str, decode=int
+    )
+    await queue.put(1)
+    await queue.put(2)
+
+    # The reservation of an item in process is extended beyond the visibility timeout
+    assert await queue.get() == 1
+    await asyncio.sleep(1.0)
+    assert backend.size("q") == 1
+    queue.task_done()
+    await queue.join()
+    assert backend.pending("q") == 1
+
+    # The item of a cancelled worker is released before its reservation expires
+    async def worker():
+        await queue.get()
+        await asyncio.sleep(10)
+
+    task = asyncio.create_task(worker())
+    await asyncio.sleep(0.05)
+    assert backend.size("q") == 0
+    task.cancel()
+    await asyncio.sleep(0.3)
+    assert backend.size("q") == 1
+
+
+@pytest.mark.asyncio
+async def test_orchestrator_shared_queues():
+    backend = MemoryQueueBackend()
+    index = MemoryDedupIndex()
+    nodes = [_Orchestrator(queue_backend=backend, dedup_index=index) for _ in range(2)]
+    n_enrichments = 0
+
+    async def enrich(search_term, **kwargs):
+        nonlocal n_enrichments
+        n_enrichments += 1
+        await asyncio.sleep(0.3)  # the other node waits for the enriched terms
+        return ["viagra", "cialis"]
+
+    for orc in nodes:
+        orc._enricher.apply = enrich  # type: ignore[method-assign]
+    await asyncio.gather(
+        *[
+            orc.run(
+                search_term="sildenafil",
+                language=Language(name="German"),
+                location=Location(name="Switzerland"),
+                deepness=Deepness(
+                    num_results=3,
+                    enrichment=Enrichment(
+                        additional_terms=2, additional_urls_per_term=2
+                    ),
+                ),
+                prompts=_PROMPTS,
+            )
+            for orc in nodes
+        ]
+    )
+
+    # The enrichment, every SERP call, Zyte call and classification is done by exactly one node
+    assert n_enrichments == 1
+    assert sum(len(orc.serp_starts) for orc in nodes) == 3
+    expected = [f"https://shop{i}.ch/sildenafil" for i in range(3)]
+    expected += [
+        f"https://shop{i}.ch/{t}" for t in ["viagra", "cialis"] for i in (0, 1)
+    ]
+    zyte_urls = [url for orc in nodes for url in orc.zyte_urls]
+    assert sorted(zyte_urls) == sorted(expected)
+    proc_urls = [url for orc in nodes for url in orc.proc_urls]
+    assert sorted(proc_urls) == sorted(u for u in expected if "shop0" not in u)
+    results = [p.url for orc in nodes for p in orc.results if not p.filtered]
+    assert sorted(results) == sorted(u for u in expected if "shop0" not in u)
+    assert backend.pending("serp") == backend.pending("zyte") == 0
+    assert backend.pending("proc") == 0
+
+
+@pytest.mark.parametrize("kind", ["memory", "sqlite"])
+def test_rate_budget(tmp_path, kind):
+    rates = {"zyte": 10.0}
+    if kind == "memory":
+        budget = MemoryRateBudget(rates=rates, burst=2)
+    else:
+        budget = SQLiteRateBudget(tmp_path / "q.sqlite", rates=rates, burst=2)
+
+    # The calls are spaced by 1/rate after a burst
+    waits = [budget.reserve("zyte") for _ in range(4)]
+    assert waits[:2] == [0.0, 0.0]
+    assert waits[2] == pytest.approx(0.1, abs=0.02)
+    assert waits[3] == pytest.approx(0.2, abs=0.02)
+
+
+def test_client_merge_shards(tmp_path):
+    shards = []
+    for i in range(3):
+        filename = tmp_path / f"run_shard{i}.csv"
+        if i < 2:
+            pd.DataFrame({"url": [f"https://shop{i}.ch"], "shard": [i]}).to_csv(
+                filename, index=False
+            )
+        else:
+            filename.write_text("\n")  # a shard without products
+        usage = TokenUsage(n_calls=i, prompt_tokens=10 * i)
+        shards.append(
+            Results(
+                search_term="sildenafil",
+                filename=filename,
+                term_mapping={f"term{i}": "term"},
+                n_serp_calls_saved=1,
+                token_usage=usage,
+            )
+        )
+    results = FraudCrawlerClient._merge_shards(
+        search_term="sildenafil", filename=tmp_path / "run.csv", shards=shards
+    )
+    df = pd.read_csv(tmp_path / "run.csv")
+    assert sorted(df["url"]) == ["https://shop0.ch", "https://shop1.ch"]
+    assert not any(s.filename.exists() for s in shards)
+    assert results.n_serp_calls_saved == 3
+    assert len(results.term_mapping) == 3
+    assert results.token_usage.n_calls == 3
+    assert results.token_usage.prompt_tokens == 30
+
+
+def test_client_execute_sharded(tmp_path, monkeypatch):
+    class InlineExecutor:
+        """Runs the shards one after the other (with their arguments pickled like for a process)."""
+
+        def __init__(self, **kwargs):
+            pass
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            return False
+
+        def submit(self, func, **kwargs):
+            future = Future()
+            try:
+                future.set_result(func(**pickle.loads(pickle.dumps(kwargs))))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+    shard_settings = []
+
+    def execute_shard(shard, db, rates, filename, run, settings):
+        SQLiteQueueBackend(db).put("serp", "item")
+        shard_settings.append(settings)
+        if shard == 1:
+            raise RuntimeError("Shard failed")
+
+    monkeypatch.setattr("fraudcrawler.base.client.ProcessPoolExecutor", InlineExecutor)
+    monkeypatch.setattr("fraudcrawler.base.client._execute_shard", execute_shard)
+    monkeypatch.setattr(
+        "fraudcrawler.base.client.SHARD_DEFAULT_DIR", tmp_path / "shards"
+    )
+    cache = DiskCache(tmp_path / "cache.sqlite")
+    cache.set("serp:sildenafil", ["https://shop.ch"])
+    client = FraudCrawlerClient.__new__(FraudCrawlerClient)
+    client._batch = None
+    client._results_dir = tmp_path
+    client._shard_settings = {
+        "cache": cache,
+        "domain_policy": DomainPolicy(min_seen=2),
+        "key_pools": {"zyte": KeyPool(["key1", "key2"], strategy="round_robin")},
+    }
+
+    # The shards get the settings of the client; the shared queue file is removed although a shard failed
+    with pytest.raises(RuntimeError, match="Shard failed"):
+        client.execute_sharded(
+            search_term="sildenafil",
+            language=Language(name="German"),
+            location=Location(name="Switzerland"),
+            deepness=Deepness(num_results=3),
+            prompts=_PROMPTS,
+            n_processes=2,
+        )
+    assert len(shard_settings) == 2
+    settings = shard_settings[0]
+    assert settings["cache"].get("serp:sildenafil").value == ["https://shop.ch"]
+    assert settings["domain_policy"].min_seen == 2
+    assert settings["key_pools"]["zyte"].select() == "key1"
+    assert not list((tmp_path / "shards").glob("*.sqlite*"))
+
+
+@pytest.mark.asyncio
+async def test_fair_scheduler():
+    scheduler = FairScheduler(capacity={"zyte": 1})
+    order = []
+
+    async def call(job_id):
+        async with scheduler.slot(stage="zyte", job_id=job_id):
+            order.append(job_id)
+            await asyncio.sleep(0.01)
+
+    tasks = [asyncio.create_task(call("big")) for _ in range(4)]
+    await asyncio.sleep(0)
+    tasks.append(asyncio.create_task(call("small")))
+    await asyncio.sleep(0)
+    assert scheduler.n_waiting("zyte") == 4
+
+    # The small job does not wait for all calls of the big one
+    await asyncio.gather(*tasks)
+    assert order == ["big", "big", "small", "big", "big"]
+
+    # Cancelled waiters do not leak their slot
+    tasks = [asyncio.create_task(call("big")) for _ in range(3)]
+    await asyncio.sleep(0)
+    tasks[1].cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    assert scheduler.n_waiting("zyte") == 0
+    await asyncio.wait_for(call("small"), timeout=1)
+
+
+@pytest.mark.asyncio
+async def test_service(monkeypatch):
+    async def classify(self, prompt, url, name, description, failed=None):
+        return 1
+
+    monkeypatch.setattr(Processor, "classify", classify)
+    stub = _Orchestrator()
+    service = CrawlerService()
+    service.serpapi.apply = stub._serp_apply  # type: ignore[method-assign]
+    service.zyteapi.get_details = stub._get_details  # type: ignore[method-assign]
+
+    client = TestClient(TestServer(service.app()))
+    await client.start_server()
+    try:
+        payload = {
+            "search_term": "sildenafil",
+            "language": {"name": "German"},
+            "location": {"name": "Switzerland"},
+            "deepness": {"num_results": 3},
+            "prompts": [p.model_dump() for p in _PROMPTS],
+        }
+        resp = await client.post("/jobs", json=payload)
+        assert resp.status == 201
+        job = await resp.json()
+
+        # The results are streamed until the job is finished
+        resp = await client.get(f"/jobs/{job['id']}/results")
+        products = [json.loads(ln) for ln in (await resp.text()).splitlines()]
+        assert len(products) == 7
+        relevant = sorted(p["url"] for p in products if p["is_relevant"] == 1)
+        assert relevant == [f"https://shop{i}.ch/sildenafil" for i in (1, 2)]
+
+        resp = await client.get(f"/jobs/{job['id']}")
+        status = await resp.json()
+        assert status["status"] == "completed"
+        assert (status["n_products"], status["n_relevant"]) == (7, 2)
+
+        # A cancelled job stops its workers and ends its stream
+        async def hanging_get_details(url):
+            await asyncio.sleep(60)
+
+        service.zyteapi.get_details = hanging_get_details  # type: ignore[method-assign]
+        resp = await client.post("/jobs", json={**payload, "search_term": "viagra"})
+        job = await resp.json()
+        await asyncio.sleep(0.1)
+        resp = await client.delete(f"/jobs/{job['id']}")
+        assert resp.status == 200
+        resp = await asyncio.wait_for(
+            client.get(f"/jobs/{job['id']}/results"), timeout=1
+        )
+        await resp.text()
+        assert service.job(job["id"]).status == "cancelled"
+
+        resp = await client.post("/jobs", json={"search_term": "sildenafil"})
+        assert resp.status == 400
+        resp = await client.get("/jobs/unknown")
+        assert resp.status == 404
+        resp = await client.get("/jobs/unknown/results")
+        assert resp.status == 404
+
+        # Finished jobs are evicted after their TTL
+        service._job_ttl = 0
+        await asyncio.sleep(0.01)
+        assert service.jobs() == []
+    finally:
+        await client.close()
@@ -1,8 +1,32 @@
+import asyncio
+import math
+
+import pandas as pd
 import pytest
 
-from fraudcrawler.settings import PROCESSOR_DEFAULT_MODEL
+from fraudcrawler.settings import (
+    PROCESSOR_DEFAULT_MODEL,
+    PROCESSOR_SKIPPED,
+    TOKENS_APPROX_CHARS_PER_TOKEN,
+)
 from fraudcrawler.base.base import Setup
-from fraudcrawler import Processor, Prompt
+from fraudcrawler.base.cache import MemoryCache
+from fraudcrawler.processing.batch import BatchClassifier, LocalBatchBackend
+from fraudcrawler.processing.local import (
+    LocalClassifier,
+    LocalClassifierTier,
+    train_local_classifier,
+    train_local_classifiers,
+)
+from fraudcrawler.processing.processor import Cascade
+from fraudcrawler.processing import tokens
+from fraudcrawler.processing.tokens import (
+    clean_text,
+    compress_text,
+    count_tokens,
+    truncate_tokens,
+)
+from fraudcrawler import KeywordSnippetFilter, LLMSnippetFilter, Processor, Prompt
 
 
 @pytest.fixture
@@ -35,3 +59,496 @@ async def test_processor_classify_product(processor):
     assert (
         classification in allowed_classes or classification == prompt.default_if_missing
     )
+
+
+@pytest.mark.asyncio
+async def test_processor_coalesced_classify(processor, monkeypatch):
+    calls = []
+
+    async def call_openai_api(system_prompt, user_prompt, **kwargs):
+        calls.append(user_prompt)
+        await asyncio.sleep(0.01)
+        return "1"
+
+    monkeypatch.setattr(processor, "_call_openai_api", call_openai_api)
+    prompt = Prompt(
+        name="test_prompt",
+        context="We are interested in medical products",
+        system_prompt="You are a specialist for medical products.",
+        allowed_classes=[0, 1],
+    )
+    kwargs = {"prompt": prompt, "url": "https://example.com", "name": "sildenafil"}
+    classifications = await asyncio.gather(
+        processor.classify(description="buy sildenafil online", **kwargs),
+        processor.classify(description="buy sildenafil online", **kwargs),
+        processor.classify(description="sildenafil 50mg", **kwargs),
+    )
+    assert classifications == [1, 1, 1]
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_keyword_snippet_filter():
+    snippet_filter = KeywordSnippetFilter(
+        exclude=["Beipackzettel", "forum"], require=["kaufen", "bestellen"]
+    )
+    url = "https://example.ch"
+    assert await snippet_filter.keep(
+        url=url, title="Sildenafil kaufen", snippet="Günstig online"
+    )
+    assert not await snippet_filter.keep(
+        url=url, title="Sildenafil kaufen", snippet="Der Beipackzettel"
+    )
+    assert not await snippet_filter.keep(
+        url=url, title="Sildenafil", snippet="Wirkung und Nebenwirkungen"
+    )
+    # Keywords match whole words only
+    assert await snippet_filter.keep(
+        url=url, title="Sildenafil bestellen", snippet="forumstrasse 1"
+    )
+    # Results without metadata are kept
+    assert await snippet_filter.keep(url=url, title=None, snippet=None)
+
+
+@pytest.mark.asyncio
+async def test_llm_snippet_filter(monkeypatch):
+    prompt = Prompt(
+        name="snippet",
+        context="We are interested in online shops selling medical products",
+        system_prompt="Classify whether the search result is a shop (1) or not (0).",
+        allowed_classes=[0, 1],
+    )
+    snippet_filter = LLMSnippetFilter(api_key="x", prompt=prompt)
+    answers = {"Shop": "1", "News": "0", "Broken": "x"}
+
+    async def call_openai_api(system_prompt, user_prompt, **kwargs):
+        return next(a for t, a in answers.items() if t in user_prompt)
+
+    monkeypatch.setattr(snippet_filter._processor, "_call_openai_api", call_openai_api)
+    url = "https://example.ch"
+    assert await snippet_filter.keep(url=url, title="Shop", snippet="sildenafil")
+    assert not await snippet_filter.keep(url=url, title="News", snippet="sildenafil")
+    # Failed classifications keep the result
+    assert await snippet_filter.keep(url=url, title="Broken", snippet="sildenafil")
+
+
+def _labeled_products(n=40):
+    texts, labels = [], []
+    for i in range(n):
+        if i % 2:
+            texts.append(f"https://shop{i}.ch\nSildenafil 50mg kaufen\nJetzt bestellen")
+            labels.append(1)
+        else:
+            texts.append(f"https://news{i}.ch\nStudie zu Nebenwirkungen\nBericht")
+            labels.append(0)
+    return texts, labels
+
+
+def test_local_classifier(tmp_path):
+    texts, labels = _labeled_products()
+    clf, evaluation = train_local_classifier(
+        texts=texts, labels=labels, classes=[0, 1], prompt_name="relevance"
+    )
+    assert evaluation.n_test == 8
+    assert evaluation.accuracy == 1.0
+    assert evaluation.avoided_calls > 0.5
+
+    # Stored classifiers predict the same
+    clf.save(tmp_path / "relevance.npz")
+    tier = LocalClassifierTier.load(tmp_path, threshold=0.5)
+    assert LocalClassifier.load(tmp_path / "relevance.npz").predict(texts[:2]) == (
+        clf.predict(texts[:2])
+    )
+    kwargs = {"url": "https://shop.ch", "name": "Sildenafil kaufen"}
+    assert tier.classify(prompt_name="relevance", description="", **kwargs) == 1
+    assert tier.classify(prompt_name="other", description="", **kwargs) is None
+
+
+def test_train_local_classifiers(tmp_path):
+    texts, labels = _labeled_products()
+    urls, names, descriptions = zip(*[t.split("\n") for t in texts])
+    filename = tmp_path / "results.csv"
+    pd.DataFrame(
+        {
+            "url": urls,
+            "product_name": names,
+            "product_description": descriptions,
+            "relevance": labels,
+        }
+    ).to_csv(filename, index=False)
+    evaluations = train_local_classifiers(
+        classes={"relevance": [0, 1], "seriousness": [0, 1]},
+        filenames=[filename],
+        directory=tmp_path / "models",
+    )
+    assert [evl.prompt for evl in evaluations] == ["relevance"]
+    assert (tmp_path / "models" / "relevance.npz").exists()
+
+
+@pytest.mark.asyncio
+async def test_processor_local_tier(processor, monkeypatch):
+    calls = []
+
+    async def call_openai_api(system_prompt, user_prompt, **kwargs):
+        calls.append(user_prompt)
+        return "0"
+
+    monkeypatch.setattr(processor, "_call_openai_api", call_openai_api)
+    texts, labels = _labeled_products()
+    clf = LocalClassifier(classes=[0, 1]).fit(texts=texts, labels=labels)
+    processor._local_tier = LocalClassifierTier(
+        classifiers={"relevance": clf}, threshold=0.8
+    )
+    prompt = Prompt(
+        name="relevance",
+        context="We are interested in medical products",
+        system_prompt="You are a specialist for medical products.",
+        allowed_classes=[0, 1],
+    )
+
+    # Confident products are classified locally, uncertain ones by the LLM
+    kwargs = {"prompt": prompt, "url": "https://shop1.ch"}
+    assert await processor.classify(
+        name="Sildenafil 50mg kaufen", description="Jetzt bestellen", **kwargs
+    )
+    assert not calls
+    assert await processor.classify(name="Kühlschrank", description="", **kwargs) == 0
+    assert len(calls) == 1
+    assert (processor._local_tier.n_accepted, processor._local_tier.n_escalated) == (
+        1,
+        1,
+    )
+    assert (processor.usage.n_local, processor.usage.n_local_escalated) == (1, 1)
+
+    # Prompts without a local classifier do not count as escalated
+    other = prompt.model_copy(update={"name": "seriousness"})
+    await processor.classify(prompt=other, name="Kühlschrank", description="", url="")
+    assert len(calls) == 2
+    assert (processor.usage.n_local, processor.usage.n_local_escalated) == (1, 1)
+
+
+@pytest.mark.asyncio
+async def test_processor_cascade(processor, monkeypatch):
+    main_calls = []
+    cheap_calls = []
+    answers = {"sure": ("1", 0.99), "unsure": ("0", 0.6)}
+
+    async def call_openai_api(system_prompt, user_prompt, **kwargs):
+        main_calls.append(user_prompt)
+        return "1"
+
+    async def call_openai_api_with_confidence(
+        model, system_prompt, user_prompt, **kwargs
+    ):
+        cheap_calls.append(kwargs["logit_bias"])
+        content, proba = next(a for k, a in answers.items() if f"\n{k}" in user_prompt)
+        return content, proba, (100, 1)
+
+    monkeypatch.setattr(processor, "_call_openai_api", call_openai_api)
+    monkeypatch.setattr(
+        processor, "_call_openai_api_with_confidence", call_openai_api_with_confidence
+    )
+    processor._cascade = Cascade(model="gpt-4o-mini", threshold=0.9)
+    prompt = Prompt(
+        name="relevance",
+        context="We are interested in medical products",
+        system_prompt="You are a specialist for medical products.",
+        allowed_classes=[0, 1],
+    )
+    kwargs = {"prompt": prompt, "url": "https://example.com", "name": "sildenafil"}
+    assert await processor.classify(description="sure", **kwargs) == 1
+    assert not main_calls
+    assert await processor.classify(description="unsure", **kwargs) == 1
+    assert len(main_calls) == 1
+
+    # The output is restricted to the digit tokens of the allowed classes
+    assert cheap_calls[0] == {"15": 100, "16": 100}
+
+    stats = processor.cascade_stats
+    assert (stats.n_cheap, stats.n_escalated, stats.n_main) == (2, 1, 1)
+    assert stats.escalation_rate == 0.5
+    assert stats.latency_saved is not None
+    assert stats.cost_saved > 0
+
+
+def test_processor_logit_bias():
+    assert Processor._logit_bias([0, 1, 2]) == {"15": 100, "16": 100, "17": 100}
+    assert Processor._logit_bias([-1, 1]) is None
+    assert Processor._logit_bias([0, 10]) is None
+
+
+def _prompt(name, **kwargs):
+    return Prompt(
+        name=name,
+        context="context",
+        system_prompt="system prompt",
+        allowed_classes=[0, 1],
+        **kwargs,
+    )
+
+
+def test_processor_order_prompts():
+    prompts = [
+        _prompt("seriousness", run_if={"relevance": [1]}),
+        _prompt("relevance"),
+        _prompt("price", depends_on=["seriousness"]),
+        _prompt("language"),
+    ]
+    levels = Processor.order_prompts(prompts)
+    assert [[p.name for p in lvl] for lvl in levels] == [
+        ["relevance", "language"],
+        ["seriousness"],
+        ["price"],
+    ]
+
+    with pytest.raises(ValueError, match="unknown"):
+        Processor.order_prompts([_prompt("a", depends_on=["b"])])
+    with pytest.raises(ValueError, match="Cyclic"):
+        Processor.order_prompts(
+            [_prompt("a", depends_on=["b"]), _prompt("b", run_if={"a": [1]})]
+        )
+
+
+@pytest.mark.asyncio
+async def test_processor_classify_all(processor, monkeypatch):
+    calls = []
+
+    async def classify(prompt, url, name, description, failed=None):
+        calls.append((prompt.name, name))
+        await asyncio.sleep(0.01)
+        return int(name == "relevant")
+
+    monkeypatch.setattr(processor, "classify", classify)
+    prompts = [
+        _prompt("relevance"),
+        _prompt("language"),
+        _prompt("seriousness", run_if={"relevance": [1]}),
+        _prompt("price", run_if={"seriousness": [1]}),
+    ]
+    kwargs = {"prompts": prompts, "url": "https://example.com", "description": "d"}
+    assert await processor.classify_all(name="relevant", **kwargs) == {
+        "relevance": 1,
+        "language": 1,
+        "seriousness": 1,
+        "price": 1,
+    }
+
+    # Gated prompts (and the prompts gated on them) are skipped
+    calls.clear()
+    assert await processor.classify_all(name="other", **kwargs) == {
+        "relevance": 0,
+        "language": 0,
+        "seriousness": PROCESSOR_SKIPPED,
+        "price": PROCESSOR_SKIPPED,
+    }
+    assert sorted(calls) == [("language", "other"), ("relevance", "other")]
+
+
+@pytest.mark.asyncio
+async def test_batch_classifier(processor, tmp_path):
+    def answer(body):
+        user_prompt = body["messages"][1]["content"]
+        return "1" if "sildenafil" in user_prompt else "0"
+
+    backend = LocalBatchBackend(answer=answer, n_polls=2)
+    batch = BatchClassifier(
+        backend=backend, directory=tmp_path, poll_interval=0, max_requests=2
+    )
+    prompts = [_prompt("relevance"), _prompt("seriousness", run_if={"relevance": [1]})]
+    records = {
+        "a": ("https://a.ch", "sildenafil", "Potenzmittel"),
+        "b": ("https://b.ch", "ibuprofen", "Schmerzmittel"),
+        "c": ("https://c.ch", "sildenafil", None),
+    }
+    classifications = await batch.classify_all(
+        processor=processor, prompts=prompts, records=records
+    )
+    assert classifications == {
+        "a": {"relevance": 1, "seriousness": 1},
+        "b": {"relevance": 0, "seriousness": PROCESSOR_SKIPPED},
+        "c": {"relevance": -1, "seriousness": PROCESSOR_SKIPPED},
+    }
+
+    # One batch file per level (and chunk of max_requests), matched by custom ID
+    filenames = sorted(f.name for f in tmp_path.glob("*.jsonl"))
+    assert [f.split("_", 1)[1] for f in filenames] == [
+        "level0_0.jsonl",
+        "level1_0.jsonl",
+    ]
+    assert processor.usage.completion_tokens == 3
+
+
+@pytest.mark.asyncio
+async def test_batch_classifier_local_tier_and_cache(tmp_path):
+    processor = Processor(api_key="x", model="gpt-4o", cache=MemoryCache())
+    texts, labels = _labeled_products()
+    clf = LocalClassifier(classes=[0, 1]).fit(texts=texts, labels=labels)
+    processor._local_tier = LocalClassifierTier(
+        classifiers={"relevance": clf}, threshold=0.8
+    )
+    requests = []
+
+    def answer(body):
+        requests.append(body["messages"][1]["content"])
+        return "0"
+
+    batch = BatchClassifier(
+        backend=LocalBatchBackend(answer=answer), directory=tmp_path, poll_interval=0
+    )
+    prompts = [_prompt("relevance")]
+    records = {
+        "a": ("https://shop1.ch", "Sildenafil 50mg kaufen", "Jetzt bestellen"),
+        "b": ("https://shop1.ch", "Kühlschrank", ""),
+    }
+    expected = {"a": {"relevance": 1}, "b": {"relevance": 0}}
+
+    # Confident products are classified locally, only the others are sent in the batch
+    assert (
+        await batch.classify_all(processor=processor, prompts=prompts, records=records)
+        == expected
+    )
+    assert len(requests) == 1
+    assert (processor.usage.n_local, processor.usage.n_local_escalated) == (1, 1)
+
+    # The batch answers are cached
+    assert (
+        await batch.classify_all(processor=processor, prompts=prompts, records=records)
+        == expected
+    )
+    assert len(requests) == 1
+
+
+def test_processor_parse_batch_response(processor):
+    prompt = _prompt("relevance", default_if_missing=-1)
+    body = {"choices": [{"message": {"content": "1"}}]}
+    assert (
+        processor.parse_batch_response(
+            prompt=prompt, response={"response": {"status_code": 200, "body": body}}
+        )
+        == 1
+    )
+
+    body = {"choices": [{"message": {"content": "7"}}]}
+    assert (
+        processor.parse_batch_response(
+            prompt=prompt, response={"response": {"status_code": 200, "body": body}}
+        )
+        == -1
+    )
+    error = {"code": "rate_limit_exceeded", "message": "..."}
+    assert (
+        processor.parse_batch_response(
+            prompt=prompt, response={"response": None, "error": error}
+        )
+        == -1
+    )
+    failed: set = set()
+    assert (
+        processor.parse_batch_response(prompt=prompt, response=None, failed=failed)
+        == -1
+    )
+    assert failed == {"relevance"}
+
+
+@pytest.mark.asyncio
+async def test_processor_cache(monkeypatch):
+    processor = Processor(api_key="x", model="gpt-4o", cache=MemoryCache())
+    calls = []
+
+    async def classify(prompt, url, name, description):
+        calls.append(name)
+        return 1 if name == "sildenafil" else -1
+
+    monkeypatch.setattr(processor, "_classify", classify)
+    prompt = _prompt("relevance")
+    kwargs = {"prompt": prompt, "url": "https://example.com", "description": "d"}
+    assert await processor.classify(name="sildenafil", **kwargs) == 1
+    assert await processor.classify(name="sildenafil", **kwargs) == 1
+    assert calls == ["sildenafil"]
+
+    # Failed classifications are not cached, other prompts are cached separately
+    failed: set = set()
+    assert await processor.classify(name="error", failed=failed, **kwargs) == -1
+    assert await processor.classify(name="error", **kwargs) == -1
+    assert failed == {"relevance"}
+    kwargs["prompt"] = _prompt("seriousness")
+    assert await processor.classify(name="sildenafil", **kwargs) == 1
+    assert calls == ["sildenafil", "error", "error", "sildenafil"]
+
+
+def test_clean_text():
+    text = (
+        "<div><script>var x = 1;</script><p>Sildenafil&nbsp;50mg   Filmtabletten</p>"
+        "<p>Versandkostenfrei</p>\n\n<p>Versandkostenfrei</p></div>"
+    )
+    assert clean_text(text) == "Sildenafil\xa050mg Filmtabletten\nVersandkostenfrei"
+
+
+def test_compress_text():
+    model = PROCESSOR_DEFAULT_MODEL
+    boilerplate = "Es gelten unsere allgemeinen Geschäftsbedingungen. " * 30
+    text = (
+        "Sildenafil 50mg Filmtabletten zur Behandlung der erektilen Dysfunktion. "
+        + boilerplate
+        + "Packung mit 12 Tabletten, rezeptfrei bestellbar."
+    )
+    compressed = compress_text(text, max_tokens=40, model=model, query="Sildenafil")
+    assert count_tokens(compressed, model=model) <= 40
+    assert compressed.startswith("Sildenafil 50mg Filmtabletten")
+    assert "Packung mit 12 Tabletten" in compressed
+
+    # Texts within the budget are kept as they are
+    assert compress_text("kurz", max_tokens=40, model=model) == "kurz"
+
+
+def test_count_tokens_tiktoken(monkeypatch):
+    tiktoken = pytest.importorskip("tiktoken")
+
+    # A byte-level encoding (one token per byte) instead of the downloaded encoding of the model
+    encoding = tiktoken.Encoding(
+        name="bytes",
+        pat_str=r"\S+|\s+",
+        mergeable_ranks={bytes([i]): i for i in range(256)},
+        special_tokens={},
+    )
+    monkeypatch.setattr(tiktoken, "encoding_for_model", lambda model: encoding)
+    monkeypatch.setattr(tokens, "_encodings", {})
+    assert count_tokens("Sildenafil 50mg", model="gpt-4o") == 15
+    assert truncate_tokens("Sildenafil 50mg", max_tokens=10, model="gpt-4o") == (
+        "Sildenafil"
+    )
+
+    # If the encoding cannot be loaded (e.g. without internet access) the tokens are approximated
+    def encoding_for_model(model):
+        raise ConnectionError("offline")
+
+    monkeypatch.setattr(tiktoken, "encoding_for_model", encoding_for_model)
+    monkeypatch.setattr(tokens, "_encodings", {})
+    assert count_tokens("Sildenafil 50mg", model="gpt-4o") == math.ceil(
+        15 / TOKENS_APPROX_CHARS_PER_TOKEN
+    )
+
+
+@pytest.mark.asyncio
+async def test_processor_token_budget(processor, monkeypatch):
+    prompts = []
+
+    async def call_openai_api(system_prompt, user_prompt, **kwargs):
+        prompts.append(user_prompt)
+        return "1"
+
+    monkeypatch.setattr(processor, "_call_openai_api", call_openai_api)
+    prompt = _prompt("relevance", max_description_tokens=50)
+    reviews = "".join(f"<p>Bewertung Nr. {i}: gut.</p>" for i in range(200))
+    description = "<p>Sildenafil 50mg kaufen.</p>" + reviews
+    await processor.classify(
+        prompt=prompt,
+        url="https://example.com",
+        name="Sildenafil",
+        description=description,
+    )
+    assert "<p>" not in prompts[0]
+    assert "Sildenafil 50mg kaufen." in prompts[0]
+    assert len(prompts[0]) < len(description) / 10
+    assert processor.usage.n_compressed == 1
+    assert processor.usage.tokens_removed > 0
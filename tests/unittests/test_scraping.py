@@ -1,9 +1,19 @@
+import asyncio
+import time
+
+import aiohttp
 import pytest
 
 from fraudcrawler.base.base import Setup, Host, Location, Language
+from fraudcrawler.base.cache import CacheEntry, MemoryCache
 from fraudcrawler.scraping.serp import SerpResult
 from fraudcrawler import SerpApi, Enricher, ZyteApi
 from fraudcrawler.scraping.enrich import Keyword
+from fraudcrawler.scraping.terms import (
+    TermDeduplicator,
+    normalize_term,
+    term_signature,
+)
 
 
 @pytest.fixture
@@ -36,15 +46,50 @@ async def test_serpapi_search(serpapi):
     language = Language(name="German")
     location = Location(name="Switzerland")
     num_results = 5
-    urls = await serpapi._search(
+    organic = await serpapi._search(
         search_string=search_string,
         language=language,
         location=location,
         num_results=num_results,
     )
-    assert 0 < len(urls) <= num_results
-    assert all(isinstance(url, str) for url in urls)
-    assert all(url.startswith("http") for url in urls)
+    assert 0 < len(organic) <= num_results
+    assert all(isinstance(res["link"], str) for res in organic)
+    assert all(res["link"].startswith("http") for res in organic)
+    assert all("title" in res and "snippet" in res for res in organic)
+
+
+@pytest.mark.asyncio
+async def test_serpapi_cached_search(serpapi, monkeypatch):
+    fetched = []
+
+    async def fetch(search_string, language, location, num_results, start=0):
+        fetched.append(search_string)
+        return [{"link": f"https://example.ch/{len(fetched)}"}]
+
+    monkeypatch.setattr(serpapi, "_fetch", fetch)
+    serpapi._cache = MemoryCache()
+    kwargs = {
+        "search_string": "sildenafil",
+        "language": Language(name="German"),
+        "location": Location(name="Switzerland"),
+        "num_results": 5,
+    }
+
+    # Fresh results are served from the cache
+    assert await serpapi._search(**kwargs) == [{"link": "https://example.ch/1"}]
+    assert await serpapi._search(**kwargs) == [{"link": "https://example.ch/1"}]
+    assert len(fetched) == 1
+
+    # Stale results are served while being refreshed
+    key = next(iter(serpapi._cache._entries))
+    serpapi._cache._entries[key] = CacheEntry(
+        value=[{"link": "https://example.ch/1"}],
+        created_at=time.time() - serpapi._cache_ttl - 1,
+    )
+    assert await serpapi._search(**kwargs) == [{"link": "https://example.ch/1"}]
+    await asyncio.gather(*serpapi._refresh_tasks)
+    assert len(fetched) == 2
+    assert await serpapi._search(**kwargs) == [{"link": "https://example.ch/2"}]
 
 
 def test_serpapi_keep_url(serpapi):
@@ -91,6 +136,77 @@ def test_serpapi_create_serp_result(serpapi):
     assert serp_result.marketplace_name == serpapi._default_marketplace_name
 
 
+def test_serpapi_get_search_strings(serpapi):
+    search_term = "sildenafil"
+    assert serpapi._get_search_strings(search_term=search_term, marketplaces=None) == [
+        search_term
+    ]
+
+    marketplaces = [
+        Host(name="Ricardo", domains="ricardo.ch"),
+        Host(name="Galaxus", domains="galaxus.ch, digitec.ch, ricardo.ch"),
+    ]
+    search_strings = serpapi._get_search_strings(
+        search_term=search_term, marketplaces=marketplaces, max_words=4
+    )
+    assert search_strings == [
+        "sildenafil site:ricardo.ch OR site:galaxus.ch",
+        "sildenafil site:digitec.ch",
+    ]
+
+    search_strings = serpapi._get_search_strings(
+        search_term=search_term, marketplaces=marketplaces
+    )
+    assert search_strings == [
+        "sildenafil site:ricardo.ch OR site:galaxus.ch OR site:digitec.ch"
+    ]
+
+
+def test_serpapi_interleave_results(serpapi):
+    urls_per_shard = [
+        ["https://a.ch/1", "https://a.ch/2", "https://a.ch/3"],
+        ["https://b.ch/1", "https://a.ch/1"],
+    ]
+    results_per_shard = [[{"link": url} for url in shrd] for shrd in urls_per_shard]
+    results = serpapi._interleave_results(
+        results_per_shard=results_per_shard, num_results=10
+    )
+    assert [res["link"] for res in results] == [
+        "https://a.ch/1",
+        "https://b.ch/1",
+        "https://a.ch/2",
+        "https://a.ch/3",
+    ]
+
+    results = serpapi._interleave_results(
+        results_per_shard=results_per_shard, num_results=2
+    )
+    assert [res["link"] for res in results] == ["https://a.ch/1", "https://b.ch/1"]
+
+
+def test_serpapi_parse_organic_result(serpapi):
+    result = {
+        "position": 3,
+        "title": "Sildenafil 50mg kaufen",
+        "link": "https://shop.ch/sildenafil",
+        "snippet": "Sildenafil rezeptfrei bestellen",
+        "rich_snippet": {
+            "bottom": {
+                "detected_extensions": {"price": 29.9, "currency": "CHF"},
+                "extensions": ["CHF 29.90", "Auf Lager"],
+            }
+        },
+        "favicon": "https://shop.ch/favicon.ico",
+    }
+    assert serpapi._parse_organic_result(result) == {
+        "link": "https://shop.ch/sildenafil",
+        "position": 3,
+        "title": "Sildenafil 50mg kaufen",
+        "snippet": "Sildenafil rezeptfrei bestellen",
+        "extensions": {"price": 29.9, "currency": "CHF"},
+    }
+
+
 @pytest.mark.asyncio
 async def test_serpapi_apply_marketplaces(serpapi):
     search_term = "sildenafil"
@@ -176,6 +292,167 @@ async def test_enricher_apply(enricher):
     assert all(isinstance(t, str) for t in terms)
 
 
+def test_enricher_align_tasks(enricher):
+    requested = [{"keyword": "a"}, {"keyword": "b"}]
+    received = [
+        {"data": {"keyword": "b"}, "id": 1},
+        {"data": {"keyword": "a"}, "id": 0},
+    ]
+    aligned = enricher._align_tasks(requested=requested, received=received)
+    assert [t["id"] for t in aligned] == [0, 1]
+
+    aligned = enricher._align_tasks(requested=requested, received=[{"id": 0}])
+    assert aligned == [{"id": 0}, {}]
+
+
+@pytest.mark.asyncio
+async def test_enricher_batch(enricher, monkeypatch):
+    posts = []
+
+    async def post(url, headers=None, data=None, auth=None):
+        posts.append((url, data))
+        tasks = []
+        for task in data:
+            kw = task["keyword"]
+            if url.endswith(enricher._suggestions_endpoint):
+                items = [
+                    {"keyword": f"{kw} kaufen", "keyword_info": {"search_volume": 10}}
+                ]
+            else:
+                items = [
+                    {
+                        "keyword_data": {
+                            "keyword": kw,
+                            "keyword_info": {"search_volume": 100},
+                        }
+                    },
+                    {
+                        "keyword_data": {
+                            "keyword": f"{kw} preis",
+                            "keyword_info": {"search_volume": 20},
+                        }
+                    },
+                ]
+            tasks.append({"data": task, "result": [{"items": items}]})
+        return {"tasks": list(reversed(tasks))}
+
+    monkeypatch.setattr(enricher, "post", post)
+    monkeypatch.setattr("fraudcrawler.scraping.enrich.ENRICHMENT_MAX_TASKS_PER_POST", 2)
+    terms = await enricher.apply_batch(
+        search_terms=["a", "b", "c", "a"],
+        location=Location(name="Switzerland", code="ch"),
+        language=Language(name="German", code="de"),
+        n_terms=2,
+    )
+    assert terms == {
+        "a": ["a preis", "a kaufen"],
+        "b": ["b preis", "b kaufen"],
+        "c": ["c preis", "c kaufen"],
+    }
+    assert len(posts) == 4  # 2 endpoints x 2 chunks
+
+
+def test_normalize_term():
+    assert normalize_term("Kühlschrank") == "kuehlschrank"
+    assert normalize_term(" KUEHLSCHRANK ") == "kuehlschrank"
+    assert normalize_term("Crème  brûlée") == "creme brulee"
+    assert normalize_term("Kühl-Schrank kaufen!") == "kuehl schrank kaufen"
+    assert normalize_term("Straße") == "strasse"
+
+
+def test_term_signature():
+    signature = term_signature("Bosch Kühlschrank")
+    assert signature == term_signature("Kühlschränke  bosch")
+    assert term_signature("Sildenafil Tabletten") == term_signature(
+        "sildenafil tablette"
+    )
+    assert term_signature("sildenafil") != term_signature("tadalafil")
+
+    # Neither transliterations nor noun endings are collapsed
+    assert term_signature("Poet") != term_signature("Pot")
+    assert term_signature("Drucker") != term_signature("Druck")
+    assert term_signature("Kocher") != term_signature("Koch")
+    assert term_signature("Bauer") != term_signature("Bau")
+
+
+def test_term_deduplicator():
+    dedup = TermDeduplicator()
+    assert dedup.add("Kühlschrank") is True
+    assert dedup.add("kuehlschrank") is False
+    assert dedup.add("Kühlschränke") is False
+    assert dedup.add("Gefrierschrank") is True
+    assert dedup.add("Kühlschrank") is False
+    assert dedup.n_duplicates == 3
+    assert dedup.mapping == {
+        "Kühlschrank": "Kühlschrank",
+        "kuehlschrank": "Kühlschrank",
+        "Kühlschränke": "Kühlschrank",
+        "Gefrierschrank": "Gefrierschrank",
+    }
+
+    # Transliterated spellings match the normalized form, but words do not lose their "e"
+    assert dedup.add("Bosch Kühlschrank") is True
+    assert dedup.add("bosch kuehlschrank") is False
+    assert dedup.add("Kühlschränke Bosch") is False
+    for term in ["Poet", "Pot", "Drucker", "Druck", "Kocher", "Koch", "Bauer", "Bau"]:
+        assert dedup.add(term) is True
+
+
+@pytest.mark.asyncio
+async def test_enricher_expand(enricher, monkeypatch):
+    graph = {
+        "kühlschrank": [
+            ("Kuehlschrank", 500),
+            ("kühlschrank klein", 300),
+            ("gefrierschrank", 200),
+        ],
+        "kühlschrank klein": [("mini kühlschrank", 400), ("Kühlschrank", 1000)],
+        "gefrierschrank": [("tiefkühler", 50)],
+        "mini kühlschrank": [("minibar", 600)],
+    }
+    posted = []
+
+    async def post(url, headers=None, data=None, auth=None):
+        posted.append([task["keyword"] for task in data])
+        tasks = []
+        for task in data:
+            items = []
+            if url.endswith(enricher._suggestions_endpoint):
+                items = [
+                    {"keyword": kw, "keyword_info": {"search_volume": vol}}
+                    for kw, vol in graph.get(task["keyword"], [])
+                ]
+            tasks.append({"data": task, "result": [{"items": items}]})
+        return {"tasks": tasks}
+
+    monkeypatch.setattr(enricher, "post", post)
+    kwargs = {
+        "search_term": "kühlschrank",
+        "location": Location(name="Switzerland", code="ch"),
+        "language": Language(name="German", code="de"),
+        "n_terms": 10,
+    }
+
+    terms = await enricher.expand(max_depth=1, **kwargs)
+    assert terms == ["kühlschrank klein", "gefrierschrank"]
+
+    posted.clear()
+    terms = await enricher.expand(max_depth=3, **kwargs)
+    assert terms == [
+        "minibar",
+        "mini kühlschrank",
+        "kühlschrank klein",
+        "gefrierschrank",
+        "tiefkühler",
+    ]
+    assert len(posted) == 6  # 3 levels x 2 endpoints
+
+    posted.clear()
+    terms = await enricher.expand(max_depth=3, max_calls=4, **kwargs)
+    assert "minibar" not in terms
+    assert len(posted) == 4
+
+
 @pytest.mark.asyncio
 async def test_zyteapi_get_details(zyteapi):
     url = "https://www.altibbi.com/answer/159"
@@ -189,6 +466,64 @@ async def test_zyteapi_get_details(zyteapi):
     assert "metadata" in product["product"]
 
 
+@pytest.mark.asyncio
+async def test_zyteapi_coalesced_details(zyteapi, monkeypatch):
+    posted = []
+
+    async def post(url, headers=None, data=None, auth=None):
+        posted.append(data["url"])
+        await asyncio.sleep(0.01)
+        return {"url": data["url"], "product": {"name": "sildenafil"}}
+
+    monkeypatch.setattr(zyteapi, "post", post)
+    urls = ["https://example.ch/a", "https://example.ch/a", "https://example.ch/b"]
+    details = await asyncio.gather(*[zyteapi.get_details(url=url) for url in urls])
+    assert [d["url"] for d in details] == urls
+    assert posted == ["https://example.ch/a", "https://example.ch/b"]
+
+
+@pytest.mark.asyncio
+async def test_zyteapi_key_pool(monkeypatch):
+    zyteapi = ZyteApi(api_key="revoked, valid", retry_delay=0)
+
+    async def post(url, headers=None, data=None, auth=None):
+        if auth.login == "revoked":
+            raise aiohttp.ClientResponseError(
+                request_info=None,  # type: ignore[arg-type]
+                history=(),
+                status=401,
+            )
+        return {"url": data["url"], "product": {"name": "sildenafil"}}
+
+    monkeypatch.setattr(zyteapi, "post", post)
+    urls = [f"https://example.ch/{i}" for i in range(3)]
+    details = await asyncio.gather(*[zyteapi.get_details(url=url) for url in urls])
+    assert [d["url"] for d in details] == urls
+    assert zyteapi._keys.quarantined() == ["revoked"]
+    assert zyteapi._keys.n_calls == [1, 3]
+
+
+@pytest.mark.asyncio
+async def test_enricher_accounts(monkeypatch):
+    enricher = Enricher(user="a,b", pwd="x,y")
+    used = []
+
+    async def post(url, headers=None, data=None, auth=None):
+        used.append(headers["Authorization"])
+        if headers == Enricher._auth_headers("a", "x"):
+            return {"status_code": 40200, "status_message": "Payment Required."}
+        return {"status_code": 20000, "tasks": [{"data": data[0], "result": []}]}
+
+    monkeypatch.setattr(enricher, "post", post)
+    for _ in range(3):
+        await enricher._post_tasks(endpoint="/", tasks=[{"keyword": "a"}])
+    assert enricher._accounts.quarantined() == [Enricher._auth_headers("a", "x")]
+    assert len(used) == 3 and len(set(used[1:])) == 1
+
+    with pytest.raises(ValueError):
+        Enricher(user="a,b", pwd="x")
+
+
 def test_zyteapi_keep_product(zyteapi):
     details = {
         "url": "http://example.ch",